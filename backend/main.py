@@ -1,19 +1,84 @@
 import os
-import json
+import time
+import mimetypes
+
+import orjson
+
+from urllib.parse import quote
 
 from flask import request
+from flask import Response
 from flask import jsonify
 from flask import render_template
 from flask import send_from_directory
-from flask import abort
 from flask_cors import CORS
 
 from utils.server import Server
+from utils.controller import Controller
+from utils.document_watcher import DocumentWatcher
+
+IMAGE_DETAIL_FIELDS = ["hash", "url", "local_path", "extension", "hidden"]
+DOCUMENT_DETAIL_FIELDS = ["title", "content_preview", "url", "date", "hidden"]
+SEARCH_RESULT_FIELDS = ("id", "score", *Controller.IMAGE_RETURN_FIELDS)
+ALLOWED_MAX_RESULTS = frozenset({4, 8, 16, 32})
+DEFAULT_MAX_RESULTS = 8
+IMAGE_MAX_AGE = 86400  # Images are addressed by content hash
+STATUS_STREAM_KEEPALIVE = 15  # seconds
+STATUS_STREAM_LIFETIME = 300  # seconds before the server closes a status stream
+STATUS_STREAM_RETRY = 3000  # milliseconds before EventSource reconnects
 
 s = Server()
 
 CORS(s.app, origins=["http://localhost:3000", "http://localhost:5173", "http://127.0.0.1:3000", "http://127.0.0.1:5173", "http://localhost", "http://localhost:80"])
 
+def dev_only_route(rule, **options):
+    """Register a route only outside production; in production it is left out of the URL map"""
+    if s.production:
+        return lambda view: view
+    return s.app.route(rule, **options)
+
+
+def model_not_ready_response():
+    """
+    Load the model on demand and return an error response if it cannot serve
+    a search yet, or None when it is ready.
+    """
+    model_status = s.get_cached_model_status()
+    if model_status == 2 and s.mark_model_used():  # ModelStatus.LOADED
+        return None
+    if model_status != 1:  # ModelStatus.LOADING
+        model_status = s.try_load_and_return_status()
+
+    if model_status == 2:  # ModelStatus.LOADED
+        return None
+
+    if model_status == 1:
+        return jsonify(
+            {
+                "status": "model_loading",
+                "message": f"Model '{s.model_alias}' is currently loading",
+                "suggestion": "Please wait and check /api/search/status or retry in a few moments",
+            }
+        ), 202  # Accepted
+
+    return jsonify(
+        {
+            "error": f"Failed to load model '{s.model_alias}'",
+            "suggestion": "Check server logs for details or try POST /api/model/load",
+        }
+    ), 503
+
+
+def search_result_to_dict(doc):
+    """Build the response entry for an image search result"""
+    doc_dict = {}
+    for field in SEARCH_RESULT_FIELDS:
+        value = getattr(doc, field, None)
+        if value is not None:
+            doc_dict[field] = value
+    return doc_dict
+
+
 @s.app.route("/")
 def health():
     return "Backend is running!", 200
@@ -27,57 +92,25 @@ def index():
 def search():
     """Handle image search requests using the default model"""
     try:
-        query = request.json.get("query", "").strip()
-        max_results = request.json.get("max_results", 6)
+        data = request.get_json(silent=True) or {}
+        query = (data.get("query") or "").strip()
+        max_results = data.get("max_results", DEFAULT_MAX_RESULTS)
 
-        if max_results not in [4, 8, 16, 32]:
-            max_results = 8  # Default fallback
+        if not isinstance(max_results, int) or max_results not in ALLOWED_MAX_RESULTS:
+            max_results = DEFAULT_MAX_RESULTS
 
         if not query:
             return jsonify({"error": "Search query is required"}), 400
 
-        model_status = s.controller.get_model_status(s.model_alias)
+        not_ready = model_not_ready_response()
+        if not_ready:
+            return not_ready
 
-        if model_status == 1:
-            return jsonify(
-                {
-                    "status": "model_loading",
-                    "message": f"Model '{s.model_alias}' is currently loading",
-                    "suggestion": "Please wait and check /api/search/status or retry in a few moments",
-                }
-            ), 202
-
-        if not s.ensure_model_loaded():
-            model_status = s.controller.get_model_status(s.model_alias)
-            if model_status == 1:
-                return jsonify(
-                    {
-                        "status": "model_loading",
-                        "message": f"Model '{s.model_alias}' is now loading",
-                        "suggestion": "Please wait and check /api/search/status or retry in a few moments",
-                    }
-                ), 202  # Accepted
-            else:
-                return jsonify(
-                    {
-                        "error": f"Failed to load model '{s.model_alias}'",
-                        "suggestion": "Check server logs for details or try POST /api/model/load",
-                    }
-                ), 503
-
-        results = s.controller.search(s.model_alias, query, top_k=max_results)
+        results = s.search_batcher.search(query, top_k=max_results)
 
         if results and hasattr(results, "docs"):
-            search_results = []
-            for doc in results.docs:
-                if hasattr(doc, "hidden") and getattr(doc, "hidden", "false") == "true":
-                    continue
-
-                doc_dict = {}
-                for key, value in doc.__dict__.items():
-                    if key != "payload":  # Skip payload as it might contain binary data
-                        doc_dict[key] = value
-                search_results.append(doc_dict)
+            # Hidden images are already excluded by the KNN pre-filter
+            search_results = [search_result_to_dict(doc) for doc in results.docs]
 
             return jsonify(
                 {
@@ -98,6 +131,15 @@ def search():
                 }
             )
 
+    except TimeoutError as e:
+        s.server_log(f"[ERROR] Search timed out: {e}")
+        return jsonify(
+            {
+                "error": str(e),
+                "suggestion": "The search service is busy or reloading the model, retry in a few moments",
+            }
+        ), 503
+
     except Exception as e:
         s.server_log(f"[ERROR] Search failed: {e}")
         return jsonify({"error": str(e)}), 500
@@ -107,73 +149,53 @@ def search():
 def search_complex():
     """Handle hybrid search requests with fallback to image search"""
     try:
-        query = request.json.get("query", "").strip()
-        max_results = request.json.get("max_results", 6)
-        hybrid_function = request.json.get("hybrid_function", 1)
+        data = request.get_json(silent=True) or {}
+        query = (data.get("query") or "").strip()
+        max_results = data.get("max_results", DEFAULT_MAX_RESULTS)
+        hybrid_function = data.get("hybrid_function", 1)
 
-        if max_results not in [4, 8, 16, 32]:
-            max_results = 8  # Default fallback
+        if not isinstance(max_results, int) or max_results not in ALLOWED_MAX_RESULTS:
+            max_results = DEFAULT_MAX_RESULTS
 
         if not query:
             return jsonify({"error": "Search query is required"}), 400
 
-        model_status = s.controller.get_model_status(s.model_alias)
-
-        if model_status == 1:  # ModelStatus.LOADING
-            return jsonify(
-                {
-                    "status": "model_loading",
-                    "message": f"Model '{s.model_alias}' is currently loading",
-                    "suggestion": "Please wait and check /api/search/status or retry in a few moments",
-                }
-            ), 202
-
-        if not s.ensure_model_loaded():
-            model_status = s.controller.get_model_status(s.model_alias)
-            if model_status == 1:
-                return jsonify(
-                    {
-                        "status": "model_loading",
-                        "message": f"Model '{s.model_alias}' is now loading",
-                        "suggestion": "Please wait and check /api/search/status or retry in a few moments",
-                    }
-                ), 202
-            else:
-                return jsonify(
-                    {
-                        "error": f"Failed to load model '{s.model_alias}'",
-                    }
-                ), 503
+        not_ready = model_not_ready_response()
+        if not_ready:
+            return not_ready
 
         hybrid_error = None
 
         # Try hybrid search first
         try:
             results = s.controller.search_complex(
-                s.model_alias, query, top_k=max_results, function_option=hybrid_function
+                s.model_alias,
+                query,
+                top_k=max_results,
+                function_option=hybrid_function,
             )
 
             if len(results) > 0:
+                candidates = [result for result in results if result.get("hash")]
+
+                pipe = s.rc.text_pipeline()
+                for result in candidates:
+                    pipe.hmget(f"image:{result['hash']}", "hash", "hidden")
+                image_fields = pipe.execute()
+
                 search_results = []
-                for result in results:
-                    hash_value = result.get("hash", "")
-                    if hash_value:
-                        image_data = s.rc.hgetall(f"image:{hash_value}")
-                        if image_data:
-                            search_result = s.rc.decode_object(image_data)
-
-                            if search_result.get("hidden", "false") == "true":
-                                continue
-
-                            # Add score information from hybrid search
-                            search_result["score"] = result.get("final_score", 0.0)
-                            search_results.append(
-                                {
-                                    "id": f"image:{search_result['hash']}",
-                                    "hash": search_result["hash"],
-                                    "score": str(search_result["score"]),
-                                }
-                            )
+                for result, (image_hash, hidden) in zip(candidates, image_fields):
+                    if image_hash is None or hidden == "true":
+                        continue
+
+                    # Add score information from hybrid search
+                    search_results.append(
+                        {
+                            "id": f"image:{image_hash}",
+                            "hash": image_hash,
+                            "score": str(result.get("final_score", 0.0)),
+                        }
+                    )
 
                 return jsonify(
                     {
@@ -194,24 +216,14 @@ def search_complex():
         s.server_log(f"[INFO] Falling back to image search due to: {hybrid_error}")
 
         try:
-            image_results = s.controller.search(s.model_alias, query, top_k=max_results)
+            # The query embedding is cached, so this only adds the image KNN
+            image_results = s.controller.search(
+                s.model_alias, query, top_k=max_results
+            )
 
             if image_results and hasattr(image_results, "docs"):
-                search_results = []
-                for doc in image_results.docs:
-                    if (
-                        hasattr(doc, "hidden")
-                        and getattr(doc, "hidden", "false") == "true"
-                    ):
-                        continue
-
-                    doc_dict = {}
-                    for key, value in doc.__dict__.items():
-                        if (
-                            key != "payload"
-                        ):  # Skip payload as it might contain binary data
-                            doc_dict[key] = value
-                    search_results.append(doc_dict)
+                # Hidden images are already excluded by the KNN pre-filter
+                search_results = [search_result_to_dict(doc) for doc in image_results.docs]
 
                 return jsonify(
                     {
@@ -261,38 +273,82 @@ def search_complex():
         return jsonify({"error": str(e)}), 500
 
 
+def build_search_status():
+    """Current search/model status shared by the polling and streaming endpoints"""
+    model_status = s.get_cached_model_status()
+    dynamic_status = s.get_dynamic_loading_status()
+
+    return {
+        "model_alias": s.model_alias,
+        "model_status": s.MODEL_STATUS_NAMES.get(model_status, "unknown"),
+        "model_status_code": model_status,
+        "dynamic_loading": dynamic_status,
+        "ready_for_search": model_status == 2,
+    }
+
+
 @s.app.route("/api/search/status", methods=["GET"])
 def search_status():
     """Get current search/model status for dynamic loading"""
     try:
-        model_status = s.controller.get_model_status(s.model_alias)
-        dynamic_status = s.get_dynamic_loading_status()
-
-        status_info = {
-            "model_alias": s.model_alias,
-            "model_status": {0: "unloaded", 1: "loading", 2: "loaded"}.get(
-                model_status, "unknown"
-            ),
-            "model_status_code": model_status,
-            "dynamic_loading": dynamic_status,
-            "ready_for_search": model_status == 2,
-        }
-
-        return jsonify(status_info)
+        return jsonify(build_search_status())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@s.app.route("/api/status")
+@s.app.route("/api/search/status/stream", methods=["GET"])
+def search_status_stream():
+    """
+    Push search/model status as Server-Sent Events whenever the model status changes.
+    Each stream is closed after STATUS_STREAM_LIFETIME so it does not hold a server
+    thread for as long as a tab stays open; EventSource reconnects on its own.
+    """
+
+    def generate():
+        deadline = time.monotonic() + STATUS_STREAM_LIFETIME
+        yield b"retry: %d\n\n" % STATUS_STREAM_RETRY
+
+        # Read the version before the first status, so the first wait blocks
+        # instead of returning at once and repeating the initial event
+        version = s.controller.wait_for_model_status_change(s.model_alias, None)
+        while True:
+            s.invalidate_model_status()
+            try:
+                status_info = build_search_status()
+            except Exception as e:
+                status_info = {"error": str(e)}
+            yield b"data: " + orjson.dumps(status_info) + b"\n\n"
+
+            # Idle streams get a comment line so proxies keep them open
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                new_version = s.controller.wait_for_model_status_change(
+                    s.model_alias,
+                    version,
+                    timeout=min(STATUS_STREAM_KEEPALIVE, remaining),
+                )
+                if new_version != version:
+                    break
+                yield b": keep-alive\n\n"
+            version = new_version
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@dev_only_route("/api/status")
 def status():
     """Server status and statistics endpoint"""
-    if s.production:
-        abort(404)
 
     try:
         stats = s.get_server_statistics()
         schedule_status = s.get_embedding_schedule_status()
-        model_status = s.controller.get_model_status(s.model_alias)
+        model_status = s.get_cached_model_status()
         model_status_text = {0: "UNLOADED", 1: "LOADING", 2: "LOADED"}.get(
             model_status, "UNKNOWN"
         )
@@ -314,14 +370,13 @@ def status():
         return jsonify({"error": str(e)}), 500
 
 
-@s.app.route("/api/model/load", methods=["POST"])
+@dev_only_route("/api/model/load", methods=["POST"])
 def load_model():
     """Load the model"""
-    if s.production:
-        abort(404)
 
     try:
         success = s.controller.load_model(s.model_alias)
+        s.invalidate_model_status()
         if success:
             return jsonify({"message": f"Model {s.model_alias} loaded successfully"})
         else:
@@ -330,14 +385,13 @@ def load_model():
         return jsonify({"error": str(e)}), 500
 
 
-@s.app.route("/api/model/unload", methods=["POST"])
+@dev_only_route("/api/model/unload", methods=["POST"])
 def unload_model():
     """Unload the model"""
-    if s.production:
-        abort(404)
 
     try:
         success = s.controller.unload_model(s.model_alias)
+        s.invalidate_model_status()
         if success:
             return jsonify({"message": f"Model {s.model_alias} unloaded successfully"})
         else:
@@ -360,11 +414,9 @@ def model_status():
         return jsonify({"error": str(e)}), 500
 
 
-@s.app.route("/api/embeddings/generate", methods=["POST"])
+@dev_only_route("/api/embeddings/generate", methods=["POST"])
 def generate_embeddings():
     """Manually trigger embedding generation"""
-    if s.production:
-        abort(404)
 
     try:
         result = s.trigger_embedding_generation()
@@ -373,11 +425,9 @@ def generate_embeddings():
         return jsonify({"error": str(e)}), 500
 
 
-@s.app.route("/api/embeddings/progress")
+@dev_only_route("/api/embeddings/progress")
 def get_embedding_progress():
     """Get current embedding generation progress"""
-    if s.production:
-        abort(404)
 
     try:
         progress = s.get_embedding_progress()
@@ -390,21 +440,41 @@ def get_embedding_progress():
 def serve_image(image_id):
     """Serve image files"""
     try:
-        image_path = s.rc.hget(f"image:{image_id}", "local_path")
-        if not image_path:
-            s.server_log(f"[ERROR] Image not found in Redis: {image_id}")
-            return jsonify({"error": "Image not found"}), 404
+        image_path_str = s.image_path_cache.get(image_id)
+
+        if image_path_str is None:
+            image_path_str = s.rc.text_client.hget(f"image:{image_id}", "local_path")
+            if not image_path_str:
+                s.server_log(f"[ERROR] Image not found in Redis: {image_id}")
+                return jsonify({"error": "Image not found"}), 404
 
-        image_path_str = image_path.decode("utf-8")
+            if not os.path.exists(image_path_str):
+                s.server_log(f"[ERROR] Image file not found on disk: {image_path_str}")
+                return jsonify({"error": "Image file not found on disk"}), 404
 
-        if not os.path.exists(image_path_str):
-            s.server_log(f"[ERROR] Image file not found on disk: {image_path_str}")
-            return jsonify({"error": "Image file not found on disk"}), 404
+            s.image_path_cache.set(image_id, image_path_str)
 
         s.server_log(f"[INFO] Serving image: {image_path_str}")
+
+        if s.production and s.x_accel_redirect.get("enabled", False):
+            # Let nginx stream the file from its internal location
+            internal_location = s.x_accel_redirect.get(
+                "internal_location", "/protected"
+            ).rstrip("/")
+            response = Response(status=200)
+            response.headers["X-Accel-Redirect"] = internal_location + quote(
+                image_path_str
+            )
+            response.headers["Content-Type"] = (
+                mimetypes.guess_type(image_path_str)[0] or "application/octet-stream"
+            )
+            response.headers["Cache-Control"] = f"public, max-age={IMAGE_MAX_AGE}"
+            return response
+
         return send_from_directory(
             os.path.dirname(image_path_str),
             os.path.basename(image_path_str),
+            max_age=IMAGE_MAX_AGE,
         )
     except Exception as e:
         s.server_log(f"[ERROR] Failed to serve image {image_id}: {e}")
@@ -418,97 +488,92 @@ def get_image_details(image_id):
         if not s.rc:
             return jsonify({"error": "Redis not connected"}), 500
 
-        image_data = s.rc.hgetall(f"image:{image_id}")
-        if not image_data:
+        cached_payload = s.image_details_cache.get(image_id)
+        if cached_payload is not None:
+            return Response(cached_payload, mimetype="application/json")
+
+        image_values = s.rc.text_client.hmget(f"image:{image_id}", IMAGE_DETAIL_FIELDS)
+        if not any(image_values):
             return jsonify({"error": "Image not found"}), 404
 
-        image_info = s.rc.decode_object(image_data)
+        image_info = {
+            field: value
+            for field, value in zip(IMAGE_DETAIL_FIELDS, image_values)
+            if value is not None
+        }
 
         if image_info.get("hidden", "false") == "true":
             return jsonify({"error": "Image not found"}), 404
 
-        document_keys = s.rc.keys("document:*")
+        document_keys = list(s.rc.text_client.smembers(f"image_docs:{image_id}"))
         associated_documents = []
 
         if document_keys:
-            pipe = s.rc.client.pipeline()
+            doc_hashes = []
+            pipe = s.rc.text_pipeline()
             for doc_key in document_keys:
-                pipe.hget(doc_key, "images")
-                pipe.hget(doc_key, "hidden")
+                doc_hash = doc_key.split(":")[-1] if ":" in doc_key else doc_key
+                doc_hashes.append(doc_hash)
+
+                pipe.hmget(doc_key, DOCUMENT_DETAIL_FIELDS)
+                # The document may have been rewritten without this image
+                pipe.sismember(f"document_images:{doc_hash}", image_id)
 
             results = pipe.execute()
 
-            for i, doc_key in enumerate(document_keys):
-                images_json_bytes = results[i * 2]
-                hidden_status = results[i * 2 + 1]
+            for i, doc_hash in enumerate(doc_hashes):
+                doc_values = results[i * 2]
+                still_linked = results[i * 2 + 1]
 
-                if hidden_status:
-                    hidden_value = (
-                        hidden_status.decode("utf-8")
-                        if isinstance(hidden_status, bytes)
-                        else str(hidden_status)
-                    )
-                    if hidden_value == "true":
-                        continue
+                if not still_linked or not any(doc_values):
+                    continue
 
-                if images_json_bytes:
-                    images_json = (
-                        images_json_bytes.decode("utf-8")
-                        if isinstance(images_json_bytes, bytes)
-                        else images_json_bytes
+                doc_info = {
+                    field: value
+                    for field, value in zip(DOCUMENT_DETAIL_FIELDS, doc_values)
+                    if value is not None
+                }
+                if doc_info.get("hidden", "false") == "true":
+                    continue
+
+                associated_documents.append(
+                    {
+                        "title": doc_info.get("title", "Untitled Document"),
+                        "content": doc_info.get("content_preview"),
+                        "url": doc_info.get("url", ""),
+                        "date": doc_info.get("date", ""),
+                        "hash": doc_hash,
+                    }
+                )
+
+            # Documents ingested before previews were stored
+            missing_preview = [
+                document
+                for document in associated_documents
+                if document["content"] is None
+            ]
+            if missing_preview:
+                pipe = s.rc.text_pipeline()
+                for document in missing_preview:
+                    pipe.hget(f"document:{document['hash']}", "content")
+                for document, content in zip(missing_preview, pipe.execute()):
+                    document["content"] = DocumentWatcher.content_preview(
+                        content or ""
                     )
 
-                    try:
-                        images = json.loads(images_json) if images_json else []
-
-                        for img in images:
-                            if isinstance(img, dict) and img.get("hash") == image_id:
-                                doc_data = s.rc.hgetall(doc_key)
-                                if doc_data:
-                                    doc_info = s.rc.decode_object(doc_data)
-                                    doc_key_str = (
-                                        doc_key.decode("utf-8")
-                                        if isinstance(doc_key, bytes)
-                                        else str(doc_key)
-                                    )
-                                    doc_hash = (
-                                        doc_key_str.split(":")[-1]
-                                        if ":" in doc_key_str
-                                        else doc_key_str
-                                    )
-
-                                    associated_documents.append(
-                                        {
-                                            "title": doc_info.get(
-                                                "title", "Untitled Document"
-                                            ),
-                                            "content": doc_info.get("content", "")[:500]
-                                            + (
-                                                "..."
-                                                if len(doc_info.get("content", ""))
-                                                > 500
-                                                else ""
-                                            ),
-                                            "url": doc_info.get("url", ""),
-                                            "date": doc_info.get("date", ""),
-                                            "hash": doc_hash,
-                                        }
-                                    )
-                                break
-                    except json.JSONDecodeError:
-                        continue
+        details = {
+            "image": {
+                "hash": image_info.get("hash", image_id),
+                "url": image_info.get("url", ""),
+                "local_path": image_info.get("local_path", ""),
+                "extension": image_info.get("extension", ""),
+            },
+            "documents": associated_documents,
+        }
+        payload = orjson.dumps(details)
+        s.image_details_cache.set(image_id, payload)
 
-        return jsonify(
-            {
-                "image": {
-                    "hash": image_info.get("hash", image_id),
-                    "url": image_info.get("url", ""),
-                    "local_path": image_info.get("local_path", ""),
-                    "extension": image_info.get("extension", ""),
-                },
-                "documents": associated_documents,
-            }
-        )
+        return Response(payload, mimetype="application/json")
 
     except Exception as e:
         s.server_log(f"[ERROR] Failed to get image details for {image_id}: {e}")
@@ -516,4 +581,10 @@ def get_image_details(image_id):
 
 
 if __name__ == "__main__":
-    s.app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
\ No newline at end of file
+    s.app.run(
+        host="0.0.0.0",
+        port=5000,
+        debug=not s.production,
+        threaded=True,
+        use_reloader=False,
+    )
\ No newline at end of file
@@ -1,14 +1,40 @@
 import os
+import copy
 import json
 import time
-import math
-import random
+import heapq
 
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import numpy as np
 from redis.commands.search.query import Query
-from redis.commands.search.field import VectorField, TextField
+from redis.commands.search.field import VectorField, TagField
 
 from utils.model import Model, ModelStatus
 from utils.redis import RedisHelper
+from utils.ttl_cache import TTLCache
+
+# Parsed models.json contents keyed by (path, mtime)
+_CONFIG_CACHE: dict[tuple[str, float], dict] = {}
+
+
+def _rank_coefficients(factor: float, size: int):
+    """Precompute 1 - decay(rank) for each search_complex function_option"""
+    ranks = np.arange(size)
+    return {
+        1: 1 - factor * ranks,
+        2: 1 - factor * (ranks + 1),
+        3: 1 - factor ** np.sqrt(ranks),
+        4: 1 - factor ** np.exp(ranks),
+    }
+
+
+def _copy_result(results):
+    """Copy a search Result and its documents, so callers can annotate them freely"""
+    results = copy.copy(results)
+    results.docs = [copy.copy(doc) for doc in results.docs]
+    return results
 
 
 class Controller:
@@ -17,8 +43,35 @@ class Controller:
     IMAGE_TOP_K = 10
     TEMP_TOP_K = 25
 
+    # HNSW graph parameters for the image/document indexes
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_RUNTIME = 64
+
+    IMAGE_RETURN_FIELDS = ("hash", "url", "extension")
+
+    # search_complex score adjustment coefficients per function_option and rank
+    RANK_COEFFICIENTS = _rank_coefficients(COMPLEX_FACTOR, TEMP_TOP_K)
+
+    SEARCH_WORKERS = 4
+    QUERY_EMBEDDING_CACHE_TTL = 600
+    QUERY_EMBEDDING_CACHE_SIZE = 1024
+    SEARCH_RESULT_CACHE_TTL = 60
+    SEARCH_RESULT_CACHE_SIZE = 1024
+
     def __init__(self, logger=None, models_config_path=None, model_alias=None):
         self.rc = None
+        self.query_embedding_cache = TTLCache(
+            self.QUERY_EMBEDDING_CACHE_TTL, self.QUERY_EMBEDDING_CACHE_SIZE
+        )
+        self.search_result_cache = TTLCache(
+            self.SEARCH_RESULT_CACHE_TTL, self.SEARCH_RESULT_CACHE_SIZE
+        )
+        self.query_templates = {}
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=self.SEARCH_WORKERS, thread_name_prefix="search"
+        )
+        self.ft_clients = {}
         self.images_path = None
         self.logger = logger or print
         self.model = None
@@ -39,8 +92,12 @@ class Controller:
             raise FileNotFoundError(error_msg)
 
         try:
-            with open(config_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
+            cache_key = (config_path, os.path.getmtime(config_path))
+            config = _CONFIG_CACHE.get(cache_key)
+            if config is None:
+                with open(config_path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                _CONFIG_CACHE[cache_key] = config
 
             models_config = config.get("models", {})
 
@@ -59,6 +116,7 @@ class Controller:
                     model_pretrained=model_data.get("model_pretrained"),
                     embedding_name=model_data.get("embedding_name"),
                     embedding_length=model_data.get("embedding_length"),
+                    embedding_type=model_data.get("embedding_type", "float32"),
                     hidden=model_data.get("hidden", False),
                     description=model_data.get("description"),
                     logger=self.logger,
@@ -83,6 +141,7 @@ class Controller:
         """Connect to Redis database with error guards"""
         try:
             self.rc = RedisHelper(host, port, db, logger=self.logger)
+            self.ft_clients = {}
             if self.rc.connect():
                 self.logger(f"[SUCCESS] Connected to Redis at {host}:{port}/{db}")
                 return True
@@ -107,6 +166,7 @@ class Controller:
                 model_pretrained=model_config.get("model_pretrained"),
                 embedding_name=model_config.get("embedding_name"),
                 embedding_length=model_config.get("embedding_length"),
+                embedding_type=model_config.get("embedding_type", "float32"),
                 hidden=model_config.get("hidden", False),
                 description=model_config.get("description"),
                 logger=self.logger,
@@ -222,6 +282,16 @@ class Controller:
             return None
         return model.loaded
 
+    def wait_for_model_status_change(
+        self, model_alias: str, version: int, timeout: float = None
+    ):
+        """Block until the model status moves past `version`; returns the new version"""
+        model = self.get_model(model_alias)
+        if not model:
+            time.sleep(timeout or 0)
+            return version
+        return model.wait_for_status_change(version, timeout)
+
     def get_models_status(self, include_hidden: bool = False):
         """Get status of all models"""
         status = {}
@@ -258,8 +328,13 @@ class Controller:
                     f"[INFO] Document index {document_index_name} did not exist"
                 )
 
-            self.index("image:", [TextField(name="hidden")], model_alias, mute=False)
-            self.index("document:", [TextField(name="hidden")], model_alias, mute=False)
+            # Queries built against the dropped indexes may use the old hidden syntax
+            self.query_templates = {}
+            self.search_result_cache.clear()
+            self.ft_clients = {}
+
+            self.index("image:", [TagField(name="hidden")], model_alias, mute=False)
+            self.index("document:", [TagField(name="hidden")], model_alias, mute=False)
 
             self.logger("[SUCCESS] Indexes recreated with hidden field support")
             return True
@@ -274,8 +349,13 @@ class Controller:
         returning_fields: list,
         model_alias: str,
         mute: bool = True,
+        initial_cap: int = None,
     ):
-        """Creates index for documents with embeddings"""
+        """
+        Creates index for documents with embeddings.
+        Callers that already know roughly how many documents match the prefix
+        can pass initial_cap to skip counting them.
+        """
         if not self.rc:
             self.logger("[ERROR] Redis not connected")
             return False
@@ -285,36 +365,56 @@ class Controller:
             return False
 
         try:
-            document_keys = self.rc.keys(f"{document_prefix}*")
-            document_keys_len = len(document_keys)
+            index_name = f"idx:{document_prefix}{model.embedding_name}"
+            if self.rc.index_exists(index_name):
+                if not mute:
+                    self.logger(f"[INFO] Index {index_name} already exists")
+                return True
 
-            if document_keys_len == 0:
+            sample_key = next(
+                self.rc.scan_iter(match=f"{document_prefix}*", count=1000), None
+            )
+            if sample_key is None:
                 self.logger(
                     f"[ERROR] No documents found with prefix '{document_prefix}'. Cannot create index."
                 )
                 return False
 
-            embedding_data = self.rc.hget(document_keys[0], model.embedding_name)
+            embedding_data = self.rc.hget(sample_key, model.embedding_name)
             if embedding_data is None:
                 self.logger(
                     f"[ERROR] No embedding found in first document for model '{model_alias}'. Cannot create index."
                 )
                 return False
 
-            h, w = self.rc.embedding_decode(embedding_data).shape
-            vector_dimension = w + 2  # Add 2 floats for h and w
+            if initial_cap is not None:
+                document_keys_len = max(initial_cap, 1)
+            else:
+                document_keys_len = sum(
+                    1
+                    for _ in self.rc.scan_iter(
+                        match=f"{document_prefix}*", count=1000
+                    )
+                )
+
+            # The stored vector includes the (h, w) header, read as vector components
+            vector_dimension = len(embedding_data) // np.dtype(
+                model.embedding_type
+            ).itemsize
 
-            index_name = f"idx:{document_prefix}{model.embedding_name}"
             vector_field = model.embedding_name
 
             embedding_field = VectorField(
                 vector_field,
-                "FLAT",
+                "HNSW",
                 {
-                    "TYPE": "FLOAT32",
+                    "TYPE": model.vector_type,
                     "DIM": vector_dimension,
                     "DISTANCE_METRIC": "COSINE",
                     "INITIAL_CAP": document_keys_len,
+                    "M": self.HNSW_M,
+                    "EF_CONSTRUCTION": self.HNSW_EF_CONSTRUCTION,
+                    "EF_RUNTIME": self.HNSW_EF_RUNTIME,
                 },
             )
 
@@ -332,49 +432,125 @@ class Controller:
             self.logger(f"[ERROR] Index creation failed: {e}")
             return False
 
-    def _perform_search(
-        self, model_alias: str, query: str, search_config: dict, top_k: int = 5
-    ):
-        """Common search function to reduce code duplication"""
+    def _embed_query(self, model_alias: str, query: str):
+        """
+        Return (model, query embedding) for a loaded model, or (None, None).
+        Embeddings are cached per model and query, since the UI repeats queries.
+        """
         model = self.get_model(model_alias)
         if not model:
-            return None
+            return None, None
 
         if model.loaded != ModelStatus.LOADED:
             self.logger(f"[ERROR] Model {model_alias} not loaded")
-            return None
+            return None, None
 
         if not self.rc:
             self.logger("[ERROR] Redis not connected")
-            return None
+            return None, None
 
-        try:
+        cache_key = (model.model_name, model.embedding_name, query)
+        text_embedding = self.query_embedding_cache.get(cache_key)
+        if text_embedding is None:
             text_embedding = model.generate_text_embedding(query)
             if text_embedding is None:
                 self.logger(
                     f"[ERROR] Failed to generate text embedding for query: {query}"
                 )
+                return None, None
+            self.query_embedding_cache.set(cache_key, text_embedding)
+
+        return model, text_embedding
+
+    def _perform_search(
+        self, model_alias: str, query: str, search_config: dict, top_k: int = 5
+    ):
+        """Common search function to reduce code duplication"""
+        try:
+            model, text_embedding = self._embed_query(model_alias, query)
+            if model is None:
                 return None
 
-            text_embedding_encoded = self.rc.embedding_encode(text_embedding)
+            return self._search_with_embedding(
+                model, text_embedding, search_config, top_k
+            )
+
+        except Exception as e:
+            self.logger(f"[ERROR] Search failed: {e}")
+            return None
+
+    def _hidden_filter(self, ft):
+        """
+        Pre-filter excluding hidden entries. New indexes store hidden as a TAG
+        field; indexes created before that still have it as TEXT.
+        Returns None if the index cannot be inspected (e.g. not created yet).
+        """
+        try:
+            attributes = ft.info().get("attributes", [])
+        except Exception:
+            return None
+
+        for attribute in attributes:
+            attribute = [
+                item.decode("utf-8") if isinstance(item, bytes) else item
+                for item in attribute
+            ]
+            if "hidden" in attribute and "TAG" in attribute:
+                return "(-@hidden:{true})"
+        return "(-@hidden:true)"
+
+    def _search_with_embedding(
+        self,
+        model,
+        text_embedding,
+        search_config: dict,
+        top_k: int = 5,
+        text_embedding_encoded: bytes = None,
+    ):
+        """
+        Run a KNN search for an already generated query embedding.
+        Callers searching several indexes can pass the encoded vector to skip re-encoding.
+        """
+        try:
+            if text_embedding_encoded is None:
+                text_embedding_encoded = self.rc.embedding_encode(text_embedding)
 
             vector_field = model.embedding_name
             index_name = search_config["index_name"].format(vector_field=vector_field)
             return_fields = search_config["return_fields"]
 
-            redis_query = (
-                Query(
-                    f"(-@hidden:true)=>[KNN {top_k} @{vector_field} $vector as score]"
+            # Only the $vector parameter changes between calls, so the Query
+            # object and the index handle are built once and reused
+            query_key = (index_name, vector_field, top_k, tuple(return_fields))
+
+            result_key = (query_key, text_embedding_encoded)
+            results = self.search_result_cache.get(result_key)
+            if results is not None:
+                return _copy_result(results)
+
+            redis_query = self.query_templates.get(query_key)
+            ft = self.ft_clients.get(index_name)
+            if ft is None:
+                ft = self.ft_clients[index_name] = self.rc.ft(index_name)
+
+            if redis_query is None:
+                hidden_filter = self._hidden_filter(ft)
+                redis_query = (
+                    Query(
+                        f"{hidden_filter or '(-@hidden:true)'}=>[KNN {top_k} @{vector_field} $vector as score]"
+                    )
+                    .return_fields("score", *return_fields)
+                    .sort_by("score")
+                    .paging(0, top_k)
+                    .dialect(2)
                 )
-                .return_fields("score", *return_fields)
-                .sort_by("score")
-                .paging(0, top_k)
-                .dialect(2)
-            )
+                if hidden_filter:
+                    self.query_templates[query_key] = redis_query
 
             query_params = {"vector": text_embedding_encoded}
 
-            results = self.rc.ft(index_name).search(redis_query, query_params)
+            results = ft.search(redis_query, query_params)
+            self.search_result_cache.set(result_key, _copy_result(results))
             self.logger(
                 f"[SUCCESS] Search completed. Found {len(results.docs)} results"
             )
@@ -389,18 +565,87 @@ class Controller:
         search_config = {
             # "index_name": "idx:evaluation:image:{vector_field}",
             "index_name": "idx:image:{vector_field}",
-            "return_fields": ["hash", "url", "extension"],
+            "return_fields": self.IMAGE_RETURN_FIELDS,
         }
         return self._perform_search(model_alias, query, search_config, top_k)
 
+    def search_batch(self, model_alias: str, requests: list):
+        """Search images for several (query, top_k) pairs with one embedding pass"""
+        model = self.get_model(model_alias)
+        if not model:
+            return [None] * len(requests)
+
+        if model.loaded != ModelStatus.LOADED:
+            self.logger(f"[ERROR] Model {model_alias} not loaded")
+            return [None] * len(requests)
+
+        if not self.rc:
+            self.logger("[ERROR] Redis not connected")
+            return [None] * len(requests)
+
+        # Same cache as _embed_query; only the misses go through the model
+        cache_keys = [
+            (model.model_name, model.embedding_name, query) for query, _ in requests
+        ]
+        text_embeddings = [self.query_embedding_cache.get(key) for key in cache_keys]
+        missing = [i for i, cached in enumerate(text_embeddings) if cached is None]
+
+        if missing:
+            try:
+                generated = model.generate_text_embeddings(
+                    [requests[i][0] for i in missing]
+                )
+            except Exception as e:
+                self.logger(f"[ERROR] Batched text embedding failed: {e}")
+                return [None] * len(requests)
+
+            if generated is None:
+                self.logger(
+                    f"[ERROR] Failed to generate text embeddings for {len(missing)} queries"
+                )
+                return [None] * len(requests)
+
+            for row, i in enumerate(missing):
+                # Copy the row so the cache does not keep the whole batch alive
+                text_embeddings[i] = generated[row : row + 1].copy()
+                self.query_embedding_cache.set(cache_keys[i], text_embeddings[i])
+
+        search_config = {
+            "index_name": "idx:image:{vector_field}",
+            "return_fields": self.IMAGE_RETURN_FIELDS,
+        }
+        return [
+            self._search_with_embedding(model, text_embedding, search_config, top_k)
+            for text_embedding, (_, top_k) in zip(text_embeddings, requests)
+        ]
+
     def search_documents(self, model_alias: str, query: str, top_k: int = 5):
-        """Search documents"""
+        """
+        Search documents. The KNN only returns lightweight fields; content and
+        images are fetched afterwards for the returned page alone.
+        """
         search_config = {
             # "index_name": "idx:evaluation:document:{vector_field}",
             "index_name": "idx:document:{vector_field}",
-            "return_fields": ["url", "content", "date", "images"],
+            "return_fields": ["url", "date"],
         }
-        return self._perform_search(model_alias, query, search_config, top_k)
+        results = self._perform_search(model_alias, query, search_config, top_k)
+        return self.hydrate_documents(results)
+
+    def hydrate_documents(self, results, fields=("content", "images")):
+        """Fetch heavier document fields for search results with one pipelined HMGET"""
+        if not results or not results.docs:
+            return results
+
+        pipe = self.rc.text_pipeline()
+        for doc in results.docs:
+            pipe.hmget(f"document:{doc.id.split(':')[-1]}", *fields)
+
+        for doc, values in zip(results.docs, pipe.execute()):
+            for field, value in zip(fields, values):
+                setattr(doc, field, value)
+
+        return results
 
     def search_rag_style(self, model_alias: str, query: str, top_k: int = 20):
         """Search in RAG style"""
@@ -410,6 +655,57 @@ class Controller:
         }
         return self._perform_search(model_alias, query, search_config, top_k)
 
+    def _rank_images_by_distance(
+        self, model, text_embedding_encoded: bytes, image_hashes: list, top_k: int
+    ):
+        """
+        Brute-force cosine distance between the query and a small candidate set,
+        fetched with one pipelined HMGET. Returns up to top_k (hash, distance)
+        pairs, closest first, skipping missing, hidden and unembedded images.
+        Vectors are compared exactly as stored (header included), matching the
+        distances the KNN index reports.
+        """
+        pipe = self.rc.pipeline(transaction=False)
+        for img_hash in image_hashes:
+            pipe.hmget(f"image:{img_hash}", "hash", "hidden", model.embedding_name)
+        replies = pipe.execute()
+
+        query_vector = np.frombuffer(
+            text_embedding_encoded, dtype=model.embedding_type
+        ).astype(np.float32)
+
+        ranked_hashes = []
+        vectors = []
+        for img_hash, (stored_hash, hidden_status, embedding_data) in zip(
+            image_hashes, replies
+        ):
+            if stored_hash is None:
+                self.logger(f"[WARNING] Image key does not exist: image:{img_hash}")
+                continue
+
+            if hidden_status == b"true" or embedding_data is None:
+                continue  # Skip hidden images and images not embedded yet
+
+            vector = np.frombuffer(embedding_data, dtype=model.embedding_type)
+            if vector.shape != query_vector.shape:
+                continue
+
+            ranked_hashes.append(img_hash)
+            vectors.append(vector)
+
+        if not vectors:
+            return []
+
+        vectors = np.vstack(vectors).astype(np.float32, copy=False)
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        distances = 1.0 - (vectors @ query_vector) / np.maximum(norms, 1e-12)
+
+        top_k = min(top_k, len(distances))
+        closest = np.argpartition(distances, top_k - 1)[:top_k]
+        closest = closest[np.argsort(distances[closest], kind="stable")]
+
+        return [(ranked_hashes[i], float(distances[i])) for i in closest]
+
     def search_complex(
         self, model_alias: str, query: str, top_k: int = 5, function_option: int = 1
     ):
@@ -420,31 +716,50 @@ class Controller:
             "return_fields": ["images"],
         }
 
-        model = self.get_model(model_alias)
+        # Embed the query once for the document, candidate and image rankings
+        try:
+            model, text_embedding = self._embed_query(model_alias, query)
+        except Exception as e:
+            self.logger(f"[ERROR] Search failed: {e}")
+            return []
+        if model is None:
+            return []
+        text_embedding_encoded = self.rc.embedding_encode(text_embedding)
 
-        results_text = self._perform_search(
-            model_alias, query, search_config_text, self.DOCUMENT_TOP_K
+        # Image only retrieval does not depend on the document results, so it
+        # runs alongside the document search and candidate ranking
+        search_config_image = {
+            "index_name": "idx:image:{vector_field}",
+            "return_fields": ["hash"],
+        }
+        image_future = self.search_executor.submit(
+            self._search_with_embedding,
+            model,
+            text_embedding,
+            search_config_image,
+            self.IMAGE_TOP_K,
+            text_embedding_encoded,
+        )
+
+        results_text = self._search_with_embedding(
+            model,
+            text_embedding,
+            search_config_text,
+            self.DOCUMENT_TOP_K,
+            text_embedding_encoded,
         )
         if not results_text or len(results_text.docs) == 0:
             self.logger(f"[ERROR] No results found for query: {query}")
             return []
 
-        # Create temporary index for images collected from articles
-        temp = random.randint(2**32, 2**33)
-        temp_prefix = f"temp:{temp}:"
-        temp_index_name = f"idx:{temp_prefix}{model.embedding_name}"
-
-        multiplier = {}
+        candidate_scores = {}
         for res in results_text.docs:
             try:
-                images_str = getattr(res, "images", "[]")
-                if not images_str or images_str.strip() == "":
-                    images_str = "[]"
-
+                images_str = getattr(res, "images", None)
                 images = (
-                    json.loads(images_str)
-                    if isinstance(images_str, str)
-                    else images_str
+                    orjson.loads(images_str)
+                    if isinstance(images_str, (bytes, str)) and images_str
+                    else []
                 )
                 if not isinstance(images, list):
                     self.logger(
@@ -462,28 +777,10 @@ class Controller:
                         self.logger(f"[WARNING] Empty image hash: {img}")
                         continue
 
-                    img_key_to_check = f"image:{img_hash}"
-                    temp_img_key = f"{temp_prefix}{img_hash}"
-
-                    if self.rc.exists(img_key_to_check):
-                        hidden_status = self.rc.hget(img_key_to_check, "hidden")
-                        if hidden_status:
-                            hidden_value = (
-                                hidden_status.decode("utf-8")
-                                if isinstance(hidden_status, bytes)
-                                else str(hidden_status)
-                            )
-                            if hidden_value == "true":
-                                continue  # Skip hidden images
-
-                        self.rc.copy(img_key_to_check, temp_img_key)
-                        multiplier[temp_img_key] = float(getattr(res, "score", 0.0))
-                    else:
-                        self.logger(
-                            f"[WARNING] Image key does not exist: {img_key_to_check}"
-                        )
-
-            except json.JSONDecodeError as e:
+                    # An image shared by several documents keeps the last score
+                    candidate_scores[img_hash] = float(getattr(res, "score", 0.0))
+
+            except (json.JSONDecodeError, orjson.JSONDecodeError) as e:
                 self.logger(
                     f"[ERROR] Failed to parse images JSON for document {getattr(res, 'id', 'unknown')}: {e}"
                 )
@@ -497,54 +794,26 @@ class Controller:
                 )
                 continue
 
-        if not multiplier:
+        ranked = self._rank_images_by_distance(
+            model, text_embedding_encoded, list(candidate_scores), self.TEMP_TOP_K
+        )
+        if not ranked:
             self.logger(
                 "[WARNING] No valid images found for complex search, falling back to regular search"
             )
             return {}
 
-        self.index(temp_prefix, [TextField(name="hidden")], model_alias, mute=True)
-
-        time.sleep(1)  # Wait for index to be created
-
-        search_config_temp = {
-            "index_name": temp_index_name,
-            "return_fields": ["hash"],
-        }
-
-        results_temp = self._perform_search(
-            model_alias, query, search_config_temp, self.TEMP_TOP_K
-        )
-
-        text_results = []
-        for res in results_temp.docs:
-            base_score = float(getattr(res, "score", 0.0))
-            multiplier_value = multiplier.get(getattr(res, "id", ""), 1.0)
-            final_score = base_score
-            text_results.append(
-                {
-                    "hash": getattr(res, "hash", ""),
-                    "base_score": base_score,
-                    "multiplier": multiplier_value,
-                    "final_score": final_score,
-                }
-            )
-
-        text_results.sort(key=lambda x: x["final_score"])
-
-        # Clean up temporary index and keys
-        self.rc.ft(temp_index_name).dropindex()
-        [self.rc.delete(key) for key in self.rc.keys(f"{temp_prefix}*")]
+        text_results = [
+            {
+                "hash": img_hash,
+                "base_score": distance,
+                "multiplier": candidate_scores[img_hash],
+                "final_score": distance,
+            }
+            for img_hash, distance in ranked
+        ]
 
-        # Image only retrieval
-        search_config_image = {
-            "index_name": "idx:image:{vector_field}",
-            "return_fields": ["hash"],
-        }
-
-        results_image = self._perform_search(
-            model_alias, query, search_config_image, self.IMAGE_TOP_K
-        )
+        results_image = image_future.result()
 
         image_results = []
         for res in results_image.docs:
@@ -559,34 +828,34 @@ class Controller:
 
         distance = text_results[0]["final_score"] - image_results[0]["final_score"]
 
-        for _, res in enumerate(text_results):
-            if function_option == 1:
-                res["final_score"] -= distance * (1 - (self.COMPLEX_FACTOR * _))
-            elif function_option == 2:
-                res["final_score"] -= distance * (1 - (self.COMPLEX_FACTOR * (_ + 1)))
-            elif function_option == 3:
-                res["final_score"] -= distance * (
-                    1 - (self.COMPLEX_FACTOR ** math.sqrt(_))
-                )
-            elif function_option == 4:
-                res["final_score"] -= distance * (
-                    1 - (self.COMPLEX_FACTOR ** math.exp(_))
-                )
-            else:
-                res["final_score"] -= distance * (1 - (self.COMPLEX_FACTOR * _))
+        scores = np.fromiter(
+            (res["final_score"] for res in text_results),
+            dtype=np.float64,
+            count=len(text_results),
+        )
+        # JSON numbers like 2.0 still pick their curve; anything else uses curve 1
+        if isinstance(function_option, (int, float)) and float(
+            function_option
+        ).is_integer():
+            function_option = int(function_option)
+        else:
+            function_option = 1
+        coefficients = self.RANK_COEFFICIENTS.get(
+            function_option, self.RANK_COEFFICIENTS[1]
+        )
+        scores -= distance * coefficients[: len(text_results)]
 
-        combined_results = text_results + image_results
+        for res, score in zip(text_results, scores):
+            res["final_score"] = float(score)
 
-        # Remove duplicates based on 'hash' in reverse order
-        # to keep the first occurence (has lowest score)
-        seen_hashes = set()
-        combined_results = [
-            res
-            for res in reversed(combined_results)
-            if not (res["hash"] in seen_hashes or seen_hashes.add(res["hash"]))
-        ]
-        sorted_combined_results = sorted(
-            combined_results, key=lambda x: x["final_score"]
-        )
+        # Keep one entry per image hash: the last one seen, so an image only
+        # result wins over the same image found through the documents
+        best_results = {}
+        for res in reversed(text_results + image_results):
+            best_results.setdefault(res["hash"], res)
 
-        return sorted_combined_results[:top_k] if top_k > 0 else sorted_combined_results
+        if top_k > 0:
+            return heapq.nsmallest(
+                top_k, best_results.values(), key=lambda x: x["final_score"]
+            )
+        return sorted(best_results.values(), key=lambda x: x["final_score"])
@@ -1,21 +1,49 @@
 import os
-import json
+import ijson
+import orjson
 import hashlib
 
 from pathlib import Path
+from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from utils.file_scan import iter_files
+from utils.ttl_cache import TTLCache
+
+# Document hash fields read when hiding or relinking a document
+_DOC_FIELDS = ("local_path", "images", "unresolved_images", "hidden")
 
 
 class DocumentWatcher:
     """Handles document file operations and maintains bidirectional links with images."""
 
+    CONTENT_PREVIEW_LENGTH = 500
+    FILENAME_CACHE_TTL = 3600
+    FILENAME_CACHE_SIZE = 50000
+    SCAN_BATCH_SIZE = 256
+    SCAN_WORKERS = os.cpu_count() or 4
+
     def __init__(self, server_instance):
         self.server = server_instance
-        self.document_extensions = {".json"}
+        self.document_extensions = frozenset({".json"})
+        self.document_suffixes = tuple(self.document_extensions)
+        self.suffix_length = max(map(len, self.document_suffixes))
+
+        # filename -> image hash, hits only; the image watcher invalidates changes
+        self.filename_hash_cache = TTLCache(
+            ttl=self.FILENAME_CACHE_TTL, maxsize=self.FILENAME_CACHE_SIZE
+        )
+
+    @property
+    def redis(self):
+        """Decoding client: document fields are text, so replies come back as str."""
+        return self.server.rc.text_client
 
     def can_handle(self, file_path):
         """Check if this watcher can handle the given file."""
-        _, ext = os.path.splitext(file_path.lower())
-        return ext in self.document_extensions
+        return (
+            file_path[-self.suffix_length :].lower().endswith(self.document_suffixes)
+        )
 
     def process_file(self, file_path, action="created"):
         """Process a document file and store it in Redis."""
@@ -23,110 +51,61 @@ class DocumentWatcher:
             return
 
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                doc_data = json.load(f)
+            with open(file_path, "rb") as f:
+                doc_data = orjson.loads(f.read())
 
-            is_valid, error_msg = self._validate_document_structure(doc_data)
-            if not is_valid:
-                self.server.server_log(
-                    f"[ERROR] Invalid document structure in {file_path}: {error_msg}"
-                )
+            ingested = self._ingest_document(file_path, doc_data)
+            if ingested is None:
                 return
-
-            title = doc_data["title"]
-            doc_hash = self._generate_document_hash(title)
-
-            images = doc_data.get("images", [])
-            resolved_images, unresolved_images = self._resolve_image_paths(images)
+            doc_hash, document_data, resolved_images, unresolved_images = ingested
 
             redis_key = f"document:{doc_hash}"
 
             # Check if document exists and handle hidden case
-            if self.server.rc.exists(redis_key):
-                existing_data = self.server.rc.hgetall(redis_key)
-                if existing_data:
-                    hidden_status = existing_data.get(b"hidden", b"false").decode(
-                        "utf-8"
-                    )
-                    if hidden_status == "true":
-                        self.server.server_log(
-                            f"[INFO] Unhiding existing document: {file_path}"
-                        )
-
-                        document_data = {
-                            "hash": doc_hash,
-                            "title": title,
-                            "content": doc_data["content"],
-                            "images": json.dumps(resolved_images),
-                            "unresolved_images": json.dumps(unresolved_images),
-                            "url": doc_data.get("url", ""),
-                            "date": doc_data.get("date", ""),
-                            "local_path": file_path,
-                            "remote_path": "",
-                            "filename": os.path.basename(file_path),
-                            "hidden": "false",
-                        }
-
-                        self.server.rc.hset(redis_key, mapping=document_data)
-
-                        self._create_pending_image_index(doc_hash, unresolved_images)
-                        self._link_document_to_images(doc_hash, resolved_images)
-
-                        newly_resolved_count = self.resolve_single_document_images(
-                            doc_hash
-                        )
-                        if newly_resolved_count > 0:
-                            self.server.server_log(
-                                f"[INFO] Auto-resolved {newly_resolved_count} additional images for restored document {os.path.basename(file_path)}"
-                            )
-
-                        # Schedule type is immediate
-                        if (
-                            action != "scanned"
-                            and self.server.embedding_schedule.get("schedule_type")
-                            == "immediate"
-                        ):
-                            self.server.generate_immediate_embedding(redis_key)
-                        return
-
-            document_data = {
-                "hash": doc_hash,
-                "title": title,
-                "content": doc_data["content"],
-                "images": json.dumps(resolved_images),
-                "unresolved_images": json.dumps(unresolved_images),
-                "url": doc_data.get("url", ""),
-                "date": doc_data.get("date", ""),
-                "local_path": file_path,
-                "remote_path": "",
-                "filename": os.path.basename(file_path),
-                "hidden": "false",
-            }
-
-            self.server.rc.hset(redis_key, mapping=document_data)
-
-            self._create_pending_image_index(doc_hash, unresolved_images)
-
-            self._link_document_to_images(doc_hash, resolved_images)
+            hidden_status = self.redis.hget(redis_key, "hidden")
+            restoring = hidden_status == "true"
+            if restoring:
+                self.server.server_log(f"[INFO] Unhiding existing document: {file_path}")
+
+            # The document and every index it touches are written in one MULTI/EXEC
+            image_hashes = self._image_hashes(resolved_images)
+            images_key = f"document_images:{doc_hash}"
+
+            previous_hashes = self.redis.smembers(images_key)
+            dropped_hashes = previous_hashes.difference(image_hashes)
+
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(images_key)
+            if image_hashes:
+                pipe.sadd(images_key, *image_hashes)
+            for image_hash in dropped_hashes:
+                pipe.srem(f"image_docs:{image_hash}", redis_key)
+            pipe.hset(redis_key, mapping=document_data)
+            pipe.sadd("documents", redis_key)
+            pipe.hset("local_path_to_hash", file_path, doc_hash)
+            self._create_pending_image_index(doc_hash, unresolved_images, pipe=pipe)
+            self._link_document_to_images(doc_hash, resolved_images, pipe=pipe)
+            pipe.execute()
+
+            # Images dropped from the document must not serve cached details either
+            self.server.invalidate_image_caches(*previous_hashes, *image_hashes)
 
             newly_resolved_count = self.resolve_single_document_images(doc_hash)
             if newly_resolved_count > 0:
+                restored = "restored " if restoring else ""
                 self.server.server_log(
-                    f"[INFO] Auto-resolved {newly_resolved_count} additional images for document {os.path.basename(file_path)}"
+                    f"[INFO] Auto-resolved {newly_resolved_count} additional images for {restored}document {os.path.basename(file_path)}"
                 )
 
             # Schedule type is immediate
-            if (
-                action != "scanned"
-                and self.server.embedding_schedule.get("schedule_type") == "immediate"
-            ):
+            if action != "scanned" and self.server.schedule_type == "immediate":
                 self.server.generate_immediate_embedding(redis_key)
 
             # self.server.server_log(
             #     f"[INFO] Processed document {action}: {file_path} -> {doc_hash}"
             # )
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             self.server.server_log(f"[ERROR] Invalid JSON in document {file_path}: {e}")
         except Exception as e:
             self.server.server_log(
@@ -140,36 +119,27 @@ class DocumentWatcher:
 
         try:
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    doc_data = json.load(f)
+                with open(file_path, "rb") as f:
+                    doc_data = orjson.loads(f.read())
 
                 title = doc_data.get("title", "")
                 if title:
                     doc_hash = self._generate_document_hash(title)
                     redis_key = f"document:{doc_hash}"
 
-                    existing_data = self.server.rc.hgetall(redis_key)
-                    if existing_data:
-                        stored_path = existing_data.get(b"local_path", b"").decode(
-                            "utf-8"
-                        )
-
+                    stored_path, resolved_images_str, unresolved_images_str, _ = (
+                        self.redis.hmget(redis_key, *_DOC_FIELDS)
+                    )
+                    if stored_path is not None:
                         if stored_path == file_path:
-                            resolved_images_str = existing_data.get(
-                                b"images", b""
-                            ).decode("utf-8")
-                            unresolved_images_str = existing_data.get(
-                                b"unresolved_images", b""
-                            ).decode("utf-8")
-
                             try:
                                 resolved_images = (
-                                    json.loads(resolved_images_str)
+                                    orjson.loads(resolved_images_str)
                                     if resolved_images_str
                                     else []
                                 )
                                 unresolved_images = (
-                                    json.loads(unresolved_images_str)
+                                    orjson.loads(unresolved_images_str)
                                     if unresolved_images_str
                                     else []
                                 )
@@ -177,12 +147,20 @@ class DocumentWatcher:
                                 resolved_images = []
                                 unresolved_images = []
 
-                            self._unlink_document_from_images(doc_hash, resolved_images)
+                            pipe = self.redis.pipeline(transaction=False)
+                            self._unlink_document_from_images(
+                                doc_hash, resolved_images, pipe=pipe
+                            )
                             self._remove_pending_image_index(
-                                doc_hash, unresolved_images
+                                doc_hash, unresolved_images, pipe=pipe
+                            )
+                            pipe.hset(redis_key, "hidden", "true")
+                            pipe.hdel("local_path_to_hash", file_path)
+                            pipe.execute()
+                            self.server.invalidate_image_caches(
+                                *self._image_hashes(resolved_images)
                             )
 
-                            self.server.rc.hset(redis_key, "hidden", "true")
                             self.server.server_log(
                                 f"[INFO] Marked deleted document as hidden in Redis: {file_path}"
                             )
@@ -192,7 +170,7 @@ class DocumentWatcher:
                                 f"[WARNING] Path mismatch for document {title}: stored={stored_path}, deleted={file_path}"
                             )
 
-            except (json.JSONDecodeError, FileNotFoundError, KeyError) as e:
+            except (orjson.JSONDecodeError, FileNotFoundError, KeyError) as e:
                 self.server.server_log(
                     f"[INFO] Could not parse document file {file_path} for fast removal: {e}, falling back to scan"
                 )
@@ -204,57 +182,57 @@ class DocumentWatcher:
                 f"[ERROR] Failed to mark deleted document as hidden in Redis: {e}"
             )
 
-    def _remove_file_fallback(self, file_path):
-        """Fallback method using full scan when direct lookup fails."""
-        try:
-            pattern = "document:*"
-            cursor = 0
+    def _find_document_hash_by_path(self, file_path):
+        """Look up a document hash by its local path."""
+        doc_hash = self.redis.hget("local_path_to_hash", file_path)
+        if doc_hash:
+            return doc_hash
 
-            while True:
-                cursor, keys = self.server.rc.scan(cursor, match=pattern, count=100)
-
-                for key in keys:
-                    key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-                    doc_data = self.server.rc.hgetall(key_str)
-                    if (
-                        doc_data
-                        and doc_data.get(b"local_path", b"").decode("utf-8")
-                        == file_path
-                    ):
-                        doc_hash = key_str.split(":")[1]
-                        resolved_images_str = doc_data.get(b"images", b"").decode(
-                            "utf-8"
-                        )
-                        unresolved_images_str = doc_data.get(
-                            b"unresolved_images", b""
-                        ).decode("utf-8")
-                        try:
-                            resolved_images = (
-                                json.loads(resolved_images_str)
-                                if resolved_images_str
-                                else []
-                            )
-                            unresolved_images = (
-                                json.loads(unresolved_images_str)
-                                if unresolved_images_str
-                                else []
-                            )
-                        except Exception:
-                            resolved_images = []
-                            unresolved_images = []
+        # Documents stored before the path index existed: one pipelined pass
+        doc_keys = list(self.redis.smembers("documents"))
+        pipe = self.redis.pipeline(transaction=False)
+        for doc_key in doc_keys:
+            pipe.hget(doc_key, "local_path")
 
-                        self._unlink_document_from_images(doc_hash, resolved_images)
+        for doc_key, local_path in zip(doc_keys, pipe.execute()):
+            if local_path == file_path:
+                return doc_key.split(":")[-1]
 
-                        self._remove_pending_image_index(doc_hash, unresolved_images)
+        return None
 
-                        self.server.rc.hset(key_str, "hidden", "true")
-                        self.server.server_log(
-                            f"[INFO] Marked deleted document as hidden in Redis (via fallback): {file_path}"
-                        )
-                        return
+    def _remove_file_fallback(self, file_path):
+        """Fallback used when the deleted file can no longer be read for its title."""
+        try:
+            doc_hash = self._find_document_hash_by_path(file_path)
+            if not doc_hash:
+                return
 
-                if cursor == 0:
-                    break
+            redis_key = f"document:{doc_hash}"
+            resolved_images_str, unresolved_images_str = self.redis.hmget(
+                redis_key, "images", "unresolved_images"
+            )
+            try:
+                resolved_images = (
+                    orjson.loads(resolved_images_str) if resolved_images_str else []
+                )
+                unresolved_images = (
+                    orjson.loads(unresolved_images_str) if unresolved_images_str else []
+                )
+            except Exception:
+                resolved_images = []
+                unresolved_images = []
+
+            pipe = self.redis.pipeline(transaction=False)
+            self._unlink_document_from_images(doc_hash, resolved_images, pipe=pipe)
+            self._remove_pending_image_index(doc_hash, unresolved_images, pipe=pipe)
+            pipe.hset(redis_key, "hidden", "true")
+            pipe.hdel("local_path_to_hash", file_path)
+            pipe.execute()
+            self.server.invalidate_image_caches(*self._image_hashes(resolved_images))
+
+            self.server.server_log(
+                f"[INFO] Marked deleted document as hidden in Redis (via fallback): {file_path}"
+            )
 
         except Exception as e:
             self.server.server_log(f"[ERROR] Fallback document removal failed: {e}")
@@ -265,30 +243,25 @@ class DocumentWatcher:
             return
 
         try:
-            pattern = "document:*"
-            cursor = 0
+            doc_hash = self._find_document_hash_by_path(old_path)
+            if not doc_hash:
+                return
 
-            while True:
-                cursor, keys = self.server.rc.scan(cursor, match=pattern, count=100)
-
-                for key in keys:
-                    key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-                    doc_data = self.server.rc.hgetall(key_str)
-                    if (
-                        doc_data
-                        and doc_data.get(b"local_path", b"").decode("utf-8") == old_path
-                    ):
-                        self.server.rc.hset(key_str, "local_path", new_path)
-                        self.server.rc.hset(
-                            key_str, "filename", os.path.basename(new_path)
-                        )
-                        self.server.server_log(
-                            f"[INFO] Updated moved document path in Redis: {old_path} -> {new_path}"
-                        )
-                        return
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(
+                f"document:{doc_hash}",
+                mapping={
+                    "local_path": new_path,
+                    "filename": os.path.basename(new_path),
+                },
+            )
+            pipe.hdel("local_path_to_hash", old_path)
+            pipe.hset("local_path_to_hash", new_path, doc_hash)
+            pipe.execute()
 
-                if cursor == 0:
-                    break
+            self.server.server_log(
+                f"[INFO] Updated moved document path in Redis: {old_path} -> {new_path}"
+            )
         except Exception as e:
             self.server.server_log(
                 f"[ERROR] Failed to update moved document path in Redis: {e}"
@@ -296,7 +269,8 @@ class DocumentWatcher:
 
     def scan_existing_files(self, folders):
         """Scan and process existing document files in the given folders."""
-        processed_count = 0
+        file_paths = []
+        suffixes = self.document_suffixes
 
         for folder in folders:
             if not os.path.exists(folder):
@@ -304,102 +278,158 @@ class DocumentWatcher:
 
             self.server.server_log(f"[INFO] Processing existing documents in: {folder}")
 
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if self.can_handle(file):
-                        file_path = os.path.join(root, file)
-                        try:
-                            with open(file_path, "r", encoding="utf-8") as f:
-                                doc_data = json.load(f)
-
-                            if "title" in doc_data:
-                                doc_hash = self._generate_document_hash(
-                                    doc_data["title"]
-                                )
-                                redis_key = f"document:{doc_hash}"
+            file_paths.extend(
+                file_path
+                for name, file_path in iter_files(folder)
+                if name.lower().endswith(suffixes)
+            )
 
-                                if not self.server.rc.exists(redis_key):
-                                    self.process_file(file_path, "scanned")
-                                    processed_count += 1
-                        except Exception as e:
-                            self.server.server_log(
-                                f"[ERROR] Failed to process existing document {file_path}: {e}"
-                            )
+        processed_count = 0
+        for i in range(0, len(file_paths), self.SCAN_BATCH_SIZE):
+            processed_count += self.process_documents_batch(
+                file_paths[i : i + self.SCAN_BATCH_SIZE]
+            )
+
+        if processed_count:
+            self.bulk_resolve_unresolved_images()
 
         self.server.server_log(
             f"[INFO] Document scan completed. Processed {processed_count} documents"
         )
         return processed_count
 
-    def _process_single_document(self, file_path):
-        """Process a single document file efficiently during bulk scanning."""
+    def _peek_title(self, file_path):
+        """Stream a document file just far enough to read its top-level title."""
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                doc_data = json.load(f)
-
-            if "title" in doc_data:
-                doc_hash = self._generate_document_hash(doc_data["title"])
-                redis_key = f"document:{doc_hash}"
-
-                if not self.server.rc.exists(redis_key):
-                    self._process_file_fast(file_path, doc_data, doc_hash, "scanned")
-                    return True
-                else:
-                    existing_data = self.server.rc.hgetall(redis_key)
-                    if existing_data:
-                        hidden_status = existing_data.get(b"hidden", b"false").decode(
-                            "utf-8"
-                        )
-                        if hidden_status == "true":
-                            self._process_file_fast(
-                                file_path, doc_data, doc_hash, "unhidden"
-                            )
-                            self.server.rc.hset(redis_key, "hidden", "false")
-                            self.server.server_log(
-                                f"[INFO] Unhidden existing document during scan: {file_path}"
-                            )
-                            return True
-                    return False
-            return False
-
+            with open(file_path, "rb") as f:
+                for prefix, event, value in ijson.parse(f):
+                    if prefix == "title" and event == "string":
+                        return value
         except Exception as e:
-            self.server.server_log(
-                f"[ERROR] Failed to process document {file_path}: {e}"
-            )
-            return False
+            self.server.server_log(f"[ERROR] Failed to read document {file_path}: {e}")
+
+        return None
 
-    def _process_file_fast(self, file_path, doc_data, doc_hash, action):
-        """Fast document processing that skips expensive image resolution."""
+    def _load_document(self, file_path):
+        """Read and hash a document file. Returns (file_path, doc_data, doc_hash) or None."""
         try:
-            is_valid, error_msg = self._validate_document_structure(doc_data)
-            if not is_valid:
+            with open(file_path, "rb") as f:
+                doc_data = orjson.loads(f.read())
+        except Exception as e:
+            self.server.server_log(f"[ERROR] Failed to read document {file_path}: {e}")
+            return None
+
+        if not isinstance(doc_data, dict) or "title" not in doc_data:
+            return None
+
+        return file_path, doc_data, self._generate_document_hash(doc_data["title"])
+
+    def process_documents_batch(self, file_paths):
+        """
+        Process a batch of document files during bulk scanning.
+        Titles are peeked on a thread pool and checked against Redis in one pipeline;
+        only new or hidden documents are then fully parsed and stored.
+        """
+        if not self.server.rc or not file_paths:
+            return 0
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.SCAN_WORKERS, len(file_paths))
+        ) as executor:
+            titled = [
+                (file_path, title)
+                for file_path, title in zip(
+                    file_paths, executor.map(self._peek_title, file_paths)
+                )
+                if title
+            ]
+            if not titled:
+                return 0
+
+            pipe = self.redis.pipeline(transaction=False)
+            for _, title in titled:
+                pipe.hmget(
+                    f"document:{self._generate_document_hash(title)}", "hash", "hidden"
+                )
+            states = pipe.execute()
+
+            pending = {
+                file_path: "scanned" if stored_hash is None else "unhidden"
+                for (file_path, _), (stored_hash, hidden_status) in zip(titled, states)
+                if stored_hash is None or hidden_status == "true"
+            }
+            loaded = [
+                doc for doc in executor.map(self._load_document, pending) if doc
+            ]
+
+        processed_count = 0
+        pipe = self.redis.pipeline(transaction=False)
+        pending_images = defaultdict(list)
+        for file_path, doc_data, doc_hash in loaded:
+            action = pending[file_path]
+            try:
+                self._process_file_fast(
+                    file_path,
+                    doc_data,
+                    doc_hash,
+                    action,
+                    pipe=pipe,
+                    pending=pending_images,
+                )
+                if action == "unhidden":
+                    self.server.server_log(
+                        f"[INFO] Unhidden existing document during scan: {file_path}"
+                    )
+                processed_count += 1
+            except Exception as e:
                 self.server.server_log(
-                    f"[ERROR] Invalid document structure in {file_path}: {error_msg}"
+                    f"[ERROR] Failed to process document {file_path}: {e}"
                 )
-                return
 
-            title = doc_data["title"]
+        # One variadic SADD per filename shared by the batch
+        for filename, doc_hashes in pending_images.items():
+            pipe.sadd(f"pending_image:{filename}", *doc_hashes)
+        pipe.execute()
 
-            images = doc_data.get("images", [])
+        return processed_count
 
-            redis_key = f"document:{doc_hash}"
-            document_data = {
-                "hash": doc_hash,
-                "title": title,
-                "content": doc_data["content"],
-                "images": json.dumps([]),
-                "unresolved_images": json.dumps(images),
-                "url": doc_data.get("url", ""),
-                "date": doc_data.get("date", ""),
-                "local_path": file_path,
-                "remote_path": "",
-                "filename": os.path.basename(file_path),
-                "hidden": "false",
-            }
+    def _process_single_document(self, file_path):
+        """Process a single document file efficiently during bulk scanning."""
+        return self.process_documents_batch([file_path]) > 0
 
-            self.server.rc.hset(redis_key, mapping=document_data)
+    def _process_file_fast(
+        self, file_path, doc_data, doc_hash, action, pipe=None, pending=None
+    ):
+        """
+        Fast document processing that skips expensive image resolution.
+        With a pipeline, writes are queued on it for the caller to execute, and
+        unresolved filenames are collected into pending (filename -> doc hashes).
+        """
+        try:
+            ingested = self._ingest_document(file_path, doc_data, resolve_images=False)
+            if ingested is None:
+                return
+            doc_hash, document_data, _, images = ingested
 
-            self._create_pending_image_index(doc_hash, images)
+            redis_key = f"document:{doc_hash}"
+            target = (
+                pipe if pipe is not None else self.redis.pipeline(transaction=True)
+            )
+            target.hset(redis_key, mapping=document_data)
+            target.sadd("documents", redis_key)
+            target.hset("local_path_to_hash", file_path, doc_hash)
+            if pending is not None:
+                for filename in images:
+                    pending[filename].append(doc_hash)
+            else:
+                self._create_pending_image_index(doc_hash, images, pipe=target)
+
+            if pipe is None:
+                target.execute()
+                self._store_document_image_hashes(doc_hash, [], replace=True)
+            else:
+                # Links are rebuilt by bulk resolution once the scan completes
+                target.delete(f"document_images:{doc_hash}")
 
             # self.server.server_log(
             #     f"[INFO] Processed document {action}: {file_path} -> {doc_hash}"
@@ -410,29 +440,85 @@ class DocumentWatcher:
                 f"[ERROR] Failed to process document {file_path}: {e}"
             )
 
-    def _generate_document_hash(self, title):
+    @classmethod
+    def content_preview(cls, content):
+        """Truncated content shown alongside images, computed once at ingest."""
+        if len(content) > cls.CONTENT_PREVIEW_LENGTH:
+            return content[: cls.CONTENT_PREVIEW_LENGTH] + "..."
+        return content
+
+    @staticmethod
+    @lru_cache(maxsize=100_000)
+    def _generate_document_hash(title):
         """Generate MD5 hash for document based on title."""
-        return hashlib.md5(title.encode("utf-8")).hexdigest()
+        return hashlib.md5(title.encode("utf-8"), usedforsecurity=False).hexdigest()
 
     def _extract_base_filename(self, file_path):
         """Extract base filename without extension for linking."""
         return Path(file_path).stem
 
-    def _validate_document_structure(self, doc_data):
-        """Validate that the document has required fields."""
-        required_fields = ["title", "content"]
-        for field in required_fields:
-            if field not in doc_data:
-                return False, f"Missing required field: {field}"
-        return True, None
+    def _ingest_document(self, file_path, doc_data, resolve_images=True):
+        """
+        Validate a parsed document and build its Redis hash in one pass.
+        Returns (doc_hash, document_data, resolved_images, unresolved_images),
+        or None after logging why the document is invalid.
+        """
+        title = doc_data.get("title")
+        content = doc_data.get("content")
+        if title is None or content is None:
+            missing = "title" if title is None else "content"
+            self.server.server_log(
+                f"[ERROR] Invalid document structure in {file_path}: Missing required field: {missing}"
+            )
+            return None
+
+        images = doc_data.get("images", [])
+        if resolve_images:
+            resolved_images, unresolved_images = self._resolve_image_paths(images)
+        else:
+            resolved_images, unresolved_images = [], images
+
+        doc_hash = self._generate_document_hash(title)
+        document_data = {
+            "hash": doc_hash,
+            "title": title,
+            "content": content,
+            "content_preview": self.content_preview(content),
+            "images": orjson.dumps(resolved_images),
+            "unresolved_images": orjson.dumps(unresolved_images),
+            "url": doc_data.get("url", ""),
+            "date": doc_data.get("date", ""),
+            "local_path": file_path,
+            "remote_path": "",
+            "filename": os.path.basename(file_path),
+            "hidden": "false",
+        }
+
+        return doc_hash, document_data, resolved_images, unresolved_images
 
     def _resolve_image_paths(self, images):
-        """Convert image filenames to hashes and establish bidirectional links."""
+        """
+        Convert image filenames to hashes. Names missing from the filename cache
+        are looked up together in a single HMGET; only hits are cached.
+        """
+        hashes = {
+            filename: self.filename_hash_cache.get(filename) for filename in images
+        }
+
+        missing = [
+            filename for filename, image_hash in hashes.items() if not image_hash
+        ]
+        if missing:
+            found = self.redis.hmget("filename_to_hash_index", missing)
+            for filename, image_hash in zip(missing, found):
+                if image_hash:
+                    self.filename_hash_cache.set(filename, image_hash)
+                    hashes[filename] = image_hash
+
         resolved_images = []
         unresolved_images = []
-
         for image_filename in images:
-            image_hash = self._find_image_hash_by_filename(image_filename)
+            image_hash = hashes[image_filename]
             if image_hash:
                 resolved_images.append({"hash": image_hash, "filename": image_filename})
             else:
@@ -440,212 +526,195 @@ class DocumentWatcher:
 
         return resolved_images, unresolved_images
 
-    def _link_document_to_images(self, doc_hash, resolved_images):
-        """Add this document to the documents list of each linked image."""
-        for image_info in resolved_images:
-            image_hash = image_info["hash"]
-            image_key = f"image:{image_hash}"
-
+    def _link_document_to_images(self, doc_hash, resolved_images, pipe=None):
+        """
+        Add this document to the image_docs:<hash> set of each linked image.
+        With a pipeline, writes are queued on it and the caller invalidates caches after executing.
+        """
+        target = pipe if pipe is not None else self.redis
+        for image_hash in self._image_hashes(resolved_images):
             try:
-                current_docs = self.server.rc.hget(image_key, "documents")
-                if current_docs:
-                    current_docs = (
-                        current_docs.decode("utf-8")
-                        if isinstance(current_docs, bytes)
-                        else current_docs
-                    )
-                    if current_docs:
-                        doc_list = (
-                            json.loads(current_docs) if current_docs != "" else []
-                        )
-                    else:
-                        doc_list = []
-                else:
-                    doc_list = []
-
-                if doc_hash not in doc_list:
-                    doc_list.append(doc_hash)
-                    self.server.rc.hset(image_key, "documents", json.dumps(doc_list))
+                target.sadd(f"image_docs:{image_hash}", f"document:{doc_hash}")
+                if pipe is None:
+                    self.server.invalidate_image_caches(image_hash)
 
             except Exception as e:
                 self.server.server_log(
                     f"[ERROR] Failed to link document {doc_hash} to image {image_hash}: {e}"
                 )
 
-    def _unlink_document_from_images(self, doc_hash, resolved_images):
-        """Remove this document from the documents list of each linked image."""
-        for image_info in resolved_images:
-            if isinstance(image_info, dict) and "hash" in image_info:
-                image_hash = image_info["hash"]
-                image_key = f"image:{image_hash}"
-
-                try:
-                    current_docs = self.server.rc.hget(image_key, "documents")
-                    if current_docs:
-                        current_docs = (
-                            current_docs.decode("utf-8")
-                            if isinstance(current_docs, bytes)
-                            else current_docs
-                        )
-                        if current_docs:
-                            doc_list = (
-                                json.loads(current_docs) if current_docs != "" else []
-                            )
-                        else:
-                            doc_list = []
-                    else:
-                        doc_list = []
-
-                    if doc_hash in doc_list:
-                        doc_list.remove(doc_hash)
-                        self.server.rc.hset(
-                            image_key, "documents", json.dumps(doc_list)
-                        )
-
-                except Exception as e:
-                    self.server.server_log(
-                        f"[ERROR] Failed to unlink document {doc_hash} from image {image_hash}: {e}"
-                    )
-
-    def _find_image_hash_by_filename(self, filename):
-        """Find image hash in Redis."""
-        if not self.server.rc:
-            return None
-
+    def _store_document_image_hashes(self, doc_hash, resolved_images, replace=False):
+        """Mirror resolved image hashes into the document_images:<hash> set."""
         try:
-            filename_index_key = "filename_to_hash_index"
-            image_hash = self.server.rc.hget(filename_index_key, filename)
-
-            if image_hash:
-                return (
-                    image_hash.decode("utf-8")
-                    if isinstance(image_hash, bytes)
-                    else image_hash
-                )
-
-            return None
+            key = f"document_images:{doc_hash}"
+            image_hashes = [
+                image_info["hash"]
+                for image_info in resolved_images
+                if isinstance(image_info, dict) and image_info.get("hash")
+            ]
+
+            # Replacing reads the old set before deleting it, so keep that atomic
+            pipe = self.redis.pipeline(transaction=replace)
+            if replace:
+                pipe.smembers(key)
+                pipe.delete(key)
+            if image_hashes:
+                pipe.sadd(key, *image_hashes)
+            results = pipe.execute()
+
+            if replace:
+                # Images dropped from the document must not serve cached details
+                self.server.invalidate_image_caches(*results[0])
         except Exception as e:
             self.server.server_log(
-                f"[ERROR] Failed to find image hash for {filename}: {e}"
+                f"[ERROR] Failed to store image hashes for document {doc_hash}: {e}"
             )
-            return None
+
+    def _unlink_document_from_images(self, doc_hash, resolved_images, pipe=None):
+        """
+        Remove this document from the image_docs:<hash> set of each linked image.
+        With a pipeline, writes are queued on it and the caller invalidates caches after executing.
+        """
+        target = pipe if pipe is not None else self.redis
+        for image_hash in self._image_hashes(resolved_images):
+            try:
+                target.srem(f"image_docs:{image_hash}", f"document:{doc_hash}")
+                if pipe is None:
+                    self.server.invalidate_image_caches(image_hash)
+
+            except Exception as e:
+                self.server.server_log(
+                    f"[ERROR] Failed to unlink document {doc_hash} from image {image_hash}: {e}"
+                )
+
+    def _image_hashes(self, resolved_images):
+        """Hashes of the well-formed entries of a resolved images list."""
+        return [
+            image_info["hash"]
+            for image_info in resolved_images
+            if isinstance(image_info, dict) and image_info.get("hash")
+        ]
+
+    def invalidate_filename(self, *filenames):
+        """Drop cached image hashes for filenames whose index entry changed."""
+        self.filename_hash_cache.pop(*filenames)
 
     def resolve_pending_images_for_filename(self, filename, image_hash):
         """When a new image is added, check if any documents are waiting for it."""
-        if not self.server.rc:
-            return
+        self.resolve_pending_images_bulk([(filename, image_hash)])
+
+    def resolve_pending_images_bulk(self, pairs):
+        """
+        Link every document waiting on any of the (filename, image_hash) pairs.
+        Pending sets and documents are read with one pipeline each and all updates
+        are flushed in one more. Returns the number of documents updated.
+        """
+        if not self.server.rc or not pairs:
+            return 0
 
         try:
-            pending_key = f"pending_image:{filename}"
-            waiting_docs = self.server.rc.smembers(pending_key)
+            pipe = self.redis.pipeline(transaction=False)
+            for filename, _ in pairs:
+                pipe.smembers(f"pending_image:{filename}")
+            waiting_sets = pipe.execute()
+
+            # doc_hash -> {filename: image_hash} for the images it waits on
+            waiting = defaultdict(dict)
+            for (filename, image_hash), doc_hashes in zip(pairs, waiting_sets):
+                for doc_hash in doc_hashes:
+                    waiting[doc_hash][filename] = image_hash
+
+            if not waiting:
+                return 0
 
-            documents_updated = []
+            doc_hashes = list(waiting)
+            pipe = self.redis.pipeline(transaction=False)
+            for doc_hash in doc_hashes:
+                pipe.hmget(f"document:{doc_hash}", "unresolved_images", "images")
+            doc_fields = pipe.execute()
 
-            for doc_hash_bytes in waiting_docs:
-                doc_hash = (
-                    doc_hash_bytes.decode("utf-8")
-                    if isinstance(doc_hash_bytes, bytes)
-                    else doc_hash_bytes
-                )
-                doc_key = f"document:{doc_hash}"
+            documents_updated = 0
+            updated_images = set()
+            pipe = self.redis.pipeline(transaction=False)
+            for doc_hash, (unresolved_images_str, resolved_images_str) in zip(
+                doc_hashes, doc_fields
+            ):
+                if not unresolved_images_str:
+                    continue
 
                 try:
-                    unresolved_images_str = self.server.rc.hget(
-                        doc_key, "unresolved_images"
-                    )
-                    if unresolved_images_str:
-                        unresolved_images_str = (
-                            unresolved_images_str.decode("utf-8")
-                            if isinstance(unresolved_images_str, bytes)
-                            else unresolved_images_str
-                        )
-                        try:
-                            unresolved_images = (
-                                json.loads(unresolved_images_str)
-                                if unresolved_images_str
-                                else []
-                            )
-                        except Exception:
-                            unresolved_images = []
-
-                        if filename in unresolved_images:
-                            unresolved_images.remove(filename)
-
-                            resolved_images_str = self.server.rc.hget(doc_key, "images")
-                            if resolved_images_str:
-                                resolved_images_str = (
-                                    resolved_images_str.decode("utf-8")
-                                    if isinstance(resolved_images_str, bytes)
-                                    else resolved_images_str
-                                )
-                                try:
-                                    resolved_images = (
-                                        json.loads(resolved_images_str)
-                                        if resolved_images_str
-                                        else []
-                                    )
-                                except Exception:
-                                    resolved_images = []
-                            else:
-                                resolved_images = []
-
-                            resolved_images.append(
-                                {"hash": image_hash, "filename": filename}
-                            )
+                    unresolved_images = orjson.loads(unresolved_images_str)
+                except Exception:
+                    continue
 
-                            self.server.rc.hset(
-                                doc_key, "images", json.dumps(resolved_images)
-                            )
-                            self.server.rc.hset(
-                                doc_key,
-                                "unresolved_images",
-                                json.dumps(unresolved_images),
-                            )
+                found = waiting[doc_hash]
+                newly_resolved = [
+                    {"hash": found[filename], "filename": filename}
+                    for filename in dict.fromkeys(unresolved_images)
+                    if filename in found
+                ]
+                if not newly_resolved:
+                    continue
 
-                            self._link_document_to_images(
-                                doc_hash, [{"hash": image_hash, "filename": filename}]
-                            )
+                try:
+                    resolved_images = (
+                        orjson.loads(resolved_images_str) if resolved_images_str else []
+                    )
+                except Exception:
+                    resolved_images = []
+                resolved_images.extend(newly_resolved)
+                still_unresolved = [
+                    filename for filename in unresolved_images if filename not in found
+                ]
+
+                pipe.hset(
+                    f"document:{doc_hash}",
+                    mapping={
+                        "images": orjson.dumps(resolved_images),
+                        "unresolved_images": orjson.dumps(still_unresolved),
+                    },
+                )
+                new_hashes = self._image_hashes(newly_resolved)
+                pipe.sadd(f"document_images:{doc_hash}", *new_hashes)
+                self._link_document_to_images(doc_hash, newly_resolved, pipe=pipe)
 
-                            documents_updated.append(doc_hash)
+                updated_images.update(new_hashes)
+                documents_updated += 1
 
-                except Exception as e:
-                    self.server.server_log(
-                        f"[ERROR] Failed to update document {doc_hash} for image {filename}: {e}"
-                    )
+            pipe.delete(*(f"pending_image:{filename}" for filename, _ in pairs))
+            pipe.execute()
 
-            if waiting_docs:
-                self.server.rc.delete(pending_key)
+            if updated_images:
+                self.server.invalidate_image_caches(*updated_images)
 
-            # if documents_updated:
-            #     self.server.server_log(
-            #         f"[INFO] Efficiently linked image {filename} ({image_hash}) to {len(documents_updated)} documents using Redis sets"
-            #     )
+            return documents_updated
 
         except Exception as e:
-            self.server.server_log(
-                f"[ERROR] Failed to resolve pending images for {filename}: {e}"
-            )
+            self.server.server_log(f"[ERROR] Failed to resolve pending images: {e}")
+            return 0
 
-    def _create_pending_image_index(self, doc_hash, unresolved_images):
+    def _create_pending_image_index(self, doc_hash, unresolved_images, pipe=None):
         """Create Redis sets for efficiency."""
+        target = pipe if pipe is not None else self.redis
         try:
             for filename in unresolved_images:
                 pending_key = f"pending_image:{filename}"
-                self.server.rc.sadd(pending_key, doc_hash)
+                target.sadd(pending_key, doc_hash)
         except Exception as e:
             self.server.server_log(
                 f"[ERROR] Failed to create pending image index for document {doc_hash}: {e}"
             )
 
-    def _remove_pending_image_index(self, doc_hash, unresolved_images):
-        """Remove document from pending image sets when document is removed/resolved."""
+    def _remove_pending_image_index(self, doc_hash, unresolved_images, pipe=None):
+        """
+        Remove document from pending image sets when document is removed/resolved.
+        Redis deletes a set once its last member is removed, so no cleanup is needed.
+        """
+        target = pipe if pipe is not None else self.redis
         try:
             for filename in unresolved_images:
                 pending_key = f"pending_image:{filename}"
-                self.server.rc.srem(pending_key, doc_hash)
-                # Clean up empty sets
-                if not self.server.rc.smembers(pending_key):
-                    self.server.rc.delete(pending_key)
+                target.srem(pending_key, doc_hash)
         except Exception as e:
             self.server.server_log(
                 f"[ERROR] Failed to remove pending image index for document {doc_hash}: {e}"
@@ -660,43 +729,48 @@ class DocumentWatcher:
             return {"success": False, "error": "Redis not connected"}
 
         try:
-            filename_index = self.server.rc.hgetall("filename_to_hash_index")
-            filename_to_hash = {}
-            for k, v in filename_index.items():
-                key = k.decode("utf-8") if isinstance(k, bytes) else k
-                value = v.decode("utf-8") if isinstance(v, bytes) else v
-                filename_to_hash[key] = value
-
-            if not filename_to_hash:
-                return {
-                    "success": True,
-                    "resolved_count": 0,
-                    "message": "No filename index found",
-                }
-
-            doc_keys = self.server.rc.keys("document:*")
+            doc_keys = list(self.redis.smembers("documents"))
             total_resolved = 0
             documents_updated = 0
 
+            pipe = self.redis.pipeline(transaction=False)
             for doc_key in doc_keys:
-                doc_data = self.server.rc.hgetall(doc_key)
-                if not doc_data or b"unresolved_images" not in doc_data:
+                pipe.hmget(doc_key, "images", "unresolved_images")
+            rows = pipe.execute()
+
+            waiting = []
+            for doc_key, (resolved_raw, unresolved_raw) in zip(doc_keys, rows):
+                if not unresolved_raw:
                     continue
 
-                unresolved_raw = doc_data[b"unresolved_images"].decode("utf-8")
                 try:
-                    unresolved_images = (
-                        json.loads(unresolved_raw) if unresolved_raw else []
-                    )
+                    unresolved_images = orjson.loads(unresolved_raw)
                 except Exception:
                     continue
 
-                if not unresolved_images:
-                    continue
+                if unresolved_images:
+                    waiting.append((doc_key, resolved_raw, unresolved_images))
 
-                resolved_raw = doc_data.get(b"images", b"[]").decode("utf-8")
+            # Look up only the filenames some document is waiting for
+            filenames = list(
+                {filename for _, _, unresolved in waiting for filename in unresolved}
+            )
+            filename_to_hash = {}
+            if filenames:
+                found = self.redis.hmget("filename_to_hash_index", filenames)
+                filename_to_hash = {
+                    filename: image_hash
+                    for filename, image_hash in zip(filenames, found)
+                    if image_hash
+                }
+
+            pipe = self.redis.pipeline(transaction=False)
+            # Links and pending removals are grouped by key: one SADD/SREM per set
+            image_doc_links = defaultdict(list)
+            pending_removals = defaultdict(list)
+            for doc_key, resolved_raw, unresolved_images in waiting:
                 try:
-                    resolved_images = json.loads(resolved_raw) if resolved_raw else []
+                    resolved_images = orjson.loads(resolved_raw) if resolved_raw else []
                 except Exception:
                     resolved_images = []
 
@@ -717,21 +791,32 @@ class DocumentWatcher:
                 if newly_resolved:
                     resolved_images.extend(newly_resolved)
 
-                    doc_hash = doc_key.decode("utf-8").replace("document:", "")
-                    self.server.rc.hset(doc_key, "images", json.dumps(resolved_images))
-                    self.server.rc.hset(
-                        doc_key, "unresolved_images", json.dumps(still_unresolved)
+                    doc_hash = doc_key.replace("document:", "")
+                    pipe.hset(
+                        doc_key,
+                        mapping={
+                            "images": orjson.dumps(resolved_images),
+                            "unresolved_images": orjson.dumps(still_unresolved),
+                        },
                     )
-
-                    self._link_document_to_images(doc_hash, newly_resolved)
-
+                    new_hashes = self._image_hashes(newly_resolved)
+                    if new_hashes:
+                        pipe.sadd(f"document_images:{doc_hash}", *new_hashes)
+                    for image_hash in new_hashes:
+                        image_doc_links[image_hash].append(doc_key)
                     for image_info in newly_resolved:
-                        self._remove_pending_image_index(
-                            doc_hash, [image_info["filename"]]
-                        )
+                        pending_removals[image_info["filename"]].append(doc_hash)
 
                     documents_updated += 1
 
+            if documents_updated:
+                for image_hash, linked_docs in image_doc_links.items():
+                    pipe.sadd(f"image_docs:{image_hash}", *linked_docs)
+                for filename, doc_hashes in pending_removals.items():
+                    pipe.srem(f"pending_image:{filename}", *doc_hashes)
+                pipe.execute()
+                self.server.invalidate_image_caches(*image_doc_links)
+
             self.server.server_log(
                 f"[INFO] Bulk resolution completed: {total_resolved} images resolved across {documents_updated} documents"
             )
@@ -748,6 +833,71 @@ class DocumentWatcher:
             self.server.server_log(f"[ERROR] {error_msg}")
             return {"success": False, "error": error_msg}
 
+    def rebuild_image_document_index(self):
+        """
+        Rebuild the documents set, the local_path_to_hash index and the
+        image_docs:<hash> / document_images:<hash> sets from every visible
+        document. Keeps databases created before these indexes existed in sync.
+        """
+        if not self.server.rc:
+            return 0
+
+        try:
+            doc_keys = []
+            cursor = 0
+            while True:
+                cursor, keys = self.redis.scan(
+                    cursor, match="document:*", count=1000
+                )
+                doc_keys.extend(keys)
+                if cursor == 0:
+                    break
+
+            if not doc_keys:
+                return 0
+
+            self.redis.sadd("documents", *doc_keys)
+
+            pipe = self.redis.pipeline(transaction=False)
+            for doc_key in doc_keys:
+                pipe.hmget(doc_key, "images", "hidden", "local_path")
+            results = pipe.execute()
+
+            links = 0
+            pipe = self.redis.pipeline(transaction=False)
+            for doc_key, (images_raw, hidden_raw, local_path) in zip(
+                doc_keys, results
+            ):
+                if hidden_raw == "true":
+                    continue
+
+                doc_hash = doc_key.split(":")[-1]
+                if local_path:
+                    pipe.hset("local_path_to_hash", local_path, doc_hash)
+
+                if not images_raw:
+                    continue
+
+                try:
+                    images = orjson.loads(images_raw)
+                except Exception:
+                    continue
+
+                for image_info in images:
+                    if isinstance(image_info, dict) and image_info.get("hash"):
+                        pipe.sadd(f"image_docs:{image_info['hash']}", doc_key)
+                        pipe.sadd(f"document_images:{doc_hash}", image_info["hash"])
+                        links += 1
+            pipe.execute()
+
+            return links
+
+        except Exception as e:
+            self.server.server_log(
+                f"[ERROR] Failed to rebuild image-document reverse index: {e}"
+            )
+            return 0
+
     def resolve_single_document_images(self, doc_hash):
         """
         Resolve unresolved images for a single document.
@@ -758,54 +908,51 @@ class DocumentWatcher:
 
         try:
             doc_key = f"document:{doc_hash}"
-            doc_data = self.server.rc.hgetall(doc_key)
-            if not doc_data or b"unresolved_images" not in doc_data:
+            resolved_raw, unresolved_raw = self.redis.hmget(
+                doc_key, "images", "unresolved_images"
+            )
+            if not unresolved_raw:
                 return 0
 
-            filename_index = self.server.rc.hgetall("filename_to_hash_index")
-            filename_to_hash = {}
-            for k, v in filename_index.items():
-                key = k.decode("utf-8") if isinstance(k, bytes) else k
-                value = v.decode("utf-8") if isinstance(v, bytes) else v
-                filename_to_hash[key] = value
-
-            unresolved_raw = doc_data[b"unresolved_images"].decode("utf-8")
             try:
-                unresolved_images = json.loads(unresolved_raw) if unresolved_raw else []
+                unresolved_images = orjson.loads(unresolved_raw)
             except Exception:
                 return 0
 
             if not unresolved_images:
                 return 0
 
-            resolved_raw = doc_data.get(b"images", b"[]").decode("utf-8")
             try:
-                resolved_images = json.loads(resolved_raw) if resolved_raw else []
+                resolved_images = orjson.loads(resolved_raw) if resolved_raw else []
             except Exception:
                 resolved_images = []
 
-            newly_resolved = []
-            still_unresolved = []
-
-            for filename in unresolved_images:
-                if filename in filename_to_hash:
-                    image_hash = filename_to_hash[filename]
-                    newly_resolved.append({"hash": image_hash, "filename": filename})
-                else:
-                    still_unresolved.append(filename)
+            # Only this document's filenames are looked up, via the filename cache
+            newly_resolved, still_unresolved = self._resolve_image_paths(
+                unresolved_images
+            )
 
             if newly_resolved:
                 resolved_images.extend(newly_resolved)
-
-                self.server.rc.hset(doc_key, "images", json.dumps(resolved_images))
-                self.server.rc.hset(
-                    doc_key, "unresolved_images", json.dumps(still_unresolved)
+                new_hashes = self._image_hashes(newly_resolved)
+
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.hset(
+                    doc_key,
+                    mapping={
+                        "images": orjson.dumps(resolved_images),
+                        "unresolved_images": orjson.dumps(still_unresolved),
+                    },
                 )
-
-                self._link_document_to_images(doc_hash, newly_resolved)
-
-                for image_info in newly_resolved:
-                    self._remove_pending_image_index(doc_hash, [image_info["filename"]])
+                pipe.sadd(f"document_images:{doc_hash}", *new_hashes)
+                self._link_document_to_images(doc_hash, newly_resolved, pipe=pipe)
+                self._remove_pending_image_index(
+                    doc_hash,
+                    [image_info["filename"] for image_info in newly_resolved],
+                    pipe=pipe,
+                )
+                pipe.execute()
+                self.server.invalidate_image_caches(*new_hashes)
 
                 # self.server.server_log(
                 #     f"[INFO] Auto-resolved {len(newly_resolved)} images for document {doc_hash}"
@@ -0,0 +1,69 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Directory listings kept in flight at once; helps most on network mounts
+SCAN_WORKERS = 16
+
+
+def _scan_directory(directory):
+    """
+    List one directory as ([(name, path), ...] for files, [path, ...] for subdirectories).
+    Symlinked directories are neither followed nor listed as files, and unreadable
+    directories are skipped, matching os.walk's defaults.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif not entry.is_dir():
+                    files.append((entry.name, entry.path))
+    except OSError:
+        pass
+    return files, subdirs
+
+
+def iter_files(folder):
+    """
+    Yield (name, path) for every file below folder.
+    Walks with os.scandir so directory entries are not stat'ed again.
+    """
+    stack = [folder]
+    while stack:
+        files, subdirs = _scan_directory(stack.pop())
+        stack.extend(subdirs)
+        yield from files
+
+
+def list_files(folders, max_workers=SCAN_WORKERS):
+    """
+    Return (name, path) for every file below the given folders.
+    Each level of the tree is listed on a thread pool, so slow directory reads
+    overlap instead of being waited on one by one.
+    """
+    files = []
+    frontier = list(folders)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier:
+            next_frontier = []
+            for directory_files, subdirs in executor.map(_scan_directory, frontier):
+                files.extend(directory_files)
+                next_frontier.extend(subdirs)
+            frontier = next_frontier
+
+    return files
+
+
+def paths_exist(paths, max_workers=SCAN_WORKERS):
+    """
+    Return os.path.exists for each path, in order.
+    Checks run on a thread pool, since on network mounts each one is a round trip.
+    """
+    if len(paths) < 2:
+        return [os.path.exists(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(os.path.exists, paths))
@@ -1,13 +1,19 @@
 import os
 import time
+import queue
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+from utils.file_scan import list_files
 from utils.image_watcher import ImageWatcher
 from utils.document_watcher import DocumentWatcher
 
 
 class GenericWatcherEventHandler(FileSystemEventHandler):
+    DEBOUNCE_DELAY = 0.05  # quiet period before a burst of events is flushed
+    DEBOUNCE_WINDOW = 0.5  # events this soon after a dispatch are coalesced
+
     def __init__(self, server_instance):
         self.server = server_instance
 
@@ -17,12 +23,125 @@ class GenericWatcherEventHandler(FileSystemEventHandler):
 
         self.watchers = [self.image_watcher, self.document_watcher]
 
+        # Lowercase extension -> watcher, so classifying a file is one dict lookup
+        self.extension_map = {}
+        for watcher in self.watchers:
+            for ext in getattr(watcher, "image_extensions", ()):
+                self.extension_map[ext] = watcher
+            for ext in getattr(watcher, "document_extensions", ()):
+                self.extension_map[ext] = watcher
+
+        # Coalescing of created/modified bursts: path -> latest action
+        self.pending_events = {}
+        self.last_dispatched = {}
+        self.pending_lock = threading.Lock()
+        self.flush_timer = None
+        self.burst_started = 0.0
+
+        # Redis work runs on one background thread so the observer thread never
+        # waits on it; a single queue keeps events for a path in order
+        self.work_queue = queue.SimpleQueue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+
     def _get_handler_for_file(self, file_path):
         """Get the appropriate handler for a file based on its extension."""
-        for watcher in self.watchers:
-            if watcher.can_handle(file_path):
-                return watcher
-        return None
+        return self.extension_map.get(os.path.splitext(file_path)[1].lower())
+
+    def _submit(self, func, *args):
+        """Queue func(*args) for the background worker, starting it on first use."""
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run_worker, daemon=True)
+                self.worker.start()
+        self.work_queue.put((func, args))
+
+    def _run_worker(self):
+        """Run queued watcher calls one at a time until a None sentinel arrives."""
+        while True:
+            task = self.work_queue.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                self.server.server_log(
+                    f"[ERROR] Failed to handle {args[0]} in {func.__name__}: {e}"
+                )
+
+    def stop_worker(self):
+        """Let the background worker finish queued calls, then exit."""
+        with self.worker_lock:
+            if self.worker is not None:
+                self.work_queue.put(None)
+                self.worker.join()
+                self.worker = None
+
+    def _schedule_process(self, handler, file_path, action):
+        """
+        Process the first event for a path right away; later events within
+        DEBOUNCE_WINDOW are coalesced and flushed once the burst goes quiet,
+        or at the latest DEBOUNCE_WINDOW after it started.
+        """
+        now = time.monotonic()
+        with self.pending_lock:
+            last = self.last_dispatched.get(file_path)
+            if file_path not in self.pending_events and (
+                last is None or now - last >= self.DEBOUNCE_WINDOW
+            ):
+                self.last_dispatched[file_path] = now
+                self._prune_dispatched(now)
+                immediate = True
+            else:
+                self.pending_events[file_path] = action
+                if self.flush_timer is None:
+                    self.burst_started = now
+                elif now - self.burst_started < self.DEBOUNCE_WINDOW:
+                    self.flush_timer.cancel()
+                else:
+                    # Burst has run long enough: let the armed flush fire
+                    return
+
+                self.flush_timer = threading.Timer(
+                    self.DEBOUNCE_DELAY, self._flush_pending
+                )
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+                immediate = False
+
+        if immediate:
+            self._submit(handler.process_file, file_path, action)
+
+    def _flush_pending(self):
+        """Process the latest coalesced event for every pending path."""
+        now = time.monotonic()
+        with self.pending_lock:
+            events = self.pending_events
+            self.pending_events = {}
+            self.flush_timer = None
+            for file_path in events:
+                self.last_dispatched[file_path] = now
+            self._prune_dispatched(now)
+
+        for file_path, action in events.items():
+            handler = self._get_handler_for_file(file_path)
+            if handler:
+                self._submit(handler.process_file, file_path, action)
+
+    def _prune_dispatched(self, now):
+        """Forget dispatch times that can no longer cause coalescing. Caller holds the lock."""
+        if len(self.last_dispatched) > 1024:
+            self.last_dispatched = {
+                path: dispatched
+                for path, dispatched in self.last_dispatched.items()
+                if now - dispatched < self.DEBOUNCE_WINDOW
+            }
+
+    def _cancel_pending(self, file_path):
+        """Drop a coalesced event for a path that was deleted or moved away."""
+        with self.pending_lock:
+            self.pending_events.pop(file_path, None)
 
     def on_created(self, event):
         if event.is_directory:
@@ -32,7 +151,7 @@ class GenericWatcherEventHandler(FileSystemEventHandler):
 
         handler = self._get_handler_for_file(event.src_path)
         if handler:
-            handler.process_file(event.src_path, "created")
+            self._schedule_process(handler, event.src_path, "created")
 
     def on_deleted(self, event):
         if event.is_directory:
@@ -40,9 +159,11 @@ class GenericWatcherEventHandler(FileSystemEventHandler):
 
         self.server.server_log(f"[WATCHER EVENT] File deleted: {event.src_path}")
 
+        self._cancel_pending(event.src_path)
+
         handler = self._get_handler_for_file(event.src_path)
         if handler:
-            handler.remove_file(event.src_path)
+            self._submit(handler.remove_file, event.src_path)
 
     def on_modified(self, event):
         if event.is_directory:
@@ -52,7 +173,7 @@ class GenericWatcherEventHandler(FileSystemEventHandler):
 
         handler = self._get_handler_for_file(event.src_path)
         if handler:
-            handler.process_file(event.src_path, "modified")
+            self._schedule_process(handler, event.src_path, "modified")
 
     def on_moved(self, event):
         if event.is_directory:
@@ -62,18 +183,20 @@ class GenericWatcherEventHandler(FileSystemEventHandler):
             f"[WATCHER EVENT] File moved from {event.src_path} to {event.dest_path}"
         )
 
+        self._cancel_pending(event.src_path)
+
         # Handle both source and destination
         old_handler = self._get_handler_for_file(event.src_path)
         new_handler = self._get_handler_for_file(event.dest_path)
 
         if old_handler and new_handler and old_handler == new_handler:
-            old_handler.update_file_path(event.src_path, event.dest_path)
+            self._submit(old_handler.update_file_path, event.src_path, event.dest_path)
         else:
             # Different file types or handlers, treat as delete + create
             if old_handler:
-                old_handler.remove_file(event.src_path)
+                self._submit(old_handler.remove_file, event.src_path)
             if new_handler:
-                new_handler.process_file(event.dest_path, "created")
+                self._submit(new_handler.process_file, event.dest_path, "created")
 
     def on_any_event(self, event):
         if event.is_directory:
@@ -114,6 +237,8 @@ class GenericFileWatcher:
         for observer in self.observers:
             observer.stop()
             observer.join()
+        self.handler.stop_worker()
+        self.handler.image_watcher.shutdown()
         self.server.server_log("[INFO] Generic file watcher stopped")
 
     def scan_existing_files(self):
@@ -126,25 +251,25 @@ class GenericFileWatcher:
         image_files = []
         document_files = []
 
+        extension_map = self.handler.extension_map
+        image_watcher = self.handler.image_watcher
+        document_watcher = self.handler.document_watcher
+
+        folders = []
         for folder in self.watch_directories:
             if not os.path.exists(folder):
                 continue
 
             self.server.server_log(f"[INFO] Scanning directory structure: {folder}")
+            folders.append(folder)
 
-            for root, dirs, files in os.walk(folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-
-                    for watcher in self.handler.watchers:
-                        if watcher.can_handle(file_path):
-                            if hasattr(watcher, "image_extensions"):  # ImageWatcher
-                                image_files.append(file_path)
-                            elif hasattr(
-                                watcher, "document_extensions"
-                            ):  # DocumentWatcher
-                                document_files.append(file_path)
-                            break
+        # Directories are listed concurrently; classification stays on this thread
+        for name, file_path in list_files(folders):
+            watcher = extension_map.get(os.path.splitext(name)[1].lower())
+            if watcher is image_watcher:
+                image_files.append(file_path)
+            elif watcher is document_watcher:
+                document_files.append(file_path)
 
         self.server.server_log(
             f"[INFO] Found {len(image_files)} images and {len(document_files)} documents to process"
@@ -153,32 +278,16 @@ class GenericFileWatcher:
         # Process documents first (faster)
         if document_files:
             self.server.server_log("[INFO] Processing documents...")
-            doc_watcher = None
-            for watcher in self.handler.watchers:
-                if hasattr(watcher, "document_extensions"):
-                    doc_watcher = watcher
-                    break
-
-            if doc_watcher:
-                doc_processed = self._process_files_batch(
-                    doc_watcher, document_files, "documents"
-                )
-                total_processed += doc_processed
+            total_processed += self._process_files_batch(
+                document_watcher, document_files, "documents"
+            )
 
         # Process images in batches to avoid blocking
         if image_files:
             self.server.server_log("[INFO] Processing images in batches...")
-            img_watcher = None
-            for watcher in self.handler.watchers:
-                if hasattr(watcher, "image_extensions"):
-                    img_watcher = watcher
-                    break
-
-            if img_watcher:
-                img_processed = self._process_files_batch(
-                    img_watcher, image_files, "images"
-                )
-                total_processed += img_processed
+            total_processed += self._process_files_batch(
+                image_watcher, image_files, "images"
+            )
 
         self._run_bulk_resolution()
 
@@ -202,18 +311,21 @@ class GenericFileWatcher:
                 f"files {i + 1}-{batch_end} of {total_files}"
             )
 
-            for file_path in batch:
+            if file_type == "documents":
                 try:
-                    if file_type == "documents":
-                        if watcher._process_single_document(file_path):
-                            processed_count += 1
-                    else:  # images
-                        if watcher._process_single_image(file_path):
-                            processed_count += 1
-
+                    processed_count += watcher.process_documents_batch(batch)
                 except Exception as e:
                     self.server.server_log(
-                        f"[ERROR] Failed to process {file_type[:-1]} {file_path}: {e}"
+                        f"[ERROR] Failed to process documents batch {i // batch_size + 1}: {e}"
+                    )
+            else:  # images
+                try:
+                    processed_count += watcher.process_files_batch(
+                        batch, batch_size=batch_size
+                    )
+                except Exception as e:
+                    self.server.server_log(
+                        f"[ERROR] Failed to process images batch {i // batch_size + 1}: {e}"
                     )
 
             # Small delay between batches to allow other operations
@@ -229,23 +341,18 @@ class GenericFileWatcher:
         try:
             self.server.server_log("[INFO] Running bulk image-document resolution...")
 
-            doc_watcher = None
-            for watcher in self.handler.watchers:
-                if hasattr(watcher, "document_extensions"):
-                    doc_watcher = watcher
-                    break
+            document_watcher = self.handler.document_watcher
+            links = document_watcher.rebuild_image_document_index()
+            self.server.server_log(
+                f"[INFO] Image-document reverse index holds {links} links"
+            )
 
-            if doc_watcher:
-                result = doc_watcher.bulk_resolve_unresolved_images()
-                if result["success"]:
-                    self.server.server_log(f"[INFO] {result['message']}")
-                else:
-                    self.server.server_log(
-                        f"[ERROR] Bulk resolution failed: {result['error']}"
-                    )
+            result = document_watcher.bulk_resolve_unresolved_images()
+            if result["success"]:
+                self.server.server_log(f"[INFO] {result['message']}")
             else:
                 self.server.server_log(
-                    "[WARNING] Document watcher not found for bulk resolution"
+                    f"[ERROR] Bulk resolution failed: {result['error']}"
                 )
 
         except Exception as e:
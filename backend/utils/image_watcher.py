@@ -1,18 +1,72 @@
 import os
-import imagehash
 
+import numpy as np
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.file_scan import iter_files
+
+
+def _dhash(img, hash_size=8):
+    """
+    Difference hash as a hex string, identical to str(imagehash.dhash(img)):
+    same grayscale LANCZOS resize, but bits are packed with NumPy instead of
+    being formatted through a Python bit string.
+    """
+    pixels = np.asarray(
+        img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    )
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def _hash_image(file_path):
+    """Return (dhash hex string, None) for an image file, or (None, error message)."""
+    try:
+        with Image.open(file_path) as img:
+            if img.mode == "P" and "transparency" in img.info:
+                img = img.convert("RGBA")  # Avoid PIL warnings
+            return _dhash(img), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _path_meta(stat):
+    """Fingerprint stored in path_meta_index as a prefix of "mtime_ns:size:hash"."""
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
 
 
 class ImageWatcher:
+    HASH_WORKERS = os.cpu_count() or 1
+    RESOLVE_BATCH_SIZE = 1000
+
     def __init__(self, server_instance):
         self.server = server_instance
-        self.image_extensions = {".jpg", ".jpeg", ".png"}
+        self.image_extensions = frozenset({".jpg", ".jpeg", ".png"})
+        # Suffix tuple and longest suffix, so can_handle lowercases a bounded tail
+        self.image_suffixes = tuple(self.image_extensions)
+        self.suffix_length = max(map(len, self.image_suffixes))
+        self.hash_executor = None
+
+    def _get_hash_executor(self):
+        """
+        Thread pool used to hash scanned images on every core, created on first use.
+        PIL releases the GIL while decoding and resizing, which is most of the work.
+        """
+        if self.hash_executor is None and self.HASH_WORKERS > 1:
+            self.hash_executor = ThreadPoolExecutor(max_workers=self.HASH_WORKERS)
+        return self.hash_executor
+
+    def shutdown(self):
+        """Stop the hashing pool, if one was started."""
+        if self.hash_executor is not None:
+            self.hash_executor.shutdown(wait=False, cancel_futures=True)
+            self.hash_executor = None
 
     def can_handle(self, file_path):
         """Check if this watcher can handle the given file."""
-        _, ext = os.path.splitext(file_path.lower())
-        return ext in self.image_extensions
+        return (
+            file_path[-self.suffix_length :].lower().endswith(self.image_suffixes)
+        )
 
     def process_file(self, file_path, action="created"):
         """Process an image file and store it in Redis."""
@@ -20,72 +74,55 @@ class ImageWatcher:
             return
 
         try:
-            # Generate hash
-            with Image.open(file_path) as img:
-                if img.mode == "P" and "transparency" in img.info:
-                    img = img.convert("RGBA")  # Avoid PIL warnings
-                hash_value = str(imagehash.dhash(img))
+            stat = os.stat(file_path)
+            hash_value, error = _hash_image(file_path)
+            if hash_value is None:
+                raise ValueError(error)
 
             redis_key = f"image:{hash_value}"
-
-            if self.server.rc.exists(redis_key):
-                existing_data = self.server.rc.hgetall(redis_key)
-                if existing_data:
-                    hidden_status = existing_data.get(b"hidden", b"false").decode(
-                        "utf-8"
-                    )
-                    if hidden_status == "true":
-                        self.server.rc.hset(redis_key, "hidden", "false")
-                        self.server.rc.hset(redis_key, "local_path", file_path)
-
-                        filename = os.path.basename(file_path)
-                        self.server.rc.hset(
-                            "filename_to_hash_index", filename, hash_value
-                        )
-
-                        self.server.server_log(
-                            f"[INFO] Unhidden existing image: {file_path}"
-                        )
-
-                        # Schedule type is immediate
-                        if (
-                            action != "scanned"
-                            and self.server.embedding_schedule.get("schedule_type")
-                            == "immediate"
-                        ):
-                            self.server.generate_immediate_embedding(redis_key)
-
-                        if action != "scanned":
-                            self._check_and_link_to_documents(filename, hash_value)
-                        return
-                    else:
-                        # Image exists and is not hidden, skip processing
-                        return
-
-            image_data = {
-                "hash": hash_value,
-                "local_path": file_path,
-                "remote_path": "",
-                "filename": os.path.basename(file_path),
-                "documents": "",
-                "hidden": "false",
-            }
-
             filename = os.path.basename(file_path)
 
-            pipe = self.server.rc.client.pipeline()
-            pipe.hset(redis_key, mapping=image_data)
+            # One read decides between create, unhide and skip
+            pipe = self.server.rc.pipeline(transaction=False)
+            pipe.hmget(redis_key, "hash", "hidden")
+            pipe.hset("path_meta_index", file_path, f"{_path_meta(stat)}:{hash_value}")
+            stored_hash, hidden_status = pipe.execute()[0]
+
+            unhiding = hidden_status == b"true"
+            if stored_hash is not None and not unhiding:
+                # Image exists and is not hidden, skip processing
+                return
+
+            pipe = self.server.rc.pipeline(transaction=False)
+            if unhiding:
+                pipe.hset(
+                    redis_key, mapping={"hidden": "false", "local_path": file_path}
+                )
+            else:
+                pipe.hset(
+                    redis_key,
+                    mapping={
+                        "hash": hash_value,
+                        "local_path": file_path,
+                        "remote_path": "",
+                        "filename": filename,
+                        "hidden": "false",
+                    },
+                )
             pipe.hset("filename_to_hash_index", filename, hash_value)
+            pipe.hset("local_path_to_hash_index", file_path, hash_value)
             pipe.execute()
+            self._invalidate_filenames(filename)
+
+            if unhiding:
+                self.server.invalidate_image_caches(hash_value)
+                self.server.server_log(f"[INFO] Unhidden existing image: {file_path}")
 
             if action != "scanned":
                 self._check_and_link_to_documents(filename, hash_value)
 
             # Schedule type is immediate
-            if (
-                action != "scanned"
-                and self.server.embedding_schedule.get("schedule_type") == "immediate"
-            ):
+            if action != "scanned" and self.server.schedule_type == "immediate":
                 self.server.generate_immediate_embedding(redis_key)
 
             # self.server.server_log(f"[INFO] Processed image {action}: {file_path}")
@@ -109,14 +146,19 @@ class ImageWatcher:
 
                 redis_key = f"image:{image_hash}"
 
-                image_data = self.server.rc.hgetall(redis_key)
-                if image_data:
-                    stored_path = image_data.get(b"local_path", b"").decode("utf-8")
+                stored_path = self.server.rc.hget(redis_key, "local_path")
+                if stored_path is not None:
+                    stored_path = stored_path.decode("utf-8")
 
                     if stored_path == file_path:
-                        self.server.rc.hset(redis_key, "hidden", "true")
-
-                        self.server.rc.hdel("filename_to_hash_index", filename)
+                        pipe = self.server.rc.pipeline(transaction=False)
+                        pipe.hset(redis_key, "hidden", "true")
+                        pipe.hdel("filename_to_hash_index", filename)
+                        pipe.hdel("local_path_to_hash_index", file_path)
+                        pipe.hdel("path_meta_index", file_path)
+                        pipe.execute()
+                        self.server.invalidate_image_caches(image_hash)
+                        self._invalidate_filenames(filename)
 
                         self.server.server_log(
                             f"[INFO] Marked deleted image as hidden in Redis: {file_path}"
@@ -128,7 +170,7 @@ class ImageWatcher:
                         )
 
             self.server.server_log(
-                f"[INFO] Filename index lookup failed for {filename}, falling back to full scan"
+                f"[INFO] Filename index lookup failed for {filename}, falling back to path index"
             )
             self._remove_file_fallback(file_path)
 
@@ -137,34 +179,49 @@ class ImageWatcher:
                 f"[ERROR] Failed to mark deleted image as hidden in Redis: {e}"
             )
 
+    def _find_image_hash_by_path(self, file_path):
+        """Look up an image hash by its local path."""
+        image_hash = self.server.rc.hget("local_path_to_hash_index", file_path)
+        if image_hash:
+            return image_hash.decode("utf-8")
+
+        # Images stored before the path index existed: match by filename, then
+        # confirm the stored path and backfill the index entry
+        image_hash = self.server.rc.hget(
+            "filename_to_hash_index", os.path.basename(file_path)
+        )
+        if not image_hash:
+            return None
+        image_hash = image_hash.decode("utf-8")
+
+        local_path = self.server.rc.hget(f"image:{image_hash}", "local_path")
+        if local_path is None or local_path.decode("utf-8") != file_path:
+            return None
+
+        self.server.rc.hset("local_path_to_hash_index", file_path, image_hash)
+        return image_hash
+
     def _remove_file_fallback(self, file_path):
-        """Fallback method using full scan when filename index lookup fails."""
+        """Fallback using the local path index when the filename index lookup fails."""
         try:
-            pattern = "image:*"
-            cursor = 0
-
-            while True:
-                cursor, keys = self.server.rc.scan(cursor, match=pattern, count=100)
-
-                for key in keys:
-                    key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-                    image_data = self.server.rc.hgetall(key_str)
-                    if (
-                        image_data
-                        and image_data.get(b"local_path", b"").decode("utf-8")
-                        == file_path
-                    ):
-                        self.server.rc.hset(key_str, "hidden", "true")
-
-                        filename = os.path.basename(file_path)
-                        self.server.rc.hdel("filename_to_hash_index", filename)
-                        self.server.server_log(
-                            f"[INFO] Marked deleted image as hidden in Redis (via fallback): {file_path}"
-                        )
-                        return  # Exit early
+            image_hash = self._find_image_hash_by_path(file_path)
+            if not image_hash:
+                return
+
+            filename = os.path.basename(file_path)
+
+            pipe = self.server.rc.pipeline(transaction=False)
+            pipe.hset(f"image:{image_hash}", "hidden", "true")
+            pipe.hdel("filename_to_hash_index", filename)
+            pipe.hdel("local_path_to_hash_index", file_path)
+            pipe.hdel("path_meta_index", file_path)
+            pipe.execute()
+            self.server.invalidate_image_caches(image_hash)
+            self._invalidate_filenames(filename)
 
-                if cursor == 0:
-                    break
+            self.server.server_log(
+                f"[INFO] Marked deleted image as hidden in Redis (via fallback): {file_path}"
+            )
 
         except Exception as e:
             self.server.server_log(f"[ERROR] Fallback removal failed: {e}")
@@ -175,39 +232,33 @@ class ImageWatcher:
             return
 
         try:
-            pattern = "image:*"
-            cursor = 0
-
-            while True:
-                cursor, keys = self.server.rc.scan(cursor, match=pattern, count=100)
-
-                for key in keys:
-                    key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-                    image_data = self.server.rc.hgetall(key_str)
-                    if (
-                        image_data
-                        and image_data.get(b"local_path", b"").decode("utf-8")
-                        == old_path
-                    ):
-                        old_filename = os.path.basename(old_path)
-                        new_filename = os.path.basename(new_path)
-                        image_hash = image_data.get(b"hash", b"").decode("utf-8")
-
-                        if old_filename != new_filename and image_hash:
-                            self.server.rc.hdel("filename_to_hash_index", old_filename)
-                            self.server.rc.hset(
-                                "filename_to_hash_index", new_filename, image_hash
-                            )
-
-                        self.server.rc.hset(key_str, "local_path", new_path)
-                        self.server.rc.hset(key_str, "filename", new_filename)
-                        self.server.server_log(
-                            f"[INFO] Updated moved image path in Redis: {old_path} -> {new_path}"
-                        )
-                        return  # Exit early
+            image_hash = self._find_image_hash_by_path(old_path)
+            if not image_hash:
+                return
+
+            old_filename = os.path.basename(old_path)
+            new_filename = os.path.basename(new_path)
+
+            pipe = self.server.rc.pipeline(transaction=False)
+            if old_filename != new_filename:
+                pipe.hdel("filename_to_hash_index", old_filename)
+                pipe.hset("filename_to_hash_index", new_filename, image_hash)
+            pipe.hset(
+                f"image:{image_hash}",
+                mapping={"local_path": new_path, "filename": new_filename},
+            )
+            pipe.hdel("local_path_to_hash_index", old_path)
+            pipe.hset("local_path_to_hash_index", new_path, image_hash)
+            pipe.hdel("path_meta_index", old_path)
+            pipe.execute()
+
+            self.server.invalidate_image_caches(image_hash)
+            if old_filename != new_filename:
+                self._invalidate_filenames(old_filename, new_filename)
 
-                if cursor == 0:
-                    break
+            self.server.server_log(
+                f"[INFO] Updated moved image path in Redis: {old_path} -> {new_path}"
+            )
         except Exception as e:
             self.server.server_log(
                 f"[ERROR] Failed to update moved image path in Redis: {e}"
@@ -220,6 +271,7 @@ class ImageWatcher:
     def scan_existing_files(self, folders):
         """Scan and process existing image files in the given folders using batch processing."""
         all_image_files = []
+        suffixes = self.image_suffixes
 
         # Collect all image files first
         for folder in folders:
@@ -228,11 +280,11 @@ class ImageWatcher:
 
             self.server.server_log(f"[INFO] Scanning for images in: {folder}")
 
-            for root, dirs, files in os.walk(folder):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if self.can_handle(file_path):
-                        all_image_files.append(file_path)
+            all_image_files.extend(
+                file_path
+                for name, file_path in iter_files(folder)
+                if name.lower().endswith(suffixes)
+            )
 
         self.server.server_log(
             f"[INFO] Found {len(all_image_files)} image files. Starting batch processing..."
@@ -253,111 +305,142 @@ class ImageWatcher:
         return processed_count
 
     def process_files_batch(self, file_paths, batch_size=100):
-        """Process multiple image files in batches for maximum performance."""
+        """
+        Process multiple image files in batches for maximum performance.
+        Files whose mtime and size match path_meta_index reuse the stored hash;
+        the rest are hashed, then each batch's Redis state is read and written
+        with one pipeline each.
+        """
         processed_count = 0
         total_files = len(file_paths)
 
-        for i in range(0, total_files, batch_size):
-            batch = file_paths[i : i + batch_size]
-            pipe = self.server.rc.client.pipeline()
-            batch_data = []
+        executor = self._get_hash_executor() if total_files > 1 else None
 
-            for file_path in batch:
+        for i in range(0, total_files, batch_size):
+            stated = []
+            for file_path in file_paths[i : i + batch_size]:
                 if not self.can_handle(file_path):
                     continue
-
                 try:
-                    with Image.open(file_path) as img:
-                        if img.mode == "P" and "transparency" in img.info:
-                            img = img.convert("RGBA")
-                        hash_value = str(imagehash.dhash(img))
-
-                    redis_key = f"image:{hash_value}"
-                    filename = os.path.basename(file_path)
-
-                    if self.server.rc.exists(redis_key):
-                        existing_data = self.server.rc.hgetall(redis_key)
-                        if existing_data:
-                            hidden_status = existing_data.get(
-                                b"hidden", b"false"
-                            ).decode("utf-8")
-                            if hidden_status == "true":
-                                pipe.hset(redis_key, "hidden", "false")
-                                pipe.hset(redis_key, "local_path", file_path)
-                                pipe.hset(
-                                    "filename_to_hash_index", filename, hash_value
-                                )
-                                continue
-                        # Image exists and is not hidden, skip
-                        continue
+                    stated.append((file_path, _path_meta(os.stat(file_path))))
+                except OSError as e:
+                    self.server.server_log(
+                        f"[ERROR] Failed to process image {file_path}: {e}"
+                    )
+            if not stated:
+                continue
 
-                    image_data = {
-                        "hash": hash_value,
-                        "local_path": file_path,
-                        "remote_path": "",
-                        "filename": filename,
-                        "documents": "",
-                        "hidden": "false",
-                    }
+            pipe = self.server.rc.pipeline(transaction=False)
+            for file_path, _ in stated:
+                pipe.hget("path_meta_index", file_path)
+            stored_metas = pipe.execute()
+
+            hashed = []
+            to_hash = []
+            for (file_path, meta), stored_meta in zip(stated, stored_metas):
+                if stored_meta:
+                    stored_meta = stored_meta.decode("utf-8")
+                    if stored_meta.startswith(f"{meta}:"):
+                        hashed.append((file_path, stored_meta[len(meta) + 1 :]))
+                        continue
+                to_hash.append((file_path, meta))
 
-                    batch_data.append((redis_key, image_data, filename, hash_value))
+            to_hash_paths = [file_path for file_path, _ in to_hash]
+            if executor is not None and len(to_hash_paths) > 1:
+                results = executor.map(_hash_image, to_hash_paths)
+            else:
+                results = map(_hash_image, to_hash_paths)
 
-                except Exception as e:
+            new_metas = {}
+            for (file_path, meta), (hash_value, error) in zip(to_hash, results):
+                if hash_value is None:
                     self.server.server_log(
-                        f"[ERROR] Failed to process image {file_path}: {e}"
+                        f"[ERROR] Failed to process image {file_path}: {error}"
                     )
+                    continue
+                hashed.append((file_path, hash_value))
+                new_metas[file_path] = f"{meta}:{hash_value}"
 
-            if batch_data:
-                try:
-                    for redis_key, image_data, filename, hash_value in batch_data:
-                        pipe.hset(redis_key, mapping=image_data)
-                        pipe.hset("filename_to_hash_index", filename, hash_value)
+            if not hashed:
+                continue
 
-                    pipe.execute()
-                    processed_count += len(batch_data)
+            pipe = self.server.rc.pipeline(transaction=False)
+            for _, hash_value in hashed:
+                pipe.hmget(f"image:{hash_value}", "hash", "hidden")
+            states = pipe.execute()
+
+            pipe = self.server.rc.pipeline(transaction=False)
+            if new_metas:
+                pipe.hset("path_meta_index", mapping=new_metas)
+            changed_filenames = []
+            unhidden_hashes = []
+            for (file_path, hash_value), (stored_hash, hidden_status) in zip(
+                hashed, states
+            ):
+                # Also backfills the path index for images that are already stored
+                pipe.hset("local_path_to_hash_index", file_path, hash_value)
 
-                    if processed_count % 1000 == 0:
-                        self.server.server_log(
-                            f"[INFO] Batch processed {processed_count}/{total_files} images"
-                        )
+                unhiding = stored_hash is not None and hidden_status == b"true"
+                if stored_hash is not None and not unhiding:
+                    # Image exists and is not hidden, skip
+                    continue
 
-                except Exception as e:
-                    self.server.server_log(f"[ERROR] Batch processing failed: {e}")
+                redis_key = f"image:{hash_value}"
+                filename = os.path.basename(file_path)
+                if unhiding:
+                    pipe.hset(
+                        redis_key, mapping={"hidden": "false", "local_path": file_path}
+                    )
+                    unhidden_hashes.append(hash_value)
+                else:
+                    pipe.hset(
+                        redis_key,
+                        mapping={
+                            "hash": hash_value,
+                            "local_path": file_path,
+                            "remote_path": "",
+                            "filename": filename,
+                            "hidden": "false",
+                        },
+                    )
 
-        self.server.server_log(
-            f"[INFO] Batch processing completed. Processed {processed_count} images"
-        )
-        return processed_count
+                pipe.hset("filename_to_hash_index", filename, hash_value)
+                changed_filenames.append(filename)
 
-    def _process_single_image(self, file_path):
-        """Process a single image file efficiently."""
-        try:
-            with Image.open(file_path) as img:
-                if img.mode == "P" and "transparency" in img.info:
-                    img = img.convert("RGBA")
-                hash_value = str(imagehash.dhash(img))
+            try:
+                pipe.execute()
+            except Exception as e:
+                self.server.server_log(f"[ERROR] Batch processing failed: {e}")
+                continue
 
-            redis_key = f"image:{hash_value}"
+            if unhidden_hashes:
+                self.server.invalidate_image_caches(*unhidden_hashes)
+            self._invalidate_filenames(*changed_filenames)
+            processed_count += len(changed_filenames)
 
-            if not self.server.rc.exists(redis_key):
-                self.process_file(file_path, "scanned")
-                return True
-            else:
-                return False
+            if processed_count and processed_count % 1000 == 0:
+                self.server.server_log(
+                    f"[INFO] Batch processed {processed_count}/{total_files} images"
+                )
 
-        except Exception as e:
-            self.server.server_log(f"[ERROR] Failed to process image {file_path}: {e}")
-            return False
+        return processed_count
+
+    def _document_watcher(self):
+        """Document watcher of the running file watcher, or None before it starts."""
+        file_watcher = self.server.file_watcher
+        return file_watcher.handler.document_watcher if file_watcher else None
+
+    def _invalidate_filenames(self, *filenames):
+        """Tell the document watcher that these filename index entries changed."""
+        document_watcher = self._document_watcher()
+        if document_watcher is not None:
+            document_watcher.invalidate_filename(*filenames)
 
     def _check_and_link_to_documents(self, filename, image_hash):
         """Check if any documents are waiting for this image and link them."""
         try:
-            if (
-                hasattr(self.server, "file_watcher")
-                and hasattr(self.server.file_watcher, "handler")
-                and hasattr(self.server.file_watcher.handler, "document_watcher")
-            ):
-                document_watcher = self.server.file_watcher.handler.document_watcher
+            document_watcher = self._document_watcher()
+            if document_watcher is not None:
                 document_watcher.resolve_pending_images_for_filename(
                     filename, image_hash
                 )
@@ -373,47 +456,33 @@ class ImageWatcher:
     def _batch_resolve_pending_documents(self):
         """Batch resolve all pending document-image links after bulk processing."""
         try:
-            if (
-                hasattr(self.server, "file_watcher")
-                and hasattr(self.server.file_watcher, "handler")
-                and hasattr(self.server.file_watcher.handler, "document_watcher")
-            ):
-                document_watcher = self.server.file_watcher.handler.document_watcher
-
-                pending_keys = []
-                cursor = 0
-                while True:
-                    cursor, keys = self.server.rc.scan(
-                        cursor, match="pending_image:*", count=1000
+            document_watcher = self._document_watcher()
+            if document_watcher is not None:
+
+                # Decoded client: keys and hashes come back as str, no per-key decode
+                redis = self.server.rc.text_client
+                filenames = [
+                    pending_key[len("pending_image:") :]
+                    for pending_key in redis.scan_iter(
+                        match="pending_image:*", count=1000
                     )
-                    pending_keys.extend(keys)
-                    if cursor == 0:
-                        break
-
-                links_resolved = 0
-                for pending_key in pending_keys:
-                    pending_key_str = (
-                        pending_key.decode("utf-8")
-                        if isinstance(pending_key, bytes)
-                        else pending_key
+                ]
+
+                documents_updated = 0
+                for i in range(0, len(filenames), self.RESOLVE_BATCH_SIZE):
+                    batch = filenames[i : i + self.RESOLVE_BATCH_SIZE]
+                    image_hashes = redis.hmget("filename_to_hash_index", batch)
+                    documents_updated += document_watcher.resolve_pending_images_bulk(
+                        [
+                            (filename, image_hash)
+                            for filename, image_hash in zip(batch, image_hashes)
+                            if image_hash
+                        ]
                     )
-                    filename = pending_key_str.replace("pending_image:", "")
-
-                    image_hash = self.server.rc.hget("filename_to_hash_index", filename)
-                    if image_hash:
-                        image_hash = (
-                            image_hash.decode("utf-8")
-                            if isinstance(image_hash, bytes)
-                            else image_hash
-                        )
-                        document_watcher.resolve_pending_images_for_filename(
-                            filename, image_hash
-                        )
-                        links_resolved += 1
 
-                if links_resolved > 0:
+                if documents_updated > 0:
                     self.server.server_log(
-                        f"[INFO] Batch resolved {links_resolved} pending document-image links"
+                        f"[INFO] Batch resolved pending images for {documents_updated} documents"
                     )
             else:
                 self.server.server_log(
@@ -1,11 +1,31 @@
+import gc
 import os
+import threading
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image
 from PIL import ImageFile
 
 # AI imports will be loaded dynamically when needed
 import torch
+import torch.nn.functional as F
+
+# Process-wide CUDA math settings, applied by the first model loaded on a GPU
+_cuda_math_configured = False
+
+
+def _configure_cuda_math():
+    """Allow TF32 matmuls/convolutions and cuDNN autotuning, once per process"""
+    global _cuda_math_configured
+    if _cuda_math_configured:
+        return
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    _cuda_math_configured = True
 
 
 class ModelType:
@@ -29,6 +49,7 @@ class ModelType:
         "bertimbau": BERTIMBAU,
         "albertina": ALBERTINA,
     }
+    NAME_BY_TYPE = {value: name for name, value in TYPE_NAMES.items()}
 
     @classmethod
     def get_type_from_name(cls, type_name):
@@ -47,10 +68,10 @@ class ModelType:
     @classmethod
     def get_name_from_type(cls, type_value):
         """Convert numeric model type to human-readable name"""
-        for name, value in cls.TYPE_NAMES.items():
-            if value == type_value:
-                return name
-        raise ValueError(f"Unknown model type value: {type_value}")
+        try:
+            return cls.NAME_BY_TYPE[type_value]
+        except KeyError:
+            raise ValueError(f"Unknown model type value: {type_value}") from None
 
 
 class ModelStatus:
@@ -65,6 +86,8 @@ class EmbeddingType:
 
 
 class Model:
+    PREPROCESS_WORKERS = os.cpu_count() or 1
+
     def __init__(
         self,
         model_type,
@@ -90,7 +113,10 @@ class Model:
         self.embedding_name = embedding_name or model_name.replace("/", "").replace(
             "-", ""
         )
-        self.embedding_type = embedding_type
+        self.embedding_type = np.dtype(embedding_type).type
+        self.torch_embedding_type = torch.from_numpy(
+            np.empty(0, dtype=self.embedding_type)
+        ).dtype
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.hidden = hidden
         self.description = description or f"Model: {model_name}"
@@ -101,6 +127,12 @@ class Model:
         self.processor = None
         self.tokenizer = None
         self.loaded = ModelStatus.UNLOADED
+        self.status_version = 0
+        self.status_changed = threading.Condition()
+        self.preprocess_executor = None
+        self.image_size = None  # encoder input side, used to decode JPEGs smaller
+        self.image_transform = None  # CPU part of a torchvision pipeline, uint8 out
+        self.image_normalize = None  # (mean, std) applied on the device instead
 
         # For models that have different embedding lengths
         self.embedding_length = embedding_length
@@ -108,6 +140,12 @@ class Model:
         # Configure environment
         os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
         os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
+        # Reuse torch.compile artifacts across restarts
+        os.environ.setdefault(
+            "TORCHINDUCTOR_CACHE_DIR",
+            os.path.expanduser("~/.cache/imageseek/torchinductor"),
+        )
+        os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
         ImageFile.LOAD_TRUNCATED_IMAGES = True
 
     def list_supported_models():
@@ -122,6 +160,41 @@ class Model:
             ModelType.ALBERTINA: "Albertina",
         }
 
+    def _to_numpy(self, tensor):
+        """Cast to the embedding dtype on the device, then copy to host once"""
+        tensor = tensor.detach()
+        if tensor.dtype != self.torch_embedding_type:
+            tensor = tensor.to(self.torch_embedding_type)
+        return tensor.cpu().numpy()
+
+    def _autocast(self):
+        """Half-precision autocast for encoder forwards on CUDA; a no-op on CPU"""
+        return torch.autocast(
+            device_type=self.device,
+            dtype=torch.float16,
+            enabled=self.device == "cuda",
+        )
+
+    def _set_status(self, status):
+        """Update the load status and wake anyone waiting for a change"""
+        with self.status_changed:
+            self.loaded = status
+            self.status_version += 1
+            self.status_changed.notify_all()
+
+    @property
+    def vector_type(self):
+        """RediSearch vector TYPE matching the stored embedding dtype"""
+        return np.dtype(self.embedding_type).name.upper()
+
+    def wait_for_status_change(self, version, timeout=None):
+        """Block until the status version differs from `version` or timeout; returns the current version"""
+        with self.status_changed:
+            self.status_changed.wait_for(
+                lambda: self.status_version != version, timeout
+            )
+            return self.status_version
+
     def load_model(self):
         """Load the model"""
         model_type_name = ModelType.get_name_from_type(self.model_type)
@@ -135,7 +208,9 @@ class Model:
             return False
 
         try:
-            self.loaded = ModelStatus.LOADING
+            self._set_status(ModelStatus.LOADING)
+            if self.device == "cuda":
+                _configure_cuda_math()
 
             if self.model_type == ModelType.CLIP:
                 self._load_clip_model()
@@ -164,59 +239,83 @@ class Model:
             else:
                 raise ValueError(f"Unsupported model type: {model_type_name}")
 
-            self.loaded = ModelStatus.LOADED
+            self.image_size = self._find_image_size()
+            self.image_transform, self.image_normalize = self._split_image_transform()
+            self._compile_model()
+
+            self._set_status(ModelStatus.LOADED)
             self.logger(f"[SUCCESS] Model {self.model_name} loaded successfully")
             return True
 
         except ImportError as e:
-            self.loaded = ModelStatus.UNLOADED
+            self._set_status(ModelStatus.UNLOADED)
             self.logger(f"[ERROR] Missing dependency for {model_type_name}: {e}")
             return False
         except FileNotFoundError as e:
-            self.loaded = ModelStatus.UNLOADED
+            self._set_status(ModelStatus.UNLOADED)
             self.logger(f"[ERROR] Model file not found: {e}")
             return False
         except Exception as e:
-            self.loaded = ModelStatus.UNLOADED
+            self._set_status(ModelStatus.UNLOADED)
             self.logger(f"[ERROR] Failed to load model {self.model_name}: {e}")
             return False
 
+    def _pretrained_kwargs(self):
+        """
+        from_pretrained options that load weights straight onto the device
+        without a second full copy in RAM. Weights stay in full precision;
+        _autocast decides where half precision is used.
+        """
+        return {
+            "low_cpu_mem_usage": True,
+            "torch_dtype": torch.float32,
+            "device_map": {"": self.device},
+        }
+
     def _load_clip_model(self):
         """Load CLIP model"""
         import clip
 
         self.model, self.processor = clip.load(self.model_name, device=self.device)
+        self.tokenizer = clip.tokenize
 
     def _load_multilingual_clip_model(self):
         """Load Multilingual CLIP model"""
         from multilingual_clip.pt_multilingual_clip import MultilingualCLIP
         from transformers import AutoTokenizer
 
-        self.model = MultilingualCLIP.from_pretrained(self.model_name)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Tokenizers are built on a helper thread while the weights load
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            tokenizer = executor.submit(AutoTokenizer.from_pretrained, self.model_name)
+            self.model = MultilingualCLIP.from_pretrained(self.model_name)
+            self.tokenizer = tokenizer.result()
 
     def _load_open_clip_model(self):
         """Load OpenCLIP model"""
         import open_clip
 
-        self.model, _, self.processor = open_clip.create_model_and_transforms(
-            self.model_name, self.model_pretrained, device=self.device
-        )
-        self.model.eval()  # model in train mode by default
-        self.tokenizer = open_clip.get_tokenizer(self.model_name)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            tokenizer = executor.submit(open_clip.get_tokenizer, self.model_name)
+            self.model, _, self.processor = open_clip.create_model_and_transforms(
+                self.model_name, self.model_pretrained, device=self.device
+            )
+            self.model.eval()  # model in train mode by default
+            self.tokenizer = tokenizer.result()
 
     def _load_open_clip_fine_tuned_model(self):
         """Load fine-tuned OpenCLIP model"""
         import open_clip
 
-        self.model, self.processor = open_clip.create_model_from_pretrained(
-            self.model_name,
-            self.model_pretrained,
-            load_weights_only=False,
-            device=self.device,
-        )
-        self.model.eval()  # model in train mode by default
-        self.tokenizer = open_clip.get_tokenizer(self.model_name)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            tokenizer = executor.submit(open_clip.get_tokenizer, self.model_name)
+            self.model, self.processor = open_clip.create_model_from_pretrained(
+                self.model_name,
+                self.model_pretrained,
+                load_weights_only=False,
+                device=self.device,
+            )
+            self.model.eval()  # model in train mode by default
+            self.tokenizer = tokenizer.result()
 
     def _load_blip2_model(self):
         """Load BLIP-2 model"""
@@ -226,12 +325,16 @@ class Model:
             AutoProcessor,
         )
 
-        self.model = [None, None]
-        self.model[0] = Blip2VisionModelWithProjection.from_pretrained(self.model_name)
-        self.model[0].to(self.device)
-        self.model[1] = Blip2TextModelWithProjection.from_pretrained(self.model_name)
-        self.model[1].to(self.device)
-        self.processor = AutoProcessor.from_pretrained(self.model_name)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            processor = executor.submit(AutoProcessor.from_pretrained, self.model_name)
+            self.model = [None, None]
+            self.model[0] = Blip2VisionModelWithProjection.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.model[1] = Blip2TextModelWithProjection.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.processor = processor.result()
         self.tokenizer = "OK"
 
     def _load_siglip_model(self):
@@ -243,32 +346,126 @@ class Model:
             SiglipImageProcessor,
         )
 
-        self.model = [None, None]
-        self.model[0] = SiglipVisionModel.from_pretrained(self.model_name)
-        self.model[0].to(self.device)
-        self.model[1] = SiglipTextModel.from_pretrained(self.model_name)
-        self.model[1].to(self.device)
-        self.tokenizer = SiglipTokenizer.from_pretrained(self.model_name)
-        self.processor = SiglipImageProcessor.from_pretrained(self.model_name)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            tokenizer = executor.submit(
+                SiglipTokenizer.from_pretrained, self.model_name
+            )
+            processor = executor.submit(
+                SiglipImageProcessor.from_pretrained, self.model_name
+            )
+            self.model = [None, None]
+            self.model[0] = SiglipVisionModel.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.model[1] = SiglipTextModel.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.tokenizer = tokenizer.result()
+            self.processor = processor.result()
 
     def _load_bertimbau_model(self):
         """Load BERTimbau model"""
         from transformers import BertTokenizer, BertModel
 
-        self.model = BertModel.from_pretrained(self.model_name)
-        self.tokenizer = BertTokenizer.from_pretrained(self.model_name)
-        self.model.to(self.device)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            tokenizer = executor.submit(BertTokenizer.from_pretrained, self.model_name)
+            self.model = BertModel.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.tokenizer = tokenizer.result()
         self.processor = "OK"
 
     def _load_albertina_model(self):
         """Load Albertina model"""
         from transformers import AutoTokenizer, AutoModel
 
-        self.model = AutoModel.from_pretrained(self.model_name)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model.to(self.device)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            tokenizer = executor.submit(AutoTokenizer.from_pretrained, self.model_name)
+            self.model = AutoModel.from_pretrained(
+                self.model_name, **self._pretrained_kwargs()
+            )
+            self.tokenizer = tokenizer.result()
         self.processor = "OK"
 
+    def _compile_model(self):
+        """
+        Compile the encoder forwards with torch.compile on CUDA and warm them up,
+        so the first real request does not pay the compilation. Falls back to the
+        eager modules if compilation fails.
+        """
+        if self.device != "cuda" or not hasattr(torch, "compile"):
+            return
+
+        if self.model_type in (
+            ModelType.CLIP,
+            ModelType.OPEN_CLIP,
+            ModelType.OPEN_CLIP_FINE_TUNED,
+        ):
+            # Only forward() is compiled on a wrapped module, so compile the encoders
+            eager = (self.model.encode_image, self.model.encode_text)
+            self.model.encode_image = self._compiled(eager[0])
+            self.model.encode_text = self._compiled(eager[1])
+        elif self.model_type in (ModelType.BLIP2, ModelType.SIGLIP):
+            eager = list(self.model)
+            self.model = [self._compiled(module) for module in eager]
+        else:
+            return
+
+        try:
+            self._warmup()
+        except Exception as e:
+            self.logger(
+                f"[WARNING] torch.compile failed for {self.model_name}, using eager mode: {e}"
+            )
+            if isinstance(self.model, list):
+                self.model = eager
+            else:
+                self.model.encode_image, self.model.encode_text = eager
+
+    def _compiled(self, eager):
+        """
+        torch.compile a forward with a dynamic batch dimension, so search and
+        embedding batches of any size reuse one graph. If the compiled forward
+        fails at call time (e.g. a recompile hits an unsupported op), it logs once
+        and the eager forward is used from then on.
+        """
+        compiled = torch.compile(eager, dynamic=True)
+
+        def forward(*args, **kwargs):
+            nonlocal compiled
+            if compiled is not None:
+                try:
+                    return compiled(*args, **kwargs)
+                except Exception as e:
+                    self.logger(
+                        f"[WARNING] Compiled forward failed for {self.model_name}, using eager mode: {e}"
+                    )
+                    compiled = None
+            return eager(*args, **kwargs)
+
+        return forward
+
+    def _warmup(self):
+        """
+        Run text and image forwards through the (compiled) encoders with one and
+        two inputs: a single input gets its own specialized graph, and the pair
+        builds the dynamic-batch graph used by every larger batch.
+        """
+        image = Image.new("RGB", (224, 224))
+        for batch_size in (1, 2):
+            self.generate_text_embeddings(["warmup"] * batch_size)
+
+            images = [image] * batch_size
+            with torch.inference_mode(), self._autocast():
+                if isinstance(self.model, list):
+                    image_processed = self.processor(images=images, return_tensors="pt")
+                    self.model[0](**image_processed.to(self.device))
+                else:
+                    image_processed = torch.stack(
+                        [self.processor(img) for img in images]
+                    ).to(self.device)
+                    self.model.encode_image(image_processed)
+
     def unload_model(self):
         self.logger(f"[INFO] Unloading model {self.model_name}...")
         if self.loaded == ModelStatus.UNLOADED:
@@ -278,13 +475,25 @@ class Model:
             self.logger(f"[ERROR] Model {self.model_name} still loading")
             return False
 
-        del self.model
-        del self.processor
-        del self.tokenizer
+        # BLIP2/SigLIP keep their submodels in a list; clear it so nothing else
+        # sharing the list keeps the weights alive
+        for attr in ("model", "processor", "tokenizer"):
+            value = getattr(self, attr)
+            if isinstance(value, list):
+                value[:] = [None] * len(value)
         self.model = None
         self.processor = None
         self.tokenizer = None
-        self.loaded = ModelStatus.UNLOADED
+        self.image_transform = None
+        self.image_normalize = None
+
+        # Collect reference cycles first so the caching allocator can hand the
+        # freed blocks back to the driver
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.ipc_collect()
+        self._set_status(ModelStatus.UNLOADED)
         self.logger(f"[INFO] Model {self.model_name} unloaded successfully")
         return True
 
@@ -297,27 +506,22 @@ class Model:
                 f"Cannot reduce {current_dim} to {target_dim} using average pooling"
             )
 
-        pooled = []
-        for i in range(embedding.shape[0]):
-            x = embedding[i]
-            # Reshape and pool
-            x_reshaped = x[: num_pools * target_dim].reshape(-1, target_dim)
-            pooled.append(np.mean(x_reshaped, axis=0))
-
-        return np.array(pooled)
+        # Pool every row at once: (N, num_pools, target_dim) -> (N, target_dim)
+        trimmed = embedding[:, : num_pools * target_dim]
+        return trimmed.reshape(embedding.shape[0], num_pools, target_dim).mean(axis=1)
 
     def generate_image_embedding(self, image_path: str):
         if self.model is None or self.processor is None:
             self.logger(f"[ERROR] Model {self.model_name} not loaded")
             return None
 
-        image = Image.open(image_path)
+        image = self._open_image(image_path)
 
         if self.model_type == ModelType.CLIP:
             image_processed = self.processor(image).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                image_embedding = self.model.encode_image(image_processed)
-                image_embedding /= image_embedding.norm(dim=-1, keepdim=True)
+            with torch.inference_mode(), self._autocast():
+                image_embedding = self.model.encode_image(image_processed).float()
+                image_embedding = F.normalize(image_embedding, dim=-1)
 
         elif self.model_type == ModelType.MULTILINGUAL_CLIP:
             self.logger(
@@ -330,28 +534,20 @@ class Model:
             or self.model_type == ModelType.OPEN_CLIP_FINE_TUNED
         ):
             image_processed = self.processor(image).unsqueeze(0).to(self.device)
-            with torch.no_grad():
-                image_embedding = self.model.encode_image(image_processed)
-                image_embedding /= image_embedding.norm(dim=-1, keepdim=True)
+            with torch.inference_mode(), self._autocast():
+                image_embedding = self.model.encode_image(image_processed).float()
+                image_embedding = F.normalize(image_embedding, dim=-1)
 
         elif self.model_type == ModelType.BLIP2:
             image_processed = self.processor(images=image, return_tensors="pt").to(
                 self.device
             )
-            with torch.no_grad():
-                image_embedding = self.model[0](
-                    **image_processed
-                ).image_embeds.squeeze()
-                image_embedding = image_embedding / image_embedding.norm(
-                    dim=-1, keepdim=True
+            with torch.inference_mode(), self._autocast():
+                image_embedding = (
+                    self.model[0](**image_processed).image_embeds.squeeze().float()
                 )
-            image_embedding = (
-                image_embedding.detach()
-                .cpu()
-                .numpy()
-                .astype(self.embedding_type)
-                .reshape(1, -1)
-            )
+                image_embedding = F.normalize(image_embedding, dim=-1)
+            image_embedding = self._to_numpy(image_embedding).reshape(1, -1)
             image_embedding = self.average_pool(image_embedding, self.embedding_length)
             return image_embedding
 
@@ -359,16 +555,10 @@ class Model:
             image_processed = self.processor(images=image, return_tensors="pt").to(
                 self.device
             )
-            with torch.no_grad():
+            with torch.inference_mode(), self._autocast():
                 image_embedding = self.model[0](**image_processed)
-                image_embedding = image_embedding.pooler_output.squeeze()
-            return (
-                image_embedding.detach()
-                .cpu()
-                .numpy()
-                .astype(self.embedding_type)
-                .reshape(1, -1)
-            )
+                image_embedding = image_embedding.pooler_output.squeeze().float()
+            return self._to_numpy(image_embedding).reshape(1, -1)
 
         elif (
             self.model_type == ModelType.BERTIMBAU
@@ -383,7 +573,7 @@ class Model:
             self.logger(f"[ERROR] Model type {self.model_type} not supported")
             return None
 
-        return image_embedding.detach().cpu().numpy().astype(self.embedding_type)
+        return self._to_numpy(image_embedding)
 
     def generate_text_embedding(self, text: str):
         if self.model is None or self.tokenizer is None:
@@ -395,42 +585,33 @@ class Model:
             return None
 
         if self.model_type == ModelType.CLIP:
-            import clip
-
-            text_tokenized = clip.tokenize([text]).to(self.device)
-            with torch.no_grad():
-                text_embedding = self.model.encode_text(text_tokenized)
-                text_embedding /= text_embedding.norm(dim=-1, keepdim=True)
+            text_tokenized = self.tokenizer([text]).to(self.device)
+            with torch.inference_mode(), self._autocast():
+                text_embedding = self.model.encode_text(text_tokenized).float()
+                text_embedding = F.normalize(text_embedding, dim=-1)
 
         elif self.model_type == ModelType.MULTILINGUAL_CLIP:
-            text_embedding = self.model.forward([text], self.tokenizer)
+            with torch.inference_mode():
+                text_embedding = self.model.forward([text], self.tokenizer)
 
         elif (
             self.model_type == ModelType.OPEN_CLIP
             or self.model_type == ModelType.OPEN_CLIP_FINE_TUNED
         ):
             text_tokenized = self.tokenizer([text]).to(self.device)
-            with torch.no_grad():
-                text_embedding = self.model.encode_text(text_tokenized)
-                text_embedding /= text_embedding.norm(dim=-1, keepdim=True)
+            with torch.inference_mode(), self._autocast():
+                text_embedding = self.model.encode_text(text_tokenized).float()
+                text_embedding = F.normalize(text_embedding, dim=-1)
 
         elif self.model_type == ModelType.BLIP2:
             text_tokenized = self.processor(text=[text], return_tensors="pt").to(
                 self.device
             )
-            with torch.no_grad():
+            with torch.inference_mode(), self._autocast():
                 text_embedding = self.model[1](**text_tokenized)
-                text_embedding = text_embedding.text_embeds.squeeze()
-                text_embedding = text_embedding / text_embedding.norm(
-                    dim=-1, keepdim=True
-                )
-            text_embedding = (
-                text_embedding.detach()
-                .cpu()
-                .numpy()
-                .astype(self.embedding_type)
-                .reshape(1, -1)
-            )
+                text_embedding = text_embedding.text_embeds.squeeze().float()
+                text_embedding = F.normalize(text_embedding, dim=-1)
+            text_embedding = self._to_numpy(text_embedding).reshape(1, -1)
             text_embedding = self.average_pool(text_embedding, self.embedding_length)
             return text_embedding
 
@@ -438,16 +619,10 @@ class Model:
             text_tokenized = self.tokenizer(
                 [text], padding="max_length", truncation=True, return_tensors="pt"
             ).to(self.device)
-            with torch.no_grad():
+            with torch.inference_mode(), self._autocast():
                 text_embedding = self.model[1](**text_tokenized)
-                text_embedding = text_embedding.pooler_output.squeeze()
-            return (
-                text_embedding.detach()
-                .cpu()
-                .numpy()
-                .astype(self.embedding_type)
-                .reshape(1, -1)
-            )
+                text_embedding = text_embedding.pooler_output.squeeze().float()
+            return self._to_numpy(text_embedding).reshape(1, -1)
 
         elif (
             self.model_type == ModelType.BERTIMBAU
@@ -456,17 +631,12 @@ class Model:
             text_tokenized = self.tokenizer(
                 text, padding=True, truncation=True, return_tensors="pt"
             ).to(self.device)
-            text_embedding = self.model(**text_tokenized)
-            text_embedding = text_embedding.last_hidden_state.mean(dim=1)
-            text_embedding = text_embedding / text_embedding.norm(dim=-1, keepdim=True)
-
-            text_embedding = (
-                text_embedding.detach()
-                .cpu()
-                .numpy()
-                .astype(self.embedding_type)
-                .reshape(1, -1)
-            )
+            with torch.inference_mode():
+                text_embedding = self.model(**text_tokenized)
+                text_embedding = text_embedding.last_hidden_state.mean(dim=1)
+                text_embedding = F.normalize(text_embedding, dim=-1)
+
+            text_embedding = self._to_numpy(text_embedding).reshape(1, -1)
 
             return text_embedding
 
@@ -474,4 +644,223 @@ class Model:
             print(f"[ERROR] Model type {self.model_type} not supported")
             return None
 
-        return text_embedding.detach().cpu().numpy().astype(self.embedding_type)
+        return self._to_numpy(text_embedding)
+
+    def generate_text_embeddings(self, texts: list):
+        """Generate embeddings for several texts, one row per text"""
+        if self.model is None or self.tokenizer is None:
+            self.logger(f"[ERROR] Model {self.model_name} not loaded")
+            return None
+
+        if self.model_type == ModelType.CLIP:
+            text_tokenized = self.tokenizer(texts).to(self.device)
+            with torch.inference_mode(), self._autocast():
+                text_embedding = self.model.encode_text(text_tokenized).float()
+                text_embedding = F.normalize(text_embedding, dim=-1)
+
+        elif self.model_type == ModelType.MULTILINGUAL_CLIP:
+            with torch.inference_mode():
+                text_embedding = self.model.forward(texts, self.tokenizer)
+
+        elif (
+            self.model_type == ModelType.OPEN_CLIP
+            or self.model_type == ModelType.OPEN_CLIP_FINE_TUNED
+        ):
+            text_tokenized = self.tokenizer(texts).to(self.device)
+            with torch.inference_mode(), self._autocast():
+                text_embedding = self.model.encode_text(text_tokenized).float()
+                text_embedding = F.normalize(text_embedding, dim=-1)
+
+        elif self.model_type == ModelType.SIGLIP:
+            text_tokenized = self.tokenizer(
+                texts, padding="max_length", truncation=True, return_tensors="pt"
+            ).to(self.device)
+            with torch.inference_mode(), self._autocast():
+                text_embedding = self.model[1](**text_tokenized).pooler_output.float()
+
+        else:
+            # BLIP-2 and the BERT encoders pool over the unpadded sequence,
+            # so padding a batch would change their embeddings
+            embeddings = [self.generate_text_embedding(text) for text in texts]
+            if any(embedding is None for embedding in embeddings):
+                return None
+            return np.vstack(embeddings)
+
+        return self._to_numpy(text_embedding)
+
+    def _find_image_size(self):
+        """Input side of the image encoder, read from its preprocessing config"""
+        processor = getattr(self.processor, "image_processor", self.processor)
+        size = getattr(processor, "size", None)
+        if isinstance(size, dict):
+            size = max(size.values(), default=None)
+
+        # torchvision pipelines (CLIP, OpenCLIP) carry the size on their Resize step
+        for transform in getattr(processor, "transforms", ()):
+            transform_size = getattr(transform, "size", None)
+            if transform_size:
+                size = transform_size
+                break
+
+        if isinstance(size, (list, tuple)):
+            size = max(size)
+        return size if isinstance(size, int) else None
+
+    def _split_image_transform(self):
+        """
+        Split a torchvision pipeline ending in ToTensor + Normalize (CLIP, OpenCLIP)
+        so batches cross to the device as uint8 and are normalized there.
+        Resizing stays on PIL, so this split alone does not change the pixels
+        (JPEGs still differ from a full decode, see _open_image).
+        """
+        steps = getattr(self.processor, "transforms", None)
+        if not steps or len(steps) < 2:
+            return None, None
+
+        from torchvision import transforms
+
+        to_tensor, normalize = steps[-2], steps[-1]
+        if not isinstance(to_tensor, transforms.ToTensor) or not isinstance(
+            normalize, transforms.Normalize
+        ):
+            return None, None
+
+        transform = transforms.Compose(list(steps[:-2]) + [transforms.PILToTensor()])
+        mean = torch.tensor(normalize.mean, device=self.device).view(1, -1, 1, 1)
+        std = torch.tensor(normalize.std, device=self.device).view(1, -1, 1, 1)
+        return transform, (mean, std)
+
+    def _open_image(self, image_path: str):
+        """
+        Open an image, letting JPEGs decode at a reduced DCT scale that still
+        covers the encoder input, since it is downsampled right after anyway.
+        The resized pixels, and so the embeddings, differ slightly from a full decode.
+        """
+        image = Image.open(image_path)
+        if self.image_size:
+            image.draft("RGB", (self.image_size, self.image_size))
+        return image
+
+    def _get_preprocess_executor(self):
+        """Thread pool for image decoding and preprocessing, created on first use"""
+        if self.preprocess_executor is None:
+            self.preprocess_executor = ThreadPoolExecutor(
+                max_workers=self.PREPROCESS_WORKERS
+            )
+        return self.preprocess_executor
+
+    def _prepare_image(self, image_path: str):
+        """
+        Decode one image: CLIP-style transforms return its input tensor, while for
+        Hugging Face processors (which take the whole batch) the decoded RGB image
+        """
+        with self._open_image(image_path) as image:
+            if isinstance(self.model, list):
+                return image.convert("RGB")
+            if self.image_transform is not None:
+                return self.image_transform(image)
+            return self.processor(image)
+
+    def _preprocess_images(self, image_paths: list):
+        """Decode and preprocess images on threads; PIL and the transforms release the GIL"""
+        if len(image_paths) == 1:
+            return [self._prepare_image(image_paths[0])]
+        executor = self._get_preprocess_executor()
+        return list(executor.map(self._prepare_image, image_paths))
+
+    def generate_image_embeddings(self, image_paths: list):
+        """Generate embeddings for several images in one forward pass, one row per image"""
+        if not self._can_embed_images():
+            return None
+        return self._encode_image_batch(self._prepare_image_batch(image_paths))
+
+    def generate_image_embeddings_iter(self, path_batches):
+        """
+        Yield one embeddings array per batch of image paths. The next batch is
+        decoded and preprocessed on a helper thread while the current one runs
+        on the device; a batch that fails yields None.
+        """
+        if not self._can_embed_images():
+            for _ in path_batches:
+                yield None
+            return
+
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            path_batches = iter(path_batches)
+            upcoming = next(path_batches, None)
+            pending = None
+            if upcoming is not None:
+                pending = prefetcher.submit(self._prepare_image_batch, upcoming)
+
+            while pending is not None:
+                current = pending
+                upcoming = next(path_batches, None)
+                pending = None
+                if upcoming is not None:
+                    pending = prefetcher.submit(self._prepare_image_batch, upcoming)
+
+                try:
+                    yield self._encode_image_batch(current.result())
+                except Exception as e:
+                    self.logger(f"[WARNING] Image batch failed: {e}")
+                    yield None
+
+    def _can_embed_images(self):
+        """Check that a loaded model with an image encoder is available"""
+        if self.model is None or self.processor is None:
+            self.logger(f"[ERROR] Model {self.model_name} not loaded")
+            return False
+
+        if self.model_type not in (
+            ModelType.CLIP,
+            ModelType.OPEN_CLIP,
+            ModelType.OPEN_CLIP_FINE_TUNED,
+            ModelType.BLIP2,
+            ModelType.SIGLIP,
+        ):
+            self.logger(
+                f"[ERROR] Model type {self.model_type} does not generate image embeddings"
+            )
+            return False
+
+        return True
+
+    def _prepare_image_batch(self, image_paths: list):
+        """CPU half of a batched image forward: the model inputs, pinned on CUDA"""
+        images = self._preprocess_images(image_paths)
+        if isinstance(self.model, list):
+            inputs = dict(self.processor(images=images, return_tensors="pt"))
+        else:
+            inputs = {"pixel_values": torch.stack(images)}
+
+        if self.device == "cuda":
+            inputs = {name: tensor.pin_memory() for name, tensor in inputs.items()}
+        return inputs
+
+    def _encode_image_batch(self, inputs: dict):
+        """Device half of a batched image forward; returns one row per image"""
+        inputs = {
+            name: tensor.to(self.device, non_blocking=True)
+            for name, tensor in inputs.items()
+        }
+        count = inputs["pixel_values"].shape[0]
+
+        with torch.inference_mode(), self._autocast():
+            if inputs["pixel_values"].dtype == torch.uint8:
+                mean, std = self.image_normalize
+                pixel_values = inputs["pixel_values"].float().div_(255)
+                inputs["pixel_values"] = pixel_values.sub_(mean).div_(std)
+
+            if not isinstance(self.model, list):
+                image_embedding = self.model.encode_image(inputs["pixel_values"])
+                image_embedding = F.normalize(image_embedding.float(), dim=-1)
+            elif self.model_type == ModelType.SIGLIP:
+                image_embedding = self.model[0](**inputs).pooler_output.float()
+            else:
+                image_embedding = self.model[0](**inputs).image_embeds.float()
+                image_embedding = F.normalize(image_embedding, dim=-1)
+
+        image_embedding = self._to_numpy(image_embedding).reshape(count, -1)
+        if self.model_type == ModelType.BLIP2:
+            image_embedding = self.average_pool(image_embedding, self.embedding_length)
+        return image_embedding
@@ -5,11 +5,23 @@ import numpy as np
 # Redis imports
 import redis
 from redis.commands.search.query import Query
-from redis.commands.search.field import TextField, VectorField
+from redis.commands.search.field import TagField, TextField, VectorField
 from redis.commands.search.indexDefinition import IndexDefinition
 
 
+# Connection pools shared by every helper pointing at the same server
+_POOLS = {}
+
+# Embedding blob header holding the (h, w) shape
+_HEADER = struct.Struct(">ff")
+# Float16 blobs carry the same header as two float16 lanes
+_HALF_HEADER_SIZE = 2 * np.dtype(np.float16).itemsize
+
+
 class RedisHelper:
+    MAX_CONNECTIONS = 64
+    POOL_TIMEOUT = 5  # seconds to wait for a free connection
+
     def __init__(self, host: str, port: int, db: int, logger=None):
         self.host = host
         self.port = port
@@ -17,16 +29,42 @@ class RedisHelper:
         self.logger = logger or print
 
         self.client = None
+        self.text_client = None  # Decodes replies to str; not for embedding fields
 
     def connect(self):
         try:
-            self.client = redis.Redis(self.host, self.port, self.db)
+            self.client = redis.Redis(connection_pool=self._get_pool(False))
             self.client.ping()
+            self.text_client = redis.Redis(connection_pool=self._get_pool(True))
             return True
         except Exception as e:
             self.logger(f"[ERROR] Could not connect to Redis: {e}")
             return False
 
+    def _get_pool(self, decode_responses: bool):
+        """
+        Blocking pool per (host, port, db, decoding), so concurrent request
+        threads each get their own socket and wait rather than fail when it is full.
+        """
+        key = (self.host, self.port, self.db, decode_responses)
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = redis.BlockingConnectionPool(
+                host=self.host,
+                port=self.port,
+                db=self.db,
+                decode_responses=decode_responses,
+                max_connections=self.MAX_CONNECTIONS,
+                timeout=self.POOL_TIMEOUT,
+                socket_keepalive=True,
+            )
+            _POOLS[key] = pool
+        return pool
+
+    def text_pipeline(self):
+        """Non-transactional pipeline on the text client"""
+        return self.text_client.pipeline(transaction=False)
+
     # Redis commands
     def keys(self, pattern: str):
         return self.client.keys(pattern)
@@ -52,6 +90,9 @@ class RedisHelper:
     ):
         return self.client.hset(name, key, value, mapping, items)
 
+    def hsetnx(self, name: str, key: str, value):
+        return self.client.hsetnx(name, key, value)
+
     def hdel(self, name: str, *keys: str):
         if not keys:
             return 0
@@ -62,6 +103,27 @@ class RedisHelper:
             return self.client.delete(*name)
         return self.client.delete(name)
 
+    def unlink(self, *names: str):
+        if not names:
+            return 0
+        return self.client.unlink(*names)
+
+    def scan_iter(self, match: str = None, count: int = None):
+        return self.client.scan_iter(match=match, count=count)
+
+    def sscan_iter(self, name: str, match: str = None, count: int = None):
+        return self.client.sscan_iter(name, match=match, count=count)
+
+    def scard(self, name: str):
+        return self.client.scard(name)
+
+    def index_exists(self, index_name: str):
+        try:
+            self.client.ft(index_name).info()
+            return True
+        except redis.exceptions.ResponseError:
+            return False
+
     def ft(self, index_name: str = "idx"):
         return self.client.ft(index_name)
 
@@ -90,34 +152,66 @@ class RedisHelper:
     def srem(self, name: str, *values):
         return self.client.srem(name, *values)
 
-    def pipeline(self):
-        return self.client.pipeline()
+    def pipeline(self, transaction: bool = True):
+        return self.client.pipeline(transaction=transaction)
 
     # Custom commands
-    def decode_object(self, data: dict):
-        decoded = {}
-        for key, value in data.items():
-            try:
-                decoded[key.decode("utf-8")] = value.decode("utf-8")
-            except Exception as _:
-                decoded[key.decode("utf-8")] = value
-
-        return decoded
-
+    def hset_many(self, field: str, mapping: dict, batch_size: int = 1000):
+        """Set one field on many hashes ({name: value}), batch_size HSETs per round trip"""
+        pipe = self.client.pipeline(transaction=False)
+        for i, (name, value) in enumerate(mapping.items(), 1):
+            pipe.hset(name, field, value)
+            if i % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+    def hmget_many(self, names: list, *fields: str, batch_size: int = 1000):
+        """HMGET the same fields from many hashes, batch_size commands per round trip"""
+        replies = []
+        pipe = self.client.pipeline(transaction=False)
+        for i in range(0, len(names), batch_size):
+            for name in names[i : i + batch_size]:
+                pipe.hmget(name, *fields)
+            replies.extend(pipe.execute())
+        return replies
+
+    def hexists_many(self, names: list, field: str, batch_size: int = 1000):
+        """HEXISTS one field on many hashes without transferring its value"""
+        replies = []
+        pipe = self.client.pipeline(transaction=False)
+        for i in range(0, len(names), batch_size):
+            for name in names[i : i + batch_size]:
+                pipe.hexists(name, field)
+            replies.extend(pipe.execute())
+        return replies
+
+    # The (h, w) header is stored and indexed as part of the vector blob, so its
+    # float32 layout has to stay as is for existing data and indexes. Float16
+    # blobs get a float16 header instead: the float32 bytes read as half lanes
+    # can be NaN or huge for some widths and would break every cosine distance
     def embedding_encode(self, embedding: np.ndarray):
         h, w = embedding.shape
-        size = struct.pack(">ff", h, w)
+        if embedding.dtype == np.float16:
+            size = np.array([h, w], dtype=np.float16).tobytes()
+        else:
+            size = _HEADER.pack(h, w)
         return size + embedding.tobytes()
 
     def embedding_decode(self, data: bytes, dtype: np.dtype = np.float32):
-        h, w = struct.unpack(">ff", data[:8])
-        return np.frombuffer(data[8:], dtype).reshape(int(h), int(w))
+        if np.dtype(dtype) == np.float16:
+            # Widths above 2048 are not exact in float16, so w comes from the length
+            h = np.frombuffer(data, np.float16, count=2)[0]
+            embedding = np.frombuffer(data, np.float16, offset=_HALF_HEADER_SIZE)
+            return embedding.reshape(int(h), -1)
+        h, w = _HEADER.unpack_from(data)
+        embedding = np.frombuffer(data, dtype, offset=_HEADER.size)
+        return embedding.reshape(int(h), int(w))
 
     def create_new_index(
         self,
         index_name: str,
         doc_prefix: str,
-        fields: list[TextField | VectorField],
+        fields: list[TagField | TextField | VectorField],
         mute: bool = True,
     ):
         try:
@@ -0,0 +1,84 @@
+import time
+import queue
+import threading
+
+
+class SearchBatcher:
+    """Groups concurrent image searches so the model embeds their queries in one pass."""
+
+    BATCH_MAX = 32
+    WAIT_MS = 50
+    RESULT_TIMEOUT = 30  # seconds a caller waits for its batch
+
+    def __init__(self, controller, model_alias, logger=None):
+        self.controller = controller
+        self.model_alias = model_alias
+        self.logger = logger or print
+
+        self.requests = queue.Queue()
+        self.worker_thread = threading.Thread(target=self._worker, daemon=True)
+        self.worker_thread.start()
+
+    def search(self, query: str, top_k: int = 5):
+        """
+        Queue a search and wait for the batch containing it to finish.
+        Raises TimeoutError if it does not finish within RESULT_TIMEOUT.
+        """
+        request = {
+            "query": query,
+            "top_k": top_k,
+            "done": threading.Event(),
+            "result": None,
+        }
+        self.requests.put(request)
+        if not request["done"].wait(self.RESULT_TIMEOUT):
+            raise TimeoutError(
+                f"Search did not complete within {self.RESULT_TIMEOUT} seconds"
+            )
+        return request["result"]
+
+    def _collect_batch(self):
+        """
+        Block for the next request, then take whatever else is already queued.
+        Only when requests are arriving concurrently, keep the batch open for
+        up to WAIT_MS so a lone query is never delayed.
+        """
+        batch = [self.requests.get()]
+
+        while len(batch) < self.BATCH_MAX:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+
+        if len(batch) > 1:
+            deadline = time.monotonic() + self.WAIT_MS / 1000
+            while len(batch) < self.BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+        return batch
+
+    def _worker(self):
+        """Background worker dispatching batches to the controller."""
+        while True:
+            batch = self._collect_batch()
+
+            try:
+                results = self.controller.search_batch(
+                    self.model_alias,
+                    [(request["query"], request["top_k"]) for request in batch],
+                )
+                for request, result in zip(batch, results):
+                    request["result"] = result
+            except Exception as e:
+                self.logger(f"[ERROR] Batched search failed: {e}")
+            finally:
+                # Requests without a result are released with None
+                for request in batch:
+                    request["done"].set()
@@ -2,27 +2,81 @@ import os
 import json
 import time
 import datetime
+import queue
+import logging
+import logging.handlers
 import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask
-from redis.commands.search.field import TextField
+from redis.commands.search.field import TagField
 
 from utils.controller import Controller
+from utils.file_scan import paths_exist
 from utils.generic_watcher import GenericFileWatcher
+from utils.json_provider import OrjsonProvider
+from utils.search_batcher import SearchBatcher
+from utils.ttl_cache import TTLCache
+
+
+def _batched(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 class Server:
     CONFIG_FILE = "config.json"
     LOG_FILE = "server.log"
 
+    IMAGE_DETAILS_CACHE_TTL = 300  # seconds
+    IMAGE_DETAILS_CACHE_SIZE = 10000
+    IMAGE_PATH_CACHE_TTL = 60  # seconds
+    IMAGE_PATH_CACHE_SIZE = 8192
+    MODEL_STATUS_CACHE_TTL = 0.1  # seconds
+    IMAGE_BATCH_SIZE = 32  # images per model forward pass, by default
+    TEXT_BATCH_SIZE = 128  # document titles per model forward pass, by default
+    SCAN_COUNT = 1024  # SCAN/SSCAN hint: keys Redis walks per call
+    SCAN_BATCH_SIZE = 500  # scanned keys handled per pipelined round trip
+    STARTUP_DELAY = 2  # seconds before background init if no request arrives
+    MODEL_STATUS_NAMES = {0: "unloaded", 1: "loading", 2: "loaded"}
+    MODEL_LOAD_WAIT = 300  # seconds background work waits for a model that is loading
+
+    LOG_MAX_BYTES = 10_000_000
+    LOG_BACKUP_COUNT = 5
+
     def server_log(self, message):
         print(message)
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.log_file.write(f"{timestamp}: {message}\n")
-        self.log_file.flush()
+        self.file_logger.info(message)
+
+    def _start_file_logging(self):
+        """
+        Log to LOG_FILE through a queue: callers only enqueue the record, and a
+        listener thread formats and writes it to a rotating file
+        """
+        file_handler = logging.handlers.RotatingFileHandler(
+            self.LOG_FILE,
+            maxBytes=self.LOG_MAX_BYTES,
+            backupCount=self.LOG_BACKUP_COUNT,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(
+            logging.Formatter("%(asctime)s: %(message)s", "%Y-%m-%d %H:%M:%S")
+        )
+        log_queue = queue.SimpleQueue()
+
+        self.file_logger = logging.getLogger(__name__)
+        self.file_logger.setLevel(logging.INFO)
+        self.file_logger.propagate = False  # messages are already printed
+        self.file_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+
+        self.log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        self.log_listener.start()
 
     def __init__(self, config_path=None):
-        self.log_file = open(self.LOG_FILE, "a", encoding="utf-8")
+        self._start_file_logging()
         self.server_log("[INFO] Initializing Server...")
 
         self.app_name = None
@@ -35,19 +89,39 @@ class Server:
         self.redis_db = None
 
         self.watched_folders = []
+        self.x_accel_redirect = {"enabled": False, "internal_location": "/protected"}
         self.model_alias = None
         self.embedding_schedule = None
-
+        self.schedule_type = "manual"
+        self.schedule_start_hour = 1
+        self.schedule_interval_hours = 24
+        self.schedule_interval = datetime.timedelta(hours=24)
+        self.image_batch_size = self.IMAGE_BATCH_SIZE
+        self.text_batch_size = self.TEXT_BATCH_SIZE
+
+        self.file_watcher = None
         self.scheduler_thread = None
         self.scheduler_running = False
+        self.scheduler_stop = threading.Event()
+        self.ready_indexes = set()  # (model_alias, prefix) indexes known to exist
 
         self.dynamic_loading_enabled = False
         self.unload_timeout_minutes = 10
+        self.unload_timeout_seconds = 600
         self.model_last_used = None
         self.unload_timer = None
+        self.unload_deadline = None  # time.monotonic() after which the model unloads
         self.model_loading_lock = threading.Lock()
+        self.model_status_cache = (0.0, None)  # (expires_at, status)
         self.pending_search_requests = []
 
+        self.image_details_cache = TTLCache(
+            self.IMAGE_DETAILS_CACHE_TTL, self.IMAGE_DETAILS_CACHE_SIZE
+        )
+        self.image_path_cache = TTLCache(
+            self.IMAGE_PATH_CACHE_TTL, self.IMAGE_PATH_CACHE_SIZE
+        )
+
         self.embedding_progress = {
             "active": False,
             "stage": "",
@@ -71,6 +145,9 @@ class Server:
             )
 
         self.app = Flask(self.app_name)
+        self.app.json = OrjsonProvider(self.app)
+        self.app_ready = threading.Event()
+        self.app.before_request(self._mark_app_ready)
 
         models_config_full_path = os.path.join(
             os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
@@ -96,6 +173,10 @@ class Server:
 
         self.rc = self.controller.rc
 
+        self.search_batcher = SearchBatcher(
+            self.controller, self.model_alias, logger=self.server_log
+        )
+
         if not self.dynamic_loading_enabled:
             if not self.controller.load_model(self.model_alias):
                 self.server_log("[ERROR] Failed to load model.")
@@ -115,11 +196,17 @@ class Server:
     def __str__(self):
         return f"Server(app_name={self.app_name}, version={self.version}, redis_host={self.redis_host}, redis_port={self.redis_port}, redis_db={self.redis_db}, watched_folders={self.watched_folders})"
 
+    def _mark_app_ready(self):
+        """Flask before_request hook: the app is serving requests"""
+        if not self.app_ready.is_set():
+            self.app_ready.set()
+
     def _background_initialization(self):
         """Run background initialization tasks that shouldn't block server startup."""
         self.server_log("[INFO] Starting background initialization...")
 
-        time.sleep(2)  # Give some time for the server to start
+        # Give the server time to start; the first request shows it already has
+        self.app_ready.wait(timeout=self.STARTUP_DELAY)
 
         self.server_log("[INFO] Processing existing files in background...")
         self.process_existing_files()
@@ -141,6 +228,9 @@ class Server:
             self.redis_db = config.get("redis_db", 0)
 
             self.watched_folders = config.get("watched_folders", [])
+            self.x_accel_redirect = config.get(
+                "x_accel_redirect", self.x_accel_redirect
+            )
 
             self.model_alias = config.get("model_alias", "")
 
@@ -150,27 +240,56 @@ class Server:
                 "embedding_schedule",
                 {"schedule_type": "manual", "start_hour": 1, "interval_hours": 24},
             )
+            # Read once here instead of on every scheduler tick and request
+            self.schedule_type = self.embedding_schedule.get("schedule_type", "manual")
+            self.schedule_start_hour = self.embedding_schedule.get("start_hour", 1)
+            self.schedule_interval_hours = self.embedding_schedule.get(
+                "interval_hours", 24
+            )
+            self.schedule_interval = datetime.timedelta(
+                hours=self.schedule_interval_hours
+            )
+
+            batch_config = config.get("embedding_batch_size", {})
+            self.image_batch_size = batch_config.get("images", self.IMAGE_BATCH_SIZE)
+            self.text_batch_size = batch_config.get("documents", self.TEXT_BATCH_SIZE)
 
             dynamic_config = config.get("dynamic_model_loading", {})
             self.dynamic_loading_enabled = dynamic_config.get("enabled", False)
             self.unload_timeout_minutes = dynamic_config.get(
                 "unload_timeout_minutes", 10
             )
+            self.unload_timeout_seconds = self.unload_timeout_minutes * 60
 
     def try_create_index(self):
         """
         Attempt to create the image and document indices if embeddings are available.
-        Safe to call multiple times.
+        Safe to call multiple times; once both exist it returns without touching Redis.
         """
-        try:
-            self.controller.index(
-                "image:", [TextField(name="hidden")], self.model_alias
-            )
-            self.server_log("[INFO] Image index created successfully.")
+        image_index = (self.model_alias, "image:")
+        document_index = (self.model_alias, "document:")
+        if image_index in self.ready_indexes and document_index in self.ready_indexes:
+            return True
 
-            self.controller.index(
-                "document:", [TextField(name="hidden")], self.model_alias
-            )
+        try:
+            if image_index not in self.ready_indexes:
+                if not self.controller.index(
+                    "image:", [TagField(name="hidden")], self.model_alias
+                ):
+                    return False
+                self.ready_indexes.add(image_index)
+                self.controller.search_result_cache.clear()
+                self.server_log("[INFO] Image index created successfully.")
+
+            if not self.controller.index(
+                "document:",
+                [TagField(name="hidden")],
+                self.model_alias,
+                initial_cap=self.rc.scard("documents"),
+            ):
+                return False
+            self.ready_indexes.add(document_index)
+            self.controller.search_result_cache.clear()
             self.server_log("[INFO] Document index created successfully.")
             return True
         except Exception as e:
@@ -184,110 +303,69 @@ class Server:
 
     def stop_watchers(self):
         """Stop the generic file watcher."""
-        if hasattr(self, "file_watcher"):
+        if self.file_watcher is not None:
             self.file_watcher.stop()
             self.server_log("[INFO] All watchers stopped.")
 
     def process_existing_files(self):
         """Process existing files in watched folders."""
-        if hasattr(self, "file_watcher"):
+        if self.file_watcher is not None:
             self.file_watcher.scan_existing_files()
 
+    def invalidate_image_caches(self, *image_ids):
+        """
+        Drop cached details and paths for images whose image or documents changed.
+        Cached search results may include them, so those are cleared too.
+        """
+        image_ids = [
+            image_id.decode("utf-8") if isinstance(image_id, bytes) else image_id
+            for image_id in image_ids
+        ]
+        self.image_details_cache.pop(*image_ids)
+        self.image_path_cache.pop(*image_ids)
+        self.controller.search_result_cache.clear()
+
     def get_server_statistics(self):
         """Get server statistics including image counts."""
         try:
-            pipe = self.rc.client.pipeline()
+            pipe = self.rc.client.pipeline(transaction=False)
 
-            pattern_image = "image:*"
-            pattern_doc = "document:*"
-
-            all_image_keys = self.rc.keys(pattern_image)
-            all_doc_keys = self.rc.keys(pattern_doc)
-
-            total_images = len(all_image_keys)
-            total_documents = len(all_doc_keys)
-
-            # If there are no items, return
-            if total_images == 0 and total_documents == 0:
-                return {
-                    "total_images": 0,
-                    "visible_images": 0,
-                    "hidden_images": 0,
-                    "total_documents": 0,
-                    "visible_documents": 0,
-                    "hidden_documents": 0,
-                    "linked_documents": 0,
-                    "unlinked_documents": 0,
-                    "watched_folders": len(self.watched_folders),
-                }
-
-            for key in all_image_keys:
-                pipe.hget(key, "hidden")
-            for key in all_doc_keys:
-                pipe.hget(key, "hidden")
-                pipe.hget(key, "images")  # Also get images field for link count
-
-            results = pipe.execute()
-
-            visible_images = 0
+            # Keys are scanned and their fields read SCAN_BATCH_SIZE at a time, so
+            # Redis never builds one reply for the whole keyspace
+            total_images = 0
             hidden_images = 0
-
-            for i in range(total_images):
-                hidden_status = results[i]
-                if hidden_status:
-                    hidden_value = (
-                        hidden_status.decode("utf-8")
-                        if isinstance(hidden_status, bytes)
-                        else str(hidden_status)
-                    )
-                    if hidden_value == "true":
-                        hidden_images += 1
-                    else:
-                        visible_images += 1
-                else:
-                    # If hidden field is None/empty, consider it visible (default)
-                    visible_images += 1
-
-            visible_documents = 0
+            image_keys = self.rc.scan_iter(match="image:*", count=self.SCAN_COUNT)
+            for chunk in _batched(image_keys, self.SCAN_BATCH_SIZE):
+                for key in chunk:
+                    pipe.hget(key, "hidden")
+                # Counted in C with list.count; a missing or empty hidden field
+                # counts as visible (default)
+                hidden_statuses = pipe.execute()
+                total_images += len(hidden_statuses)
+                hidden_images += hidden_statuses.count(b"true")
+
+            total_documents = 0
             hidden_documents = 0
             linked_documents = 0
-
-            doc_start_index = total_images
-            for i in range(total_documents):
-                hidden_idx = doc_start_index + (
-                    i * 2
-                )  # Every 2nd result is hidden field
-                images_idx = (
-                    doc_start_index + (i * 2) + 1
-                )  # Every 2nd+1 result is images field
-
-                hidden_status = (
-                    results[hidden_idx] if hidden_idx < len(results) else None
+            doc_keys = self.rc.sscan_iter("documents", count=self.SCAN_COUNT)
+            for chunk in _batched(doc_keys, self.SCAN_BATCH_SIZE):
+                for key in chunk:
+                    pipe.hget(key, "hidden")
+                    pipe.hget(key, "images")  # Also get images field for link count
+                replies = pipe.execute()
+                hidden_statuses = replies[0::2]
+                images_fields = replies[1::2]
+                total_documents += len(hidden_statuses)
+                hidden_documents += hidden_statuses.count(b"true")
+                linked_documents += (
+                    len(images_fields)
+                    - images_fields.count(None)
+                    - images_fields.count(b"")
+                    - images_fields.count(b"[]")
                 )
-                images_json = results[images_idx] if images_idx < len(results) else None
 
-                if hidden_status:
-                    hidden_value = (
-                        hidden_status.decode("utf-8")
-                        if isinstance(hidden_status, bytes)
-                        else str(hidden_status)
-                    )
-                    if hidden_value == "true":
-                        hidden_documents += 1
-                    else:
-                        visible_documents += 1
-                else:
-                    # If hidden field is None/empty, consider it visible (default)
-                    visible_documents += 1
-
-                if images_json:
-                    images_str = (
-                        images_json.decode("utf-8")
-                        if isinstance(images_json, bytes)
-                        else images_json
-                    )
-                    if images_str and images_str != "[]":
-                        linked_documents += 1
+            visible_images = total_images - hidden_images
+            visible_documents = total_documents - hidden_documents
 
             return {
                 "total_images": total_images,
@@ -319,10 +397,11 @@ class Server:
 
     def start_scheduler(self):
         """Start the embedding generation scheduler if configured for interval mode."""
-        schedule_type = self.embedding_schedule.get("schedule_type")
+        schedule_type = self.schedule_type
 
         if schedule_type == "interval":
             self.scheduler_running = True
+            self.scheduler_stop.clear()
             self.scheduler_thread = threading.Thread(
                 target=self._scheduler_worker, daemon=True
             )
@@ -341,14 +420,16 @@ class Server:
         """Stop the embedding generation scheduler."""
         if self.scheduler_running:
             self.scheduler_running = False
+            self.scheduler_stop.set()
             if self.scheduler_thread and self.scheduler_thread.is_alive():
                 self.scheduler_thread.join()
             self.server_log("[INFO] Embedding generation scheduler stopped")
 
     def _scheduler_worker(self):
         """Background worker for scheduled embedding generation."""
-        start_hour = self.embedding_schedule.get("start_hour", 1)
-        interval_hours = self.embedding_schedule.get("interval_hours", 24)
+        start_hour = self.schedule_start_hour
+        interval_hours = self.schedule_interval_hours
+        interval = self.schedule_interval
 
         self.server_log(
             f"[INFO] Scheduler configured: start_hour={start_hour}, interval_hours={interval_hours}"
@@ -364,10 +445,13 @@ class Server:
             f"[INFO] Next embedding generation scheduled for: {target_time}"
         )
 
+        # Sleep until the target time; stop_scheduler wakes the wait right away
         while self.scheduler_running:
-            now = datetime.datetime.now()
+            wait_seconds = (target_time - datetime.datetime.now()).total_seconds()
+            if self.scheduler_stop.wait(timeout=max(0.0, wait_seconds)):
+                break
 
-            if now >= target_time:
+            if datetime.datetime.now() >= target_time:
                 self.server_log("[INFO] Starting scheduled embedding generation")
                 try:
                     result = self.generate_embeddings()
@@ -379,13 +463,11 @@ class Server:
                         f"[ERROR] Scheduled embedding generation failed: {e}"
                     )
 
-                target_time += datetime.timedelta(hours=interval_hours)
+                target_time += interval
                 self.server_log(
                     f"[INFO] Next embedding generation scheduled for: {target_time}"
                 )
 
-            time.sleep(60)
-
     def generate_embeddings(self):
         """Generate embeddings for all images and documents in Redis that don't have embeddings yet."""
         try:
@@ -407,133 +489,48 @@ class Server:
             self.embedding_progress["skipped"] = 0
             self.embedding_progress["errors"] = 0
 
-            image_pattern = "image:*"
-            image_keys = self.rc.keys(image_pattern)
-            doc_pattern = "document:*"
-            doc_keys = self.rc.keys(doc_pattern)
-
-            total_items = len(image_keys) + len(doc_keys)
-            self.embedding_progress["total"] = total_items
+            # Images are scanned in bounded chunks, so their total grows as they arrive
+            total_documents = self.rc.scard("documents")
+            self.embedding_progress["total"] = total_documents
             self.embedding_progress["current"] = 0
 
-            image_processed = 0
-            image_skipped = 0
-            image_errors = 0
-
-            self.embedding_progress["stage"] = "Processing images"
-            self.server_log(
-                f"[INFO] Starting embedding generation for {len(image_keys)} images using model {self.model_alias}"
-            )
-
-            for key in image_keys:
-                key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-
-                try:
-                    existing_embedding = self.rc.hget(
-                        key_str, loaded_model.embedding_name
-                    )
-                    if existing_embedding:
-                        image_skipped += 1
-                        self.embedding_progress["skipped"] += 1
-                        self.embedding_progress["current"] += 1
-                        continue
-
-                    image_data = self.rc.hgetall(key_str)
-                    local_path = image_data.get(b"local_path", b"").decode("utf-8")
-                    is_hidden = (
-                        image_data.get(b"hidden", b"false").decode("utf-8") == "true"
-                    )
-
-                    if is_hidden or not local_path or not os.path.exists(local_path):
-                        image_skipped += 1
-                        self.embedding_progress["skipped"] += 1
-                        self.embedding_progress["current"] += 1
-                        continue
-
-                    embedding = loaded_model.generate_image_embedding(local_path)
-                    if embedding is not None:
-                        encoded_embedding = self.rc.embedding_encode(embedding)
-                        self.rc.hset(
-                            key_str, loaded_model.embedding_name, encoded_embedding
-                        )
-                        image_processed += 1
-                        self.embedding_progress["processed"] += 1
-                        # self.server_log(
-                        #     f"[INFO] Generated embedding for image: {local_path}"
-                        # )
-                    else:
-                        image_errors += 1
-                        self.embedding_progress["errors"] += 1
-                        self.server_log(
-                            f"[ERROR] Failed to generate embedding for image: {local_path}"
-                        )
-
-                except Exception as e:
-                    image_errors += 1
-                    self.embedding_progress["errors"] += 1
-                    self.server_log(f"[ERROR] Error processing image {key_str}: {e}")
-
-                self.embedding_progress["current"] += 1
-
-            doc_processed = 0
-            doc_skipped = 0
-            doc_errors = 0
-
-            self.embedding_progress["stage"] = "Processing documents"
-            self.server_log(
-                f"[INFO] Starting embedding generation for {len(doc_keys)} documents using model {self.model_alias}"
+            # Both kinds run through one pipeline: scan, select, embed in batches
+            sources = (
+                (
+                    "image",
+                    self.rc.scan_iter(match="image:*", count=self.SCAN_COUNT),
+                    "local_path",
+                ),
+                (
+                    "document",
+                    self.rc.sscan_iter("documents", count=self.SCAN_COUNT),
+                    "title",
+                ),
             )
+            stats = {}
+            for kind, keys, source_field in sources:
+                self.embedding_progress["stage"] = f"Processing {kind}s"
+                self.server_log(
+                    f"[INFO] Starting embedding generation for {kind}s using model {self.model_alias}"
+                )
 
-            for key in doc_keys:
-                key_str = key.decode("utf-8") if isinstance(key, bytes) else key
-
-                try:
-                    existing_embedding = self.rc.hget(
-                        key_str, loaded_model.embedding_name
-                    )
-                    if existing_embedding:
-                        doc_skipped += 1
-                        self.embedding_progress["skipped"] += 1
-                        self.embedding_progress["current"] += 1
-                        continue
-
-                    doc_data = self.rc.hgetall(key_str)
-                    title = doc_data.get(b"title", b"").decode("utf-8")
-                    is_hidden = (
-                        doc_data.get(b"hidden", b"false").decode("utf-8") == "true"
-                    )
-
-                    if is_hidden or not title.strip():
-                        doc_skipped += 1
-                        self.embedding_progress["skipped"] += 1
-                        self.embedding_progress["current"] += 1
-                        continue
-
-                    # Generate text embedding using document title
-                    embedding = loaded_model.generate_text_embedding(title)
-                    if embedding is not None:
-                        encoded_embedding = self.rc.embedding_encode(embedding)
-                        self.rc.hset(
-                            key_str, loaded_model.embedding_name, encoded_embedding
-                        )
-                        doc_processed += 1
-                        self.embedding_progress["processed"] += 1
-                        # self.server_log(
-                        #     f"[INFO] Generated embedding for document: {title}"
-                        # )
-                    else:
-                        doc_errors += 1
-                        self.embedding_progress["errors"] += 1
-                        self.server_log(
-                            f"[ERROR] Failed to generate embedding for document: {title}"
-                        )
+                states = self._scan_embedding_state(
+                    keys, loaded_model.embedding_name, source_field
+                )
+                pending, scanned, skipped, errors = self._select_pending(
+                    states, kind, counted=kind == "document"
+                )
+                if kind == "image":
+                    pending, missing = self._drop_missing_files(pending)
+                    skipped += missing
 
-                except Exception as e:
-                    doc_errors += 1
-                    self.embedding_progress["errors"] += 1
-                    self.server_log(f"[ERROR] Error processing document {key_str}: {e}")
+                processed, embed_errors = self._embed_pending(
+                    loaded_model, pending, kind
+                )
+                stats[kind] = (scanned, processed, skipped, errors + embed_errors)
 
-                self.embedding_progress["current"] += 1
+            total_images, image_processed, image_skipped, image_errors = stats["image"]
+            _, doc_processed, doc_skipped, doc_errors = stats["document"]
 
             total_processed = image_processed + doc_processed
             total_skipped = image_skipped + doc_skipped
@@ -554,8 +551,8 @@ class Server:
                 "doc_processed": doc_processed,
                 "doc_skipped": doc_skipped,
                 "doc_errors": doc_errors,
-                "total_images": len(image_keys),
-                "total_documents": len(doc_keys),
+                "total_images": total_images,
+                "total_documents": total_documents,
             }
 
             self.server_log(
@@ -582,6 +579,171 @@ class Server:
                 "errors": 0,
             }
 
+    def _scan_embedding_state(self, keys, embedding_name, source_field):
+        """
+        Yield (key, has_embedding, (source_field, hidden)) for scanned keys, read
+        SCAN_BATCH_SIZE keys at a time in pipelined round trips
+        """
+        for chunk in _batched(keys, self.SCAN_BATCH_SIZE):
+            chunk = [
+                key.decode("utf-8") if isinstance(key, bytes) else key
+                for key in chunk
+            ]
+            yield from zip(
+                chunk,
+                self.rc.hexists_many(chunk, embedding_name),
+                self.rc.hmget_many(chunk, source_field, "hidden"),
+            )
+
+    def _select_pending(self, states, kind, counted=False):
+        """
+        Filter scanned states down to the (key, source) items that still need an
+        embedding, updating progress for the rest. Unless counted, every item is
+        also added to the progress total. Returns (pending, scanned, skipped, errors).
+        """
+        # Runs once per key, so attribute lookups are hoisted out of the loop
+        progress = self.embedding_progress
+        server_log = self.server_log
+        pending = []
+        append = pending.append
+        scanned = skipped = errors = 0
+
+        for key_str, embedded, (source, hidden_status) in states:
+            scanned += 1
+            if not counted:
+                progress["total"] += 1
+
+            if embedded or hidden_status == b"true":
+                skipped += 1
+                progress["skipped"] += 1
+                progress["current"] += 1
+                continue
+
+            try:
+                source = (source or b"").decode("utf-8")
+            except UnicodeDecodeError as e:
+                errors += 1
+                progress["errors"] += 1
+                progress["current"] += 1
+                server_log(f"[ERROR] Error processing {kind} {key_str}: {e}")
+                continue
+
+            if not source.strip():
+                skipped += 1
+                progress["skipped"] += 1
+                progress["current"] += 1
+                continue
+
+            append((key_str, source))
+
+        return pending, scanned, skipped, errors
+
+    def _drop_missing_files(self, pending):
+        """
+        Drop (key, path) items whose file is gone, counting them as skipped.
+        The checks overlap on threads. Returns (remaining, missing).
+        """
+        found = paths_exist([path for _, path in pending])
+        missing = found.count(False)
+        self.embedding_progress["skipped"] += missing
+        self.embedding_progress["current"] += missing
+        return [item for item, exists in zip(pending, found) if exists], missing
+
+    def _embed_pending(self, loaded_model, pending, kind):
+        """
+        Embed and store (redis_key, input) items in batches. kind is "image" (input
+        is a local path) or "document" (input is a title). Returns (processed, errors).
+        """
+        batch_size = self.image_batch_size if kind == "image" else self.text_batch_size
+        batches = [
+            pending[i : i + batch_size] for i in range(0, len(pending), batch_size)
+        ]
+        inputs = [[item for _, item in batch] for batch in batches]
+
+        if kind == "image":
+            # The next batch is decoded while the current one runs on the model
+            batch_embeddings = loaded_model.generate_image_embeddings_iter(inputs)
+        else:
+            batch_embeddings = (
+                self._embed_texts(loaded_model, texts) for texts in inputs
+            )
+
+        # Each batch is written on a helper thread while the next one is encoded;
+        # waiting on the previous write first keeps one write in flight at most
+        processed = errors = 0
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            write = None
+            for batch, embeddings in zip(batches, batch_embeddings):
+                encoded, batch_errors = self._encode_batch_embeddings(
+                    loaded_model, batch, kind, embeddings
+                )
+                errors += batch_errors
+                if write is not None:
+                    processed += write.result()
+                write = writer.submit(
+                    self._write_batch_embeddings,
+                    loaded_model.embedding_name,
+                    encoded,
+                    len(batch),
+                )
+            if write is not None:
+                processed += write.result()
+        return processed, errors
+
+    def _embed_texts(self, loaded_model, texts):
+        """One forward pass over texts; None if the batch fails as a whole"""
+        try:
+            return loaded_model.generate_text_embeddings(texts)
+        except Exception as e:
+            self.server_log(
+                f"[WARNING] Batch document embedding failed, retrying one by one: {e}"
+            )
+            return None
+
+    def _encode_batch_embeddings(self, loaded_model, batch, kind, embeddings):
+        """
+        Encode a batch's embeddings (one row per item) for storage. When the batch
+        produced none, items are embedded one by one instead.
+        Returns ({redis_key: encoded}, errors).
+        """
+        if embeddings is not None:
+            embeddings = [embedding.reshape(1, -1) for embedding in embeddings]
+        else:
+            embed_one = (
+                loaded_model.generate_image_embedding
+                if kind == "image"
+                else loaded_model.generate_text_embedding
+            )
+            embeddings = []
+            for _, item in batch:
+                try:
+                    embeddings.append(embed_one(item))
+                except Exception as e:
+                    self.server_log(f"[ERROR] Error processing {kind} {item}: {e}")
+                    embeddings.append(None)
+
+        encoded = {}
+        errors = 0
+        for (key_str, item), embedding in zip(batch, embeddings):
+            if embedding is not None:
+                encoded[key_str] = self.rc.embedding_encode(embedding)
+            else:
+                errors += 1
+                self.server_log(
+                    f"[ERROR] Failed to generate embedding for {kind}: {item}"
+                )
+        self.embedding_progress["errors"] += errors
+        return encoded, errors
+
+    def _write_batch_embeddings(self, embedding_name, encoded, batch_len):
+        """Store encoded embeddings and advance progress; returns the count stored"""
+        self.rc.hset_many(embedding_name, encoded)
+        # Newly embedded items can now match queries answered from the cache
+        self.controller.search_result_cache.clear()
+        self.embedding_progress["processed"] += len(encoded)
+        self.embedding_progress["current"] += batch_len
+        return len(encoded)
+
     def generate_image_embeddings(self):
         """
         Legacy method name for backward compatibility.
@@ -666,7 +828,7 @@ class Server:
         :param redis_key: Redis key for the item (e.g., 'image:hash' or 'document:hash')
         :return: Boolean indicating success
         """
-        if self.embedding_schedule.get("schedule_type") != "immediate":
+        if self.schedule_type != "immediate":
             return False
 
         try:
@@ -679,22 +841,23 @@ class Server:
 
             loaded_model = self.controller.get_model(self.model_alias)
 
-            existing_embedding = self.rc.hget(redis_key, loaded_model.embedding_name)
-            if existing_embedding:
+            # Read only decoded metadata; embedding blobs stay on the server
+            pipe = self.rc.text_pipeline()
+            pipe.hexists(redis_key, loaded_model.embedding_name)
+            pipe.hmget(redis_key, "hidden", "local_path", "title")
+            has_embedding, (hidden_status, local_path, title) = pipe.execute()
+            if has_embedding:
                 return True  # Already has embedding
 
-            item_data = self.rc.hgetall(redis_key)
-            if not item_data:
+            if hidden_status is None and local_path is None and title is None:
                 return False
 
-            is_hidden = item_data.get(b"hidden", b"false").decode("utf-8") == "true"
-            if is_hidden:
+            if hidden_status == "true":
                 return False
 
             embedding = None
 
             if redis_key.startswith("image:"):
-                local_path = item_data.get(b"local_path", b"").decode("utf-8")
                 if local_path and os.path.exists(local_path):
                     embedding = loaded_model.generate_image_embedding(local_path)
                     if embedding is not None:
@@ -703,8 +866,7 @@ class Server:
                         )
 
             elif redis_key.startswith("document:"):
-                title = item_data.get(b"title", b"").decode("utf-8")
-                if title.strip():
+                if title and title.strip():
                     embedding = loaded_model.generate_text_embedding(title)
                     if embedding is not None:
                         self.server_log(
@@ -712,8 +874,12 @@ class Server:
                         )
 
             if embedding is not None:
+                # HSETNX keeps an embedding written meanwhile by a batch run
                 encoded_embedding = self.rc.embedding_encode(embedding)
-                self.rc.hset(redis_key, loaded_model.embedding_name, encoded_embedding)
+                self.rc.hsetnx(
+                    redis_key, loaded_model.embedding_name, encoded_embedding
+                )
+                self.controller.search_result_cache.clear()
 
                 self.try_create_index()
                 return True
@@ -731,11 +897,11 @@ class Server:
 
     def get_embedding_schedule_status(self):
         """Get the current status of the embedding generation schedule."""
-        schedule_type = self.embedding_schedule.get("schedule_type", "manual")
+        schedule_type = self.schedule_type
         status = {
             "schedule_type": schedule_type,
-            "start_hour": self.embedding_schedule.get("start_hour", 1),
-            "interval_hours": self.embedding_schedule.get("interval_hours", 24),
+            "start_hour": self.schedule_start_hour,
+            "interval_hours": self.schedule_interval_hours,
             "scheduler_running": self.scheduler_running,
             "current_model": self.model_alias,
         }
@@ -755,32 +921,55 @@ class Server:
 
         return status
 
+    def get_cached_model_status(self):
+        """Model status for request handlers, re-read at most every MODEL_STATUS_CACHE_TTL seconds"""
+        expires_at, model_status = self.model_status_cache
+        now = time.monotonic()
+        if now >= expires_at:
+            model_status = self.controller.get_model_status(self.model_alias)
+            self.model_status_cache = (now + self.MODEL_STATUS_CACHE_TTL, model_status)
+        return model_status
+
+    def invalidate_model_status(self):
+        """Force the next status read to hit the controller after a load/unload"""
+        self.model_status_cache = (0.0, None)
+
     def reset_unload_timer(self):
-        """Reset the model unload timer"""
-        if self.unload_timer:
-            self.unload_timer.cancel()
+        """
+        Push the unload deadline back. Only the deadline moves per query; a timer
+        is armed just when none is pending, and re-arms itself if the deadline
+        moved while it waited. Called with model_loading_lock held.
+        """
+        if not self.dynamic_loading_enabled:
+            return
 
-        if self.dynamic_loading_enabled:
-            self.unload_timer = threading.Timer(
-                self.unload_timeout_minutes * 60, self.unload_model_after_timeout
-            )
-            self.unload_timer.start()
+        self.unload_deadline = time.monotonic() + self.unload_timeout_seconds
+        if self.unload_timer is None:
+            self._arm_unload_timer(self.unload_timeout_seconds)
+
+    def _arm_unload_timer(self, delay):
+        """Start a one-shot timer that checks the unload deadline after delay seconds"""
+        self.unload_timer = threading.Timer(delay, self.unload_model_after_timeout)
+        self.unload_timer.daemon = True
+        self.unload_timer.start()
 
     def unload_model_after_timeout(self):
-        """Unload the model after timeout period"""
+        """Unload the model once its deadline has passed, or wait for the new one"""
         with self.model_loading_lock:
-            current_time = time.time()
-            if (
-                self.model_last_used
-                and current_time - self.model_last_used
-                >= self.unload_timeout_minutes * 60
-            ):
+            remaining = self.unload_deadline - time.monotonic()
+            if remaining > 0:
+                # Used again since this timer was armed
+                self._arm_unload_timer(remaining)
+            else:
+                self.unload_timer = None
                 model_status = self.controller.get_model_status(self.model_alias)
                 if model_status == 2:  # ModelStatus.LOADED
                     self.server_log(
                         f"[INFO] Unloading model {self.model_alias} after {self.unload_timeout_minutes} minutes of inactivity"
                     )
-                    if self.controller.unload_model(self.model_alias):
+                    unloaded = self.controller.unload_model(self.model_alias)
+                    self.invalidate_model_status()
+                    if unloaded:
                         self.server_log(
                             f"[SUCCESS] Model {self.model_alias} unloaded successfully"
                         )
@@ -789,12 +978,35 @@ class Server:
                             f"[ERROR] Failed to unload model {self.model_alias}"
                         )
 
-    def ensure_model_loaded(self):
-        """Ensure the model is loaded for search operations. Returns True if ready, False if loading/failed."""
+    def mark_model_used(self):
+        """
+        Push the unload deadline back for a query that found the model loaded in
+        the status cache. Returns False if it was unloaded meanwhile.
+        """
+        if not self.dynamic_loading_enabled:
+            return True
+
+        with self.model_loading_lock:
+            # Checked under the lock so an unload in progress is not missed
+            if self.controller.get_model_status(self.model_alias) != 2:
+                return False
+            self.model_last_used = time.time()
+            self.reset_unload_timer()
+            return True
+
+    def try_load_and_return_status(self):
+        """
+        Load the model if needed and return the resulting status code in one step,
+        so callers branch once instead of re-reading the status afterwards.
+        """
         if not self.dynamic_loading_enabled:
             # If dynamic loading is disabled, model should always be loaded
-            model_status = self.controller.get_model_status(self.model_alias)
-            return model_status == 2  # ModelStatus.LOADED
+            return self.controller.get_model_status(self.model_alias)
+
+        model_status = self.controller.get_model_status(self.model_alias)
+        if model_status == 1:
+            # Another thread is loading it (and holds the lock); don't queue behind it
+            return model_status
 
         with self.model_loading_lock:
             model_status = self.controller.get_model_status(self.model_alias)
@@ -803,41 +1015,63 @@ class Server:
                 # Model is already loaded, update last used time and reset timer
                 self.model_last_used = time.time()
                 self.reset_unload_timer()
-                return True
-
-            elif model_status == 1:  # ModelStatus.LOADING
-                # Model is currently loading, return False to indicate not ready
-                return False
 
             elif model_status == 0:
                 self.server_log(f"[INFO] Loading model {self.model_alias} for query")
-                if self.controller.load_model(self.model_alias):
+                loaded = self.controller.load_model(self.model_alias)
+                self.invalidate_model_status()
+                if loaded:
                     self.model_last_used = time.time()
                     self.reset_unload_timer()
                     self.server_log(
                         f"[SUCCESS] Model {self.model_alias} loaded successfully"
                     )
-                    return True
                 else:
                     self.server_log(f"[ERROR] Failed to load model {self.model_alias}")
-                    return False
+                model_status = self.controller.get_model_status(self.model_alias)
 
-            return False
+            return model_status
+
+    def ensure_model_loaded(self):
+        """
+        Ensure the model is loaded for background work, waiting up to MODEL_LOAD_WAIT
+        seconds if another thread is loading it. Returns True if ready.
+        """
+        model_status = self.try_load_and_return_status()
+        if model_status == 1:  # ModelStatus.LOADING
+            model_status = self.wait_for_model_load(self.MODEL_LOAD_WAIT)
+        return model_status == 2  # ModelStatus.LOADED
+
+    def wait_for_model_load(self, timeout):
+        """
+        Block until the model leaves the loading state or timeout seconds pass,
+        woken by the model's status changes rather than polling. Returns the status.
+        """
+        deadline = time.monotonic() + timeout
+        # Any version differs from None, so this returns the current one at once
+        version = self.controller.wait_for_model_status_change(self.model_alias, None)
+        model_status = self.controller.get_model_status(self.model_alias)
+        while model_status == 1:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            version = self.controller.wait_for_model_status_change(
+                self.model_alias, version, timeout=remaining
+            )
+            model_status = self.controller.get_model_status(self.model_alias)
+        return model_status
 
     def get_dynamic_loading_status(self):
         """Get the current status of dynamic model loading"""
-        model_status = self.controller.get_model_status(self.model_alias)
-        status_names = {0: "unloaded", 1: "loading", 2: "loaded"}
+        model_status = self.get_cached_model_status()
 
         return {
             "enabled": self.dynamic_loading_enabled,
             "unload_timeout_minutes": self.unload_timeout_minutes,
-            "model_status": status_names.get(model_status, "unknown"),
+            "model_status": self.MODEL_STATUS_NAMES.get(model_status, "unknown"),
             "model_last_used": self.model_last_used,
-            "timer_active": self.unload_timer is not None
-            and self.unload_timer.is_alive()
-            if self.unload_timer
-            else False,
+            # unload_timer is only set while an unload is pending
+            "timer_active": self.unload_timer is not None,
         }
 
     def cleanup(self):
@@ -846,13 +1080,15 @@ class Server:
 
         if self.unload_timer:
             self.unload_timer.cancel()
+            self.unload_timer = None
 
         self.stop_scheduler()
 
-        if hasattr(self, "file_watcher"):
+        if self.file_watcher is not None:
             self.stop_watchers()
 
-        if hasattr(self, "log_file") and self.log_file:
-            self.log_file.close()
+        self.server_log("[INFO] Server cleanup completed")
 
-        self.server_log("[INFO] Server cleanup completed")
\ No newline at end of file
+        # Flushes queued records and closes the log file
+        self.log_listener.stop()
+        self.log_listener.handlers[0].close()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import time
+import threading
+
+
+class TTLCache:
+    """Thread-safe bounded mapping whose entries expire after a fixed number of seconds."""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self.entries[key]
+                return None
+
+            return value
+
+    def set(self, key, value):
+        """Store a value, evicting the oldest entry when full."""
+        with self.lock:
+            self.entries.pop(key, None)
+            if len(self.entries) >= self.maxsize:
+                del self.entries[next(iter(self.entries))]
+
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def pop(self, *keys):
+        """Drop the given keys if present."""
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -22,6 +22,7 @@ export const apiEndpoints = {
   searchComplex: `${config.apiBaseUrl}/search_complex`,
   searchPaginated: `${config.apiBaseUrl}/search_paginated`,
   searchStatus: `${config.apiBaseUrl}/api/search/status`,
+  searchStatusStream: `${config.apiBaseUrl}/api/search/status/stream`,
   modelStatus: `${config.apiBaseUrl}/api/model/status`,
   imageDetails: (hash: string) => `${config.apiBaseUrl}/api/image/${hash}/details`,
   image: (hash: string) => `${config.apiBaseUrl}/image/${hash}`,
@@ -39,13 +39,47 @@ export const useModelStatus = (pollInterval: number = 60000) => {
   useEffect(() => {
     if (!isPolling) return;
 
-    // Initial fetch
-    fetchStatus();
+    let interval: ReturnType<typeof setInterval> | null = null;
+    const startIntervalPolling = () => {
+      if (interval) return;
+      fetchStatus();
+      interval = setInterval(fetchStatus, pollInterval);
+    };
+
+    // Prefer the server-pushed stream, fall back to polling if unavailable
+    if (typeof EventSource === 'undefined') {
+      startIntervalPolling();
+      return () => {
+        if (interval) clearInterval(interval);
+      };
+    }
 
-    // Set up polling
-    const interval = setInterval(fetchStatus, pollInterval);
+    const source = new EventSource(apiEndpoints.searchStatusStream);
+    source.onmessage = (event) => {
+      try {
+        const data = JSON.parse(event.data);
+        if (data.error) {
+          setError(data.error);
+        } else {
+          setStatus(data);
+          setError(null);
+        }
+      } catch (err) {
+        console.warn('Failed to parse model status event:', err);
+      }
+    };
+    source.onerror = () => {
+      // The server closes streams periodically and the browser reconnects on
+      // its own; only fall back to polling once it has given up
+      if (source.readyState === EventSource.CLOSED) {
+        startIntervalPolling();
+      }
+    };
 
-    return () => clearInterval(interval);
+    return () => {
+      source.close();
+      if (interval) clearInterval(interval);
+    };
   }, [fetchStatus, pollInterval, isPolling]);
 
   const startPolling = useCallback(() => {